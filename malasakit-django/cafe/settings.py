@@ -180,3 +180,55 @@ STATIC_ROOT = os.path.join(PROJECT_DIR, 'static')
 if DEBUG:
     STATIC_ROOT = os.path.join(BASE_DIR, 'pcari', 'static')
 STATIC_URL = os.path.join(URL_ROOT, 'static/')
+
+# Caching
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+
+# The cache must be shared between processes in production so that every
+# worker observes invalidations (for instance, of the ratings matrix)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    }
+}
+
+if DEBUG:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+
+# Maximum number of seconds an in-memory ratings matrix is incrementally
+# updated before being rebuilt from scratch
+RATINGS_MATRIX_MAX_AGE = 60*60
+
+# Algorithm used to calculate principal components: 'svd' (exact),
+# 'randomized' (faster for large matrices), or 'covariance' (fastest when there
+# are few questions). See `./manage.py benchmarkpca`.
+PCA_ENGINE = 'svd'
+
+# Whether submitted responses are queued and acknowledged immediately, rather
+# than written during the request. Queued responses are ingested by
+# `./manage.py processresponses`, which should then run as a background worker.
+RESPONSE_QUEUE_ENABLED = False
+
+# Maximum number of rows fetched from the database at once when exporting data
+EXPORT_CHUNK_SIZE = 2000
+
+# Maximum number of quantitative question ratings sent in one page of
+# `/api/fetch/question-ratings/`
+RATINGS_PAGE_SIZE = 10000
+
+# Unfiltered admin change lists of responses estimate (rather than count) the
+# number of rows in tables with at least this many rows. Where the database
+# keeps no table statistics, an exact count is cached for this many seconds.
+ESTIMATED_COUNT_THRESHOLD = 100000
+ROW_COUNT_CACHE_TIMEOUT = 5*60
+
+# Directory where files produced by export jobs (see `./manage.py runexports`)
+# are stored
+EXPORT_JOB_DIRECTORY = os.path.join(BASE_DIR, 'exports')
+
+# Survey statistics shown on the admin statistics page are cached for this
+# many seconds
+STATISTICS_CACHE_TIMEOUT = 5*60
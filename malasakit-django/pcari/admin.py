@@ -14,21 +14,37 @@ import math
 import os
 
 from django.conf import settings
-from django.shortcuts import redirect, reverse, render
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.http import FileResponse, Http404, HttpResponseBadRequest, JsonResponse
+from django.shortcuts import get_object_or_404, redirect, reverse, render
+from django.utils.functional import cached_property
+from django.utils.html import format_html
 from django.views.decorators.http import require_POST
 from django.conf.urls import url
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin, GroupAdmin
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.models import User, Group
+from django.db.models import Case, Count, F, FloatField, IntegerField, OuterRef
+from django.db.models import Prefetch, Subquery, When
+from django.db.models.functions import Cast, Coalesce, Substr
 
 from pcari.models import QualitativeQuestion, QuantitativeQuestion
 from pcari.models import CommentRating, Comment
 from pcari.models import QuantitativeQuestionRating, Respondent
-from pcari.models import History
+from pcari.models import History, Rating, PCASnapshot, ExportJob, DailyRollup, RowChange
 from pcari.models import get_direct_fields
-from pcari.views import export_data
+from pcari.analysis import RATINGS_MATRIX_MODELS, invalidate_ratings_matrix
+from pcari.analysis import count_new_respondents
+from pcari.exports import PARQUET_SUPPORTED, export_data, get_export_functions
+from pcari.metrics import get_survey_statistics, translate_survey_statistics
+from pcari.payloads import invalidate_question_payloads, invalidate_comments
 
 __all__ = [
+    'estimate_row_count',
+    'EstimatedCountPaginator',
     'MalasakitAdminSite',
     'HistoryAdmin',
     'QuestionAdmin',
@@ -39,8 +55,105 @@ __all__ = [
     'CommentAdmin',
     'CommentRatingAdmin',
     'RespondentAdmin',
+    'ExportJobAdmin',
+    'DailyRollupAdmin',
 ]
 
+DEFAULT_ESTIMATED_COUNT_THRESHOLD = 100000  # Smaller tables are counted exactly
+DEFAULT_ROW_COUNT_CACHE_TIMEOUT = 5*60
+EXACT_COUNT_VAR = 'exact-count'  # Query parameter for requesting an exact count
+
+
+def estimate_row_count(model, using='default'):
+    """
+    Estimate the number of rows in a model's table from the statistics the
+    database maintains for its query planner, which costs no table scan.
+
+    Args:
+        model: The model whose table to estimate the size of.
+        using (str): The database alias.
+
+    Returns:
+        int: The estimated number of rows, or `None` if the database does not
+        provide an estimate (as is the case for SQLite) or has not yet
+        gathered statistics on the table.
+    """
+    connection = connections[using]
+    table_name = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        query = 'SELECT reltuples FROM pg_class WHERE relname = %s'
+    elif connection.vendor == 'mysql':
+        query = ('SELECT table_rows FROM information_schema.tables '
+                 'WHERE table_schema = DATABASE() AND table_name = %s')
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(query, [table_name])
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    An ``EstimatedCountPaginator`` avoids counting every row of a large table
+    when paginating an unfiltered ``QuerySet``.
+
+    Instead, the count is estimated from the database's table statistics (see
+    :func:`estimate_row_count`) or, if there are none, taken from an exact
+    count cached for ``ROW_COUNT_CACHE_TIMEOUT`` seconds. Estimates are only
+    used for tables with at least ``ESTIMATED_COUNT_THRESHOLD`` rows, which
+    are slow to count and for which a slightly wrong count does not matter.
+    Filtered ``QuerySet`` objects are always counted exactly.
+
+    Attributes:
+        exact (bool): Whether to always count exactly.
+        estimated (bool): Whether :attr:`count` is an estimate.
+    """
+    def __init__(self, *args, **kwargs):
+        self.exact = kwargs.pop('exact', False)
+        self.estimated = False
+        super(EstimatedCountPaginator, self).__init__(*args, **kwargs)
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query') or queryset.query.where:
+            return super(EstimatedCountPaginator, self).count
+
+        model = queryset.model
+        key = 'pcari:row-count:{0}'.format(model._meta.label)
+        threshold = getattr(settings, 'ESTIMATED_COUNT_THRESHOLD',
+                            DEFAULT_ESTIMATED_COUNT_THRESHOLD)
+        if not self.exact:
+            estimate = estimate_row_count(model, queryset.db)
+            if estimate is None:
+                estimate = cache.get(key)
+            if estimate is not None and estimate >= threshold:
+                self.estimated = True
+                return estimate
+
+        count = super(EstimatedCountPaginator, self).count
+        cache.set(key, count, timeout=getattr(settings, 'ROW_COUNT_CACHE_TIMEOUT',
+                                              DEFAULT_ROW_COUNT_CACHE_TIMEOUT))
+        return count
+
+
+class EstimatedCountChangeList(ChangeList):
+    """
+    A change list that accepts a query parameter requesting an exact count
+    from an :class:`EstimatedCountPaginator`.
+    """
+    def __init__(self, request, *args, **kwargs):
+        super(EstimatedCountChangeList, self).__init__(request, *args, **kwargs)
+        self.exact_count_url = self.get_query_string({EXACT_COUNT_VAR: 1})
+
+    def get_filters_params(self, params=None):
+        lookup_params = super(EstimatedCountChangeList, self).get_filters_params(params)
+        lookup_params.pop(EXACT_COUNT_VAR, None)
+        return lookup_params
+
 
 class MalasakitAdminSite(admin.AdminSite):
     """
@@ -56,8 +169,12 @@ class MalasakitAdminSite(admin.AdminSite):
                 name='configuration'),
             url(r'^statistics/$', self.admin_view(self.statistics),
                 name='statistics'),
+            url(r'^statistics-data/$', self.admin_view(self.statistics_data),
+                name='statistics-data'),
             url(r'^change-bloom-icon/$', self.admin_view(require_POST(self.change_bloom_icon)),
                 name='change-bloom-icon'),
+            url(r'^export-survey/$', self.admin_view(require_POST(self.export_survey)),
+                name='export-survey'),
         ]
         return urls
 
@@ -67,12 +184,29 @@ class MalasakitAdminSite(admin.AdminSite):
         if 'messages' in request.session:
             context['messages'] = request.session['messages']
             del request.session['messages']
+
+        snapshot = PCASnapshot.objects.defer('_data').order_by('-version').first()
+        if snapshot is not None:
+            context['pca_snapshot'] = snapshot
+            context['pca_snapshot_new_respondents'] = count_new_respondents(snapshot)
         return render(request, 'admin/configuration.html', context)
 
     def statistics(self, request):
         """ Render a statistics page. """
         return render(request, 'admin/statistics.html', self.each_context(request))
 
+    def statistics_data(self, request):
+        """
+        Serve the survey statistics shown on the statistics page as JSON.
+
+        The statistics are computed by :func:`pcari.metrics.get_survey_statistics`
+        and cached, unless the ``refresh`` query parameter is given. Question
+        prompts are translated into the active language.
+        """
+        # pylint: disable=no-self-use
+        statistics = get_survey_statistics(refresh='refresh' in request.GET)
+        return JsonResponse(translate_survey_statistics(statistics))
+
     def change_bloom_icon(self, request):
         """ Save an image file of a custom bloom icon. """
         # pylint: disable=no-self-use
@@ -95,6 +229,22 @@ class MalasakitAdminSite(admin.AdminSite):
         request.session['messages'] = ['Successfully uploaded bloom icon.']
         return redirect(reverse('admin:configuration'))
 
+    def export_survey(self, request):
+        """
+        Request an export job that writes every survey model as a zip archive
+        (see ``exportsurvey``), which can be downloaded from the export jobs
+        page once the ``runexports`` command has produced it.
+        """
+        # pylint: disable=no-self-use
+        data_format = request.POST.get('format', 'csv')
+        if data_format not in get_export_functions():
+            return HttpResponseBadRequest('no such data format "{0}"'.format(data_format))
+        job = ExportJob.objects.create(model_label=ExportJob.SURVEY_LABEL,
+                                       data_format=data_format)
+        messages.info(request, '{0} queued. The archive can be downloaded here once '
+                      'it is ready.'.format(job))
+        return redirect(reverse('admin:pcari_exportjob_changelist'))
+
     def filter_actions(self, model, action_names=None):
         """
         Restrict the actions a model admin may take.
@@ -138,12 +288,18 @@ class HistoryAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         if change and issubclass(obj.__class__, History):
             old_instance = obj.__class__.objects.get(id=obj.id)
-            if set(obj.diff(old_instance)) - {'active'}:
+            # Non-editable fields (like stored statistics) may change between
+            # loading and saving the form, which should not create a revision
+            editable_fields = {field.name for field in get_direct_fields(obj.__class__)
+                               if field.editable}
+            if (set(obj.diff(old_instance)) & editable_fields) - {'active'}:
                 obj = obj.make_copy()
                 obj.predecessor = old_instance
                 old_instance.active, obj.active = False, True
                 old_instance.save()
         super(HistoryAdmin, self).save_model(request, obj, form, change)
+        if change and issubclass(self.model, RATINGS_MATRIX_MODELS):
+            invalidate_ratings_matrix()
 
     def get_readonly_fields(self, request, obj=None):
         model = obj.__class__
@@ -155,14 +311,28 @@ class HistoryAdmin(admin.ModelAdmin):
 
     def mark_active(self, request, queryset):
         """ Mark selected instances as active in bulk. """
+        RowChange.record(self.model, queryset.values_list('pk', flat=True))
         num_marked = queryset.update(active=True)
+        if issubclass(self.model, RATINGS_MATRIX_MODELS):
+            invalidate_ratings_matrix()
+        if issubclass(self.model, Comment):
+            invalidate_comments()
+        if issubclass(self.model, (QualitativeQuestion, QuantitativeQuestion)):
+            invalidate_question_payloads()
         message = '{0} row{1} successfully marked as active.'
         message = message.format(num_marked, 's' if num_marked != 1 else '')
         self.message_user(request, message)
 
     def mark_inactive(self, request, queryset):
         """ Mark selected instances as inactive in bulk. """
+        RowChange.record(self.model, queryset.values_list('pk', flat=True))
         num_marked = queryset.update(active=False)
+        if issubclass(self.model, RATINGS_MATRIX_MODELS):
+            invalidate_ratings_matrix()
+        if issubclass(self.model, Comment):
+            invalidate_comments()
+        if issubclass(self.model, (QualitativeQuestion, QuantitativeQuestion)):
+            invalidate_question_payloads()
         message = '{0} row{1} successfully marked as inactive.'
         message = message.format(num_marked, 's' if num_marked != 1 else '')
         self.message_user(request, message)
@@ -181,6 +351,18 @@ class ResponseAdmin(HistoryAdmin):
     # Sets default ordering to be most recent comment first
     ordering = ('-timestamp',)
 
+    # Response tables grow large, so avoid counting every row on each page
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page,
+                              exact=EXACT_COUNT_VAR in request.GET)
+
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
+
 
 @admin.register(CommentRating, site=site)
 class CommentRatingAdmin(ResponseAdmin):
@@ -222,15 +404,37 @@ class CommentAdmin(ResponseAdmin):
 
     def display_mean_score(self, comment):
         # pylint: disable=no-self-use
-        mean_score = comment.mean_score
-        return str(round(mean_score, 3)) if not math.isnan(mean_score) else '(No ratings)'
+        mean_score = comment.mean_score_annotation
+        return str(round(mean_score, 3)) if mean_score is not None else '(No ratings)'
     display_mean_score.short_description = 'Mean score'
+    display_mean_score.admin_order_field = 'mean_score_annotation'
+
+    def display_num_ratings(self, comment):
+        # pylint: disable=no-self-use,protected-access
+        return comment._num_scores
+    display_num_ratings.short_description = 'Number of ratings'
+    display_num_ratings.admin_order_field = '_num_scores'
+
+    def get_queryset(self, request):
+        """
+        Compute the mean score of each comment from its stored score
+        aggregates (see :class:`pcari.models.StatisticsMixin`) in the same
+        query that fetches the comments, so it can be displayed and sorted by
+        without a query per row.
+        """
+        queryset = super(CommentAdmin, self).get_queryset(request)
+        mean_score = Cast(F('_score_sum'), FloatField())/F('_num_scores')
+        return queryset.annotate(mean_score_annotation=Case(
+            When(_num_scores__gt=0, then=mean_score),
+            default=None,
+            output_field=FloatField(),
+        ))
 
     # Columns to display in the Comment change list page, in order from left to
     # right
     list_display = ('respondent', 'display_message', 'timestamp', 'language',
                     'flagged', 'tag', 'active', 'display_mean_score',
-                    'num_ratings')
+                    'display_num_ratings')
 
     # By default first column listed in list_display is clickable; this makes
     # `message` column clickable
@@ -249,6 +453,7 @@ class CommentAdmin(ResponseAdmin):
         Flag selected comments in bulk and inform the user how many were flagged.
         """
         num_flagged = queryset.update(flagged=True)
+        invalidate_comments()
         message = '{0} comment{1} successfully flagged.'
         message = message.format(num_flagged, 's' if num_flagged != 1 else '')
         self.message_user(request, message)
@@ -258,6 +463,7 @@ class CommentAdmin(ResponseAdmin):
         Unflag selected comments in bulk and inform how many were unflagged.
         """
         num_unflagged = queryset.update(flagged=False)
+        invalidate_comments()
         message = '{0} comment{1} successfully unflagged.'
         message = message.format(num_unflagged, 's' if num_unflagged != 1 else '')
         self.message_user(request, message)
@@ -343,8 +549,60 @@ class RespondentAdmin(HistoryAdmin):
 
     def comments_made(self, respondent):
         # pylint: disable=no-self-use
-        comments = list(respondent.comments)
-        return '(No comments)' if not comments else ''.join(map(str, comments))
+        # Only an excerpt of each message is prefetched (see `get_queryset`)
+        comments = respondent.comment_set.all()
+        descriptions = [Comment.describe(comment.id, comment.message_excerpt)
+                        for comment in comments]
+        return '(No comments)' if not comments else ''.join(descriptions)
+    comments_made.admin_order_field = 'num_comments_annotation'
+
+    def display_num_questions_rated(self, respondent):
+        # pylint: disable=no-self-use
+        return respondent.num_questions_rated_annotation
+    display_num_questions_rated.short_description = 'Number of questions rated'
+    display_num_questions_rated.admin_order_field = 'num_questions_rated_annotation'
+
+    def display_num_comments_rated(self, respondent):
+        # pylint: disable=no-self-use
+        return respondent.num_comments_rated_annotation
+    display_num_comments_rated.short_description = 'Number of comments rated'
+    display_num_comments_rated.admin_order_field = 'num_comments_rated_annotation'
+
+    @staticmethod
+    def count_related(model, exclude_scores=()):
+        """
+        Make an expression that counts the instances of a model belonging to
+        each respondent, as a correlated subquery. (Unlike joins, subqueries
+        for different models do not multiply each other's rows.)
+        """
+        related = model.objects.filter(respondent=OuterRef('pk'))
+        if exclude_scores:
+            related = related.exclude(score__in=exclude_scores)
+        related = related.order_by().values('respondent').annotate(count=Count('pk'))
+        return Coalesce(Subquery(related.values('count'), output_field=IntegerField()), 0)
+
+    def get_queryset(self, request):
+        """
+        Count each respondent's comments and ratings in the same query that
+        fetches the respondents, so they can be displayed and sorted by
+        without queries per row.
+
+        Comments are prefetched for every listed respondent with one more
+        query. Only the excerpt of each message that ``Comment.describe``
+        displays is fetched, rather than entire messages.
+        """
+        queryset = super(RespondentAdmin, self).get_queryset(request)
+        unrated = [Rating.NOT_RATED, Rating.SKIPPED]
+        excerpt_length = Comment.MAX_COMMENT_DISPLAY_LEN + 1  # To detect truncation
+        comments = Comment.objects.only('id', 'respondent').order_by('id')
+        comments = comments.annotate(message_excerpt=Substr('message', 1, excerpt_length))
+        queryset = queryset.prefetch_related(Prefetch('comment_set', queryset=comments))
+        return queryset.annotate(
+            num_comments_annotation=self.count_related(Comment),
+            num_questions_rated_annotation=self.count_related(QuantitativeQuestionRating,
+                                                              unrated),
+            num_comments_rated_annotation=self.count_related(CommentRating, unrated),
+        )
 
     # Empty responses (recorded as None) will be replaced by this placeholder
     empty_value_display = '(Empty)'
@@ -356,7 +614,8 @@ class RespondentAdmin(HistoryAdmin):
     # right
     list_display = ('id', 'comments_made', 'age', 'gender', 'display_location',
                     'language', 'submitted_personal_data', 'completed_survey',
-                    'num_questions_rated', 'num_comments_rated', 'active')
+                    'display_num_questions_rated', 'display_num_comments_rated',
+                    'active')
 
     # Specify which columns we want filtering capabilities for
     list_filter = ('gender', 'language', 'submitted_personal_data',
@@ -383,3 +642,146 @@ def export_selected_as_xlsx(modeladmin, request, queryset):
 
 export_selected_as_xlsx.short_description = 'Export selected rows as an Excel spreadsheet'
 site.add_action(export_selected_as_xlsx)
+
+
+def export_selected_as_npz(modeladmin, request, queryset):
+    """ Export the selected model instances as NumPy arrays (one per column). """
+    # pylint: disable=unused-argument
+    return export_data(queryset, 'npz')
+
+export_selected_as_npz.short_description = 'Export selected rows as NumPy arrays (.npz)'
+site.add_action(export_selected_as_npz)
+
+
+def export_selected_as_parquet(modeladmin, request, queryset):
+    """ Export the selected model instances as an Apache Parquet file. """
+    # pylint: disable=unused-argument
+    return export_data(queryset, 'parquet')
+
+export_selected_as_parquet.short_description = 'Export selected rows as Parquet'
+if PARQUET_SUPPORTED:
+    site.add_action(export_selected_as_parquet)
+
+
+def export_selected_in_background(modeladmin, request, queryset, data_format):
+    """ Request an export job for the selected model instances. """
+    # The change list ``QuerySet`` may carry annotations and prefetches (see
+    # ``RespondentAdmin.get_queryset``), which exports do not need
+    if queryset.query.has_filters():
+        queryset = queryset.model.objects.filter(pk__in=queryset.values('pk'))
+    else:
+        queryset = queryset.model.objects.all()
+    job = ExportJob(data_format=data_format)
+    job.queryset = queryset
+    job.save()
+    link = format_html('<a href="{0}">export jobs</a>',
+                       reverse('admin:pcari_exportjob_changelist'))
+    message = format_html('{0} queued. Check the {1} page for progress and a '
+                          'download link once the file is ready.', job, link)
+    modeladmin.message_user(request, message)
+
+
+def export_selected_in_background_as_csv(modeladmin, request, queryset):
+    """ Export the selected model instances as CSV in the background. """
+    export_selected_in_background(modeladmin, request, queryset, 'csv')
+
+export_selected_in_background_as_csv.short_description = \
+    'Export selected rows as CSV in the background'
+site.add_action(export_selected_in_background_as_csv)
+
+
+def export_selected_in_background_as_xlsx(modeladmin, request, queryset):
+    """ Export the selected model instances as a spreadsheet in the background. """
+    export_selected_in_background(modeladmin, request, queryset, 'xlsx')
+
+export_selected_in_background_as_xlsx.short_description = \
+    'Export selected rows as an Excel spreadsheet in the background'
+site.add_action(export_selected_in_background_as_xlsx)
+
+
+@admin.register(ExportJob, site=site)
+class ExportJobAdmin(admin.ModelAdmin):
+    """
+    Admin behavior for :class:`pcari.models.ExportJob`.
+
+    Jobs are created with the background export actions (or from the
+    configuration page, for the whole survey) and run by the ``runexports``
+    command, so they cannot be added or edited here.
+    """
+    def display_progress(self, job):
+        # pylint: disable=no-self-use
+        return '{0} / {1}'.format(job.rows_processed, job.rows_total or '?')
+    display_progress.short_description = 'Rows'
+
+    def display_throughput(self, job):
+        # pylint: disable=no-self-use
+        throughput = job.throughput
+        return '{0:.0f} rows/second'.format(throughput) if throughput is not None else '-'
+    display_throughput.short_description = 'Throughput'
+
+    def download_link(self, job):
+        # pylint: disable=no-self-use
+        if job.status != ExportJob.COMPLETED:
+            return '-'
+        url = reverse('admin:pcari_exportjob_download', args=(job.id, ))
+        return format_html('<a href="{0}">{1}</a>', url, job.filename)
+    download_link.short_description = 'Download'
+
+    list_display = ('id', 'model_label', 'data_format', 'status', 'display_progress',
+                    'display_throughput', 'created', 'finished', 'download_link')
+    list_filter = ('status', 'data_format', 'model_label')
+    readonly_fields = ('model_label', 'data_format', 'status', 'created', 'started',
+                       'finished', 'updated', 'rows_total', 'rows_processed',
+                       'display_throughput', 'download_link', 'error')
+    exclude = ('last_primary_key', 'bytes_written', 'filename')
+    ordering = ('-created', )
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        urls = super(ExportJobAdmin, self).get_urls()
+        return [
+            url(r'^(?P<job_id>\d+)/download/$', self.admin_site.admin_view(self.download),
+                name='pcari_exportjob_download'),
+        ] + urls
+
+    def download(self, request, job_id):
+        """ Send the file produced by a completed export job. """
+        # pylint: disable=unused-argument,no-self-use
+        job = get_object_or_404(ExportJob, id=job_id, status=ExportJob.COMPLETED)
+        if not os.path.exists(job.path):
+            raise Http404('The exported file no longer exists')
+        response = FileResponse(open(job.path, 'rb'),
+                                content_type='application/octet-stream')
+        response['Content-Disposition'] = 'attachment; filename="{0}"'.format(job.filename)
+        return response
+
+site.filter_actions(ExportJob, ['delete_selected'])
+
+
+@admin.register(DailyRollup, site=site)
+class DailyRollupAdmin(admin.ModelAdmin):
+    """
+    Admin behavior for :class:`pcari.models.DailyRollup`.
+
+    Rollups are computed by the ``rollupmetrics`` command, so they cannot be
+    added or edited here, but they can be browsed by day and exported.
+    """
+    def display_mean_score(self, rollup):
+        # pylint: disable=no-self-use
+        mean_score = rollup.mean_score
+        return round(mean_score, 3) if not math.isnan(mean_score) else '-'
+    display_mean_score.short_description = 'Mean score'
+
+    list_display = ('date', 'question', 'language', 'num_respondents', 'num_ratings',
+                    'display_mean_score', 'updated')
+    list_filter = ('language', 'question')
+    list_select_related = ('question', )
+    date_hierarchy = 'date'
+    ordering = ('-date', 'question', 'language')
+    readonly_fields = ('date', 'question', 'language', 'num_respondents', 'num_ratings',
+                       'score_sum', 'score_squared_sum', 'display_mean_score', 'updated')
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,428 @@
+"""
+This module defines the numerical machinery behind the bloom visualization.
+
+Computing the ratings matrix from scratch requires scanning every active
+quantitative question rating, which becomes the dominant cost of serving
+comments as the number of respondents grows. Instead, a
+:class:`RatingsMatrixStore` keeps the matrix in memory and folds in only the
+rows written since it was last synchronized.
+
+Similarly, the principal components barely move between consecutive
+submissions, so they are computed periodically (see the ``updatepca`` command)
+and persisted as :class:`pcari.models.PCASnapshot` instances, which a
+:class:`PCASnapshotCache` serves from memory.
+
+The components themselves are computed by one of the engines in
+:data:`PCA_ENGINES`, selected with the ``PCA_ENGINE`` setting. Only the top
+few components are ever used, so for large matrices a randomized SVD is much
+cheaper than a full one. When there are few questions (so the matrix is tall
+and narrow), diagonalizing the small covariance matrix is cheaper still. Run
+``./manage.py benchmarkpca`` to compare the engines.
+
+References:
+  * `Halko, Martinsson, and Tropp, "Finding Structure with Randomness"
+    <https://arxiv.org/abs/0909.4061>`_
+
+  * `Django Cache Framework <https://docs.djangoproject.com/en/dev/topics/cache/>`_
+"""
+
+from __future__ import division, unicode_literals
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Max
+import numpy as np
+
+from pcari.models import Respondent, QuantitativeQuestion, QuantitativeQuestionRating
+from pcari.models import PCASnapshot
+
+__all__ = [
+    'RatingsMatrixStore',
+    'invalidate_ratings_matrix',
+    'PCASnapshotCache',
+    'project_ratings',
+    'count_new_respondents',
+    'full_svd_components',
+    'randomized_svd_components',
+    'covariance_components',
+    'get_pca_engine',
+]
+
+# Models whose existing instances determine the contents of the ratings matrix
+RATINGS_MATRIX_MODELS = (Respondent, QuantitativeQuestion, QuantitativeQuestionRating)
+
+LOGGER = logging.getLogger('pcari')
+
+RATINGS_MATRIX_GENERATION_KEY = 'pcari:ratings-matrix-generation'
+DEFAULT_RATINGS_MATRIX_MAX_AGE = 60*60  # Seconds between full rebuilds
+DEFAULT_PCA_ENGINE = 'svd'
+
+
+def get_ratings_matrix_generation():
+    """
+    Get the generation number of the ratings matrix shared by all processes.
+
+    Returns:
+        int: A counter that is incremented every time the ratings matrix should
+        be rebuilt from scratch.
+    """
+    cache.add(RATINGS_MATRIX_GENERATION_KEY, 0, timeout=None)
+    return cache.get(RATINGS_MATRIX_GENERATION_KEY, 0)
+
+
+def invalidate_ratings_matrix():
+    """
+    Force every process to rebuild its ratings matrix on the next read.
+
+    This should be called whenever an existing respondent, quantitative
+    question, or quantitative question rating changes in a way the store
+    cannot observe by looking at new rows alone (for example, toggling the
+    ``active`` flag or deleting an instance).
+    """
+    cache.add(RATINGS_MATRIX_GENERATION_KEY, 0, timeout=None)
+    try:
+        cache.incr(RATINGS_MATRIX_GENERATION_KEY)
+    except ValueError:
+        cache.set(RATINGS_MATRIX_GENERATION_KEY, 1, timeout=None)
+    LOGGER.log(logging.DEBUG, 'Invalidated ratings matrix')
+
+
+class RatingsMatrixStore(object):
+    """
+    A ``RatingsMatrixStore`` maintains a ratings matrix in memory and keeps it
+    consistent with the database incrementally.
+
+    Rows for new respondents and ratings with identifiers greater than the
+    store's high-water marks are folded in on each read, which costs two
+    indexed range queries regardless of how many respondents exist. The store
+    rebuilds the matrix from scratch (with the ``build`` function) when:
+
+        * It has never been built in this process.
+        * The shared generation number (see :func:`invalidate_ratings_matrix`)
+          has changed since the last build. Because the generation lives in the
+          Django cache, every process sharing that cache observes it.
+        * A new rating references a question the matrix has no column for.
+        * The matrix is older than ``max_age`` seconds, which bounds the
+          effect of rows committed out of primary key order.
+
+    Attributes:
+        build: A callable with the same contract as
+            :func:`pcari.views.generate_ratings_matrix`.
+        max_age (float): The maximum number of seconds between full rebuilds.
+    """
+    GROWTH_FACTOR = 2
+
+    def __init__(self, build, max_age=None):
+        self.build = build
+        if max_age is None:
+            max_age = getattr(settings, 'RATINGS_MATRIX_MAX_AGE',
+                              DEFAULT_RATINGS_MATRIX_MAX_AGE)
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        """ Discard the matrix so the next read rebuilds it. """
+        with self.lock:
+            self.generation = None
+            self.built_at = None
+            self.respondent_id_map, self.question_id_map = {}, {}
+            self.buffer = np.full((0, 0), np.nan)
+            self.num_rows = 0
+            self.last_respondent_id = self.last_rating_id = 0
+
+    @property
+    def ratings_matrix(self):
+        return self.buffer[:self.num_rows]
+
+    def rebuild(self, generation):
+        """ Build the matrix from scratch and record the high-water marks. """
+        # The marks are read before building, so rows inserted while the
+        # matrix is being built are folded in (again) by the next sync
+        last_respondent_id = Respondent.objects.aggregate(Max('id'))['id__max']
+        last_rating_id = QuantitativeQuestionRating.objects.aggregate(Max('id'))['id__max']
+
+        respondent_id_map, question_id_map, ratings_matrix = self.build()
+        self.respondent_id_map = dict(respondent_id_map)
+        self.question_id_map = dict(question_id_map)
+        self.buffer, self.num_rows = ratings_matrix, ratings_matrix.shape[0]
+        self.last_respondent_id = last_respondent_id or 0
+        self.last_rating_id = last_rating_id or 0
+        self.generation, self.built_at = generation, time.time()
+        LOGGER.log(logging.DEBUG, 'Rebuilt %d by %d ratings matrix',
+                   *ratings_matrix.shape)
+
+    def add_rows(self, respondent_ids):
+        """ Append rows of missing values for the given respondents. """
+        respondent_ids = [respondent_id for respondent_id in respondent_ids
+                          if respondent_id not in self.respondent_id_map]
+        if not respondent_ids:
+            return
+
+        num_rows = self.num_rows + len(respondent_ids)
+        capacity, num_columns = self.buffer.shape
+        if num_rows > capacity:
+            capacity = max(num_rows, self.GROWTH_FACTOR*capacity)
+            buffer = np.full((capacity, num_columns), np.nan)
+            buffer[:self.num_rows] = self.buffer[:self.num_rows]
+            self.buffer = buffer
+
+        for respondent_id in respondent_ids:
+            self.respondent_id_map[respondent_id] = self.num_rows
+            self.num_rows += 1
+
+    def sync(self):
+        """
+        Fold in respondents and ratings created since the last sync.
+
+        Returns:
+            bool: ``False`` if the new rows could not be applied incrementally
+            (in which case the matrix must be rebuilt), ``True`` otherwise.
+        """
+        respondents = Respondent.objects.filter(active=True,
+                                                id__gt=self.last_respondent_id)
+        respondent_ids = list(respondents.order_by('id').values_list('id', flat=True))
+
+        ratings = QuantitativeQuestionRating.objects.filter(
+            id__gt=self.last_rating_id,
+            respondent__active=True,
+            question__active=True,
+            active=True,
+        )
+        excluded = [QuantitativeQuestionRating.SKIPPED,
+                    QuantitativeQuestionRating.NOT_RATED]
+        features = 'id', 'respondent_id', 'question_id', 'score'
+        ratings = list(ratings.exclude(score__in=excluded).values_list(*features))
+
+        if any(question_id not in self.question_id_map
+               for _, _, question_id, _ in ratings):
+            return False
+
+        self.add_rows(respondent_ids)
+        self.add_rows(respondent_id for _, respondent_id, _, _ in ratings)
+        for _, respondent_id, question_id, score in ratings:
+            row_index = self.respondent_id_map[respondent_id]
+            column_index = self.question_id_map[question_id]
+            self.buffer[row_index, column_index] = score
+
+        if respondent_ids:
+            self.last_respondent_id = max(self.last_respondent_id, respondent_ids[-1])
+        if ratings:
+            self.last_rating_id = max(self.last_rating_id,
+                                      max(rating_id for rating_id, _, _, _ in ratings))
+        return True
+
+    def get(self):
+        """
+        Get an up-to-date ratings matrix.
+
+        Returns:
+            tuple: The same tuple :func:`pcari.views.generate_ratings_matrix`
+            returns. The returned objects are shared, and must not be mutated
+            by the caller.
+        """
+        with self.lock:
+            generation = get_ratings_matrix_generation()
+            expired = (self.built_at is None
+                       or time.time() - self.built_at > self.max_age)
+            if generation != self.generation or expired or not self.sync():
+                self.rebuild(generation)
+            return self.respondent_id_map, self.question_id_map, self.ratings_matrix
+
+
+def project_ratings(arrays, question_id_map, ratings):
+    """
+    Project raw ratings onto the principal components of a snapshot.
+
+    Args:
+        arrays (dict): The arrays of a :class:`pcari.models.PCASnapshot`.
+        question_id_map (dict): A map from question identifiers to the column
+            indices of ``ratings``.
+        ratings (numpy.ndarray): A `k` by `n'` matrix of ratings, which may
+            contain ``np.nan``. The columns need not match the snapshot's.
+
+    Returns:
+        numpy.ndarray: A `k` by `p` matrix of projections. Questions the
+        snapshot has no column for are ignored.
+    """
+    question_ids = arrays['question_ids']
+    aligned = np.full((ratings.shape[0], len(question_ids)), np.nan)
+    for snapshot_index, question_id in enumerate(question_ids):
+        column_index = question_id_map.get(question_id)
+        if column_index is not None:
+            aligned[:, snapshot_index] = ratings[:, column_index]
+    normalized = np.nan_to_num(aligned - arrays['column_means'])
+    return normalized.dot(arrays['components'].T)
+
+
+def count_new_respondents(snapshot):
+    """ Count the active respondents a snapshot does not account for. """
+    respondents = Respondent.objects.filter(active=True,
+                                            id__gt=snapshot.last_respondent_id)
+    return respondents.count()
+
+
+class PCASnapshotCache(object):
+    """
+    A ``PCASnapshotCache`` holds the latest :class:`pcari.models.PCASnapshot`
+    in memory, along with its unserialized arrays.
+
+    Checking for a newer snapshot costs one query over the primary key index;
+    the serialized arrays are only fetched when the version changes.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot, self.arrays, self.respondent_index_map = None, None, {}
+
+    def get(self):
+        """
+        Get the latest snapshot.
+
+        Returns:
+            tuple: Tuple of three items:
+                * ``snapshot``: The latest :class:`pcari.models.PCASnapshot`,
+                  or `None` if no snapshot exists.
+                * ``arrays`` (`dict`): The snapshot's arrays.
+                * ``respondent_index_map`` (`dict`): A map from respondent
+                  identifiers to row indices of the ``projections`` array.
+        """
+        versions = PCASnapshot.objects.order_by('-version')
+        latest = versions.values_list('version', 'timestamp').first()
+        with self.lock:
+            current = None
+            if self.snapshot is not None:
+                current = self.snapshot.version, self.snapshot.timestamp
+
+            if latest is None:
+                self.snapshot, self.arrays, self.respondent_index_map = None, None, {}
+            elif latest != current:
+                version, _ = latest
+                self.snapshot = PCASnapshot.objects.get(version=version)
+                self.arrays = self.snapshot.arrays
+                self.respondent_index_map = {
+                    respondent_id: index for index, respondent_id
+                    in enumerate(self.arrays['respondent_ids'].tolist())
+                }
+                LOGGER.log(logging.DEBUG, 'Loaded %s', self.snapshot)
+            return self.snapshot, self.arrays, self.respondent_index_map
+
+
+def full_svd_components(normalized_ratings, num_components):
+    """
+    Calculate principal components from the full thin SVD of a matrix.
+
+    Args:
+        normalized_ratings (numpy.ndarray): An `m` by `n` normalized ratings
+            matrix.
+        num_components (int): The number of principal components to select
+            (`p`).
+
+    Returns:
+        numpy.ndarray: A `p` by `n` matrix whose rows are principal components.
+    """
+    _, _, covariance_matrix = np.linalg.svd(normalized_ratings, full_matrices=False)
+    return covariance_matrix[:num_components]
+
+
+def randomized_svd_components(normalized_ratings, num_components,
+                              num_oversamples=10, num_power_iterations=2,
+                              random_state=None):
+    """
+    Approximate the top principal components of a matrix with a randomized SVD.
+
+    The matrix is multiplied by a random `n` by `k` matrix (where `k` is
+    ``num_components + num_oversamples``) to find an orthonormal basis `Q` that
+    approximately spans the dominant column space. A few power iterations
+    sharpen the basis when singular values decay slowly. The SVD of the small
+    `k` by `n` matrix ``Q.T.dot(normalized_ratings)`` then gives the
+    components. This takes `O(mnk)` time, compared to `O(mn min(m, n))` for
+    the full SVD.
+
+    Args:
+        normalized_ratings (numpy.ndarray): An `m` by `n` normalized ratings
+            matrix.
+        num_components (int): The number of principal components to select
+            (`p`).
+        num_oversamples (int): The number of extra random vectors to sample,
+            which improves accuracy.
+        num_power_iterations (int): The number of power iterations.
+        random_state: A seed for ``numpy.random.RandomState``.
+
+    Returns:
+        numpy.ndarray: A `p` by `n` matrix whose rows are (approximate)
+        principal components.
+    """
+    num_rows, num_columns = normalized_ratings.shape
+    rank = min(num_components + num_oversamples, num_rows, num_columns)
+    random_matrix = np.random.RandomState(random_state).normal(size=(num_columns, rank))
+
+    basis, _ = np.linalg.qr(normalized_ratings.dot(random_matrix))
+    for _ in range(num_power_iterations):
+        # Orthonormalizing between multiplications preserves the accuracy of
+        # the small singular values
+        basis, _ = np.linalg.qr(normalized_ratings.T.dot(basis))
+        basis, _ = np.linalg.qr(normalized_ratings.dot(basis))
+
+    projected = basis.T.dot(normalized_ratings)
+    _, _, covariance_matrix = np.linalg.svd(projected, full_matrices=False)
+    return covariance_matrix[:num_components]
+
+
+def covariance_components(normalized_ratings, num_components):
+    """
+    Calculate principal components from the eigenvectors of the `n` by `n`
+    matrix ``normalized_ratings.T.dot(normalized_ratings)``.
+
+    Forming this matrix takes a single pass over the ratings, after which the
+    eigendecomposition is independent of the number of respondents. Squaring
+    the matrix squares its condition number, so components with very small
+    variance are less accurate than with :func:`full_svd_components`, but the
+    leading components are unaffected in practice.
+
+    Args:
+        normalized_ratings (numpy.ndarray): An `m` by `n` normalized ratings
+            matrix.
+        num_components (int): The number of principal components to select
+            (`p`).
+
+    Returns:
+        numpy.ndarray: A `p` by `n` matrix whose rows are principal components.
+    """
+    num_components = min(num_components, *normalized_ratings.shape)
+    eigenvalues, eigenvectors = np.linalg.eigh(normalized_ratings.T.dot(normalized_ratings))
+    order = np.argsort(eigenvalues)[::-1][:num_components]
+    return eigenvectors[:, order].T
+
+
+PCA_ENGINES = {
+    'svd': full_svd_components,
+    'randomized': randomized_svd_components,
+    'covariance': covariance_components,
+}
+
+
+def get_pca_engine(name=None):
+    """
+    Get a function that calculates principal components.
+
+    Args:
+        name (str): A key of :data:`PCA_ENGINES`. Defaults to the
+            ``PCA_ENGINE`` setting, or ``svd`` if the setting is absent.
+
+    Returns:
+        A callable with the same signature as :func:`full_svd_components`.
+
+    Raises:
+        ImproperlyConfigured: if no such engine exists.
+    """
+    if name is None:
+        name = getattr(settings, 'PCA_ENGINE', DEFAULT_PCA_ENGINE)
+    try:
+        return PCA_ENGINES[name]
+    except KeyError:
+        message = 'no such PCA engine "{0}" (choices: {1})'
+        raise ImproperlyConfigured(message.format(name, ', '.join(sorted(PCA_ENGINES))))
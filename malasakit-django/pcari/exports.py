@@ -0,0 +1,828 @@
+"""
+This module defines how model instances are exported as files for download.
+
+Tables like the quantitative question ratings may hold millions of rows, so
+exporters never load an entire ``QuerySet`` at once. Instead, rows are fetched
+as tuples (not model instances) in chunks of ``EXPORT_CHUNK_SIZE`` (see
+:func:`iterate_export_rows`). Formats that can be written incrementally, like
+CSV, are also streamed to the client as they are generated, so memory usage
+stays flat and the download begins immediately regardless of the size of the
+table.
+
+Exports too large to produce within a request can instead be requested as an
+:class:`pcari.models.ExportJob`, which the ``runexports`` command runs in the
+background (see :func:`run_export_job`). To export the entire survey at once,
+:func:`export_survey` bundles every model into one archive read from a single
+consistent snapshot of the database. Recurring exports (for example, a nightly
+analytics pipeline) should use :func:`export_changes`, which only exports rows
+added or changed since the previous export.
+
+For analysis, the ``npz`` (and, if ``pyarrow`` is installed, ``parquet``)
+formats store each column as a typed array, which is much smaller and faster
+to load than re-parsing text.
+
+References:
+  * `Streaming Large CSV Files <https://docs.djangoproject.com/en/dev/howto/outputting-csv/#streaming-large-csv-files>`_
+"""
+
+from __future__ import unicode_literals
+import contextlib
+import csv
+import datetime
+import io
+import json
+import logging
+import mimetypes
+import operator
+import os
+import tempfile
+import zipfile
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Max, Q
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import timezone
+import numpy as np
+from openpyxl import Workbook
+
+from pcari.models import History, Response, ExportJob, ExportCheckpoint, RowChange
+from pcari.models import Respondent
+from pcari.models import QuantitativeQuestion, QualitativeQuestion
+from pcari.models import OptionQuestion, OptionQuestionChoice
+from pcari.models import Comment, CommentRating, QuantitativeQuestionRating
+from pcari.models import get_concrete_fields
+from pcari.profiling import profile
+
+try:
+    import pyarrow
+    from pyarrow import parquet
+except ImportError:  # Parquet exports are only offered if ``pyarrow`` is installed
+    pyarrow = parquet = None
+
+__all__ = [
+    'iterate_chunks',
+    'iterate_in_chunks',
+    'iterate_export_rows',
+    'generate_csv',
+    'export_csv',
+    'export_excel',
+    'export_npz',
+    'export_parquet',
+    'export_data',
+    'export_survey',
+    'get_changed_rows',
+    'export_changes',
+    'claim_export_job',
+    'run_export_job',
+]
+
+LOGGER = logging.getLogger('pcari')
+
+DEFAULT_EXPORT_CHUNK_SIZE = 2000
+PARQUET_SUPPORTED = parquet is not None
+
+# Models included in a whole-survey export, in the order they are written
+SURVEY_MODELS = (Respondent, QuantitativeQuestion, QualitativeQuestion,
+                 OptionQuestion, OptionQuestionChoice, Comment, CommentRating,
+                 QuantitativeQuestionRating)
+
+
+def get_export_chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', DEFAULT_EXPORT_CHUNK_SIZE)
+
+
+def get_export_fields(model):
+    """
+    List the fields exported for a model, in column order.
+
+    The score aggregates stored by :class:`pcari.models.StatisticsMixin` are
+    internal and excluded, so the exported columns stay those of the survey.
+    """
+    excluded = getattr(model, 'AGGREGATE_FIELD_NAMES', ())
+    return [field for field in get_concrete_fields(model) if field.name not in excluded]
+
+
+def get_export_field_names(model):
+    """ List the names of the columns exported for a model, in order. """
+    return [unicode(field.get_attname()) for field in get_export_fields(model)]
+
+
+def iterate_chunks(queryset, chunk_size=None, key=None):
+    """
+    Fetch the rows of a ``QuerySet`` in order of primary key, at most
+    ``chunk_size`` rows per query.
+
+    Each chunk is selected by filtering on the last primary key seen (rather
+    than with an offset), so fetching a chunk does not become slower the
+    further into the table it lies.
+
+    Args:
+        queryset: A Django ``QuerySet`` to iterate over, which may return
+            instances or (with ``values_list``) tuples. Any existing ordering
+            is replaced.
+        chunk_size (int): The maximum number of rows to fetch at once.
+            Defaults to the ``EXPORT_CHUNK_SIZE`` setting.
+        key: A function that returns the primary key of a row. Defaults to
+            reading the ``pk`` attribute of an instance.
+
+    Yields:
+        list: Nonempty chunks of rows.
+    """
+    if chunk_size is None:
+        chunk_size = get_export_chunk_size()
+    if key is None:
+        key = operator.attrgetter('pk')
+    queryset = queryset.order_by('pk')
+
+    last_primary_key = None
+    while True:
+        chunk = queryset
+        if last_primary_key is not None:
+            chunk = chunk.filter(pk__gt=last_primary_key)
+        chunk = list(chunk[:chunk_size])
+
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            break
+        last_primary_key = key(chunk[-1])
+
+
+def iterate_in_chunks(queryset, chunk_size=None):
+    """
+    Iterate over the instances of a ``QuerySet`` in order of primary key,
+    fetching at most ``chunk_size`` instances per query. (See
+    :func:`iterate_chunks`.)
+    """
+    for chunk in iterate_chunks(queryset, chunk_size):
+        for instance in chunk:
+            yield instance
+
+
+def iterate_export_rows(queryset, field_names, chunk_size=None):
+    """
+    Fetch the values of the given columns as tuples, in chunks. Building
+    tuples is much cheaper than instantiating a model instance per row.
+
+    Args:
+        queryset: A Django ``QuerySet`` of instances to export.
+        field_names (list): The names of the columns to fetch, in order.
+        chunk_size (int): The maximum number of rows to fetch at once.
+
+    Yields:
+        list: Nonempty chunks of tuples, whose values follow the order of
+        ``field_names``.
+    """
+    primary_key_name = queryset.model._meta.pk.attname
+    if primary_key_name in field_names:
+        rows = queryset.values_list(*field_names)
+        key = operator.itemgetter(field_names.index(primary_key_name))
+        for chunk in iterate_chunks(rows, chunk_size, key):
+            yield chunk
+    else:
+        rows = queryset.values_list(primary_key_name, *field_names)
+        for chunk in iterate_chunks(rows, chunk_size, operator.itemgetter(0)):
+            yield [row[1:] for row in chunk]
+
+
+def encode_text(value):
+    return value.encode('utf-8')
+
+
+def encode_other(value):
+    return unicode(value).encode('utf-8')
+
+
+def make_csv_encoder(field):
+    """
+    Choose how the values of a column are converted to UTF-8 encoded text, so
+    that the choice is made once per column rather than once per value.
+
+    Args:
+        field: A Django model field.
+
+    Returns:
+        A function that converts a value of the field to ``bytes``. Missing
+        values (that is, `None`) become empty strings.
+    """
+    if isinstance(field, (models.CharField, models.TextField)):
+        encode = encode_text
+    elif isinstance(field, (models.IntegerField, models.BooleanField,
+                            models.ForeignKey, models.AutoField)):
+        encode = bytes  # Faster than decoding and encoding again
+    else:
+        encode = encode_other
+
+    if field.null:
+        return lambda value: b'' if value is None else encode(value)
+    return encode
+
+
+def write_csv_rows(writer, encoders, rows):
+    """ Encode a chunk of rows one column at a time, then write the rows. """
+    columns = [map(encode, column) for encode, column in zip(encoders, zip(*rows))]
+    writer.writerows(zip(*columns))
+
+
+def generate_csv(queryset):
+    """
+    Generate the given ``QuerySet`` as comma-separated values.
+
+    Rows are fetched as tuples and encoded one column at a time (see
+    :func:`make_csv_encoder`), which avoids inspecting the type of every value
+    and instantiating a model instance per row.
+
+    Args:
+        queryset: A Django ``QuerySet`` of instances to export.
+
+    Yields:
+        bytes: UTF-8 encoded CSV, starting with the header row, then one chunk
+        of rows at a time.
+    """
+    fields = get_export_fields(queryset.model)
+    field_names = get_export_field_names(queryset.model)
+    encoders = [make_csv_encoder(field) for field in fields]
+
+    buffer = io.BytesIO()
+    writer = csv.writer(buffer)
+    writer.writerow([encode_text(field_name) for field_name in field_names])
+
+    for rows in iterate_export_rows(queryset, field_names):
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+        write_csv_rows(writer, encoders, rows)
+    yield buffer.getvalue()
+
+
+@profile
+def export_csv(stream, queryset):
+    """
+    Export the given ``QuerySet`` as comma-separated values to a stream.
+
+    Args:
+        stream: A ``file``-like object with a ``write`` method.
+        queryset: A Django ``QuerySet`` of instances to export.
+
+    Returns:
+        `None`. Has a side effect of writing to the ``stream``.
+    """
+    for data in generate_csv(queryset):
+        stream.write(data)
+
+
+@profile
+def export_excel(stream, queryset, progress=None):
+    """
+    Export the given ``QuerySet`` as an Excel spreadsheet.
+
+    Args:
+        stream: A ``file``-like object with a ``write`` method.
+        queryset: A Django ``QuerySet`` of instances to export.
+        progress: An optional callback that receives the number of rows in
+            each chunk after the chunk is exported.
+
+    Returns:
+        `None`. Has a side effect of writing to the ``stream``.
+    """
+    field_names = get_export_field_names(queryset.model)
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(queryset.model.__name__)
+    worksheet.append(field_names)
+
+    for rows in iterate_export_rows(queryset, field_names):
+        for row in rows:
+            worksheet.append(row)
+        if progress is not None:
+            progress(len(rows))
+
+    workbook.save(stream)
+
+
+def to_naive_utc(value):
+    if value is not None and timezone.is_aware(value):
+        value = timezone.make_naive(value, timezone.utc)
+    return value
+
+
+def make_column_converter(field):
+    """
+    Choose how the values of a column are packed into a typed NumPy array.
+
+    Integers and booleans are stored as ``int64`` and ``bool`` arrays, unless
+    the column may contain missing values, in which case they are stored as
+    ``float64`` with missing values as ``NaN``. Datetimes are stored (in UTC)
+    as ``datetime64[us]`` with missing values as ``NaT``. Everything else is
+    stored as text, with missing values as empty strings.
+
+    Args:
+        field: A Django model field.
+
+    Returns:
+        A function that converts a sequence of values of the field to an
+        array.
+    """
+    if isinstance(field, models.DateTimeField):
+        return lambda column: np.array(map(to_naive_utc, column), dtype='datetime64[us]')
+    elif isinstance(field, (models.IntegerField, models.BooleanField,
+                            models.ForeignKey, models.AutoField, models.FloatField)):
+        if field.null:
+            return lambda column: np.array([np.nan if value is None else value
+                                            for value in column], dtype=np.float64)
+        elif isinstance(field, models.BooleanField):
+            return lambda column: np.array(column, dtype=np.bool_)
+        elif isinstance(field, models.FloatField):
+            return lambda column: np.array(column, dtype=np.float64)
+        return lambda column: np.array(column, dtype=np.int64)
+    elif isinstance(field, (models.CharField, models.TextField)) and not field.null:
+        return lambda column: np.array(column, dtype=np.unicode_)
+    return lambda column: np.array(['' if value is None else unicode(value)
+                                    for value in column], dtype=np.unicode_)
+
+
+def collect_columns(queryset, progress=None):
+    """
+    Fetch the exported columns of a ``QuerySet`` as typed NumPy arrays (see
+    :func:`make_column_converter`).
+
+    Rows are fetched and converted in chunks, so only the compact arrays (and
+    not every row as Python objects) are ever held in memory at once.
+
+    Args:
+        queryset: A Django ``QuerySet`` of instances to export.
+        progress: An optional callback that receives the number of rows in
+            each chunk after the chunk is converted.
+
+    Returns:
+        collections.OrderedDict: A map from column names, in order, to
+        one-dimensional arrays of equal length.
+    """
+    fields = get_export_fields(queryset.model)
+    field_names = get_export_field_names(queryset.model)
+    converters = [make_column_converter(field) for field in fields]
+    chunks = [[converter([]) for converter in converters]]
+
+    for rows in iterate_export_rows(queryset, field_names):
+        chunks.append([converter(column) for converter, column
+                       in zip(converters, zip(*rows))])
+        if progress is not None:
+            progress(len(rows))
+
+    return OrderedDict((field_name, np.concatenate(column_chunks))
+                       for field_name, column_chunks in zip(field_names, zip(*chunks)))
+
+
+@profile
+def export_npz(stream, queryset, progress=None):
+    """
+    Export the given ``QuerySet`` as a NumPy ``.npz`` archive with one typed
+    array per column. Load the archive with ``numpy.load``.
+
+    Args:
+        stream: A ``file``-like object with a ``write`` method.
+        queryset: A Django ``QuerySet`` of instances to export.
+        progress: An optional callback (see :func:`collect_columns`).
+
+    Returns:
+        `None`. Has a side effect of writing to the ``stream``.
+    """
+    # Writing a zip archive requires a seekable file
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **collect_columns(queryset, progress))
+    stream.write(buffer.getvalue())
+
+
+@profile
+def export_parquet(stream, queryset, progress=None):
+    """
+    Export the given ``QuerySet`` as an Apache Parquet file, which can be read
+    with ``pandas.read_parquet``. Requires ``pyarrow``.
+
+    Args:
+        stream: A ``file``-like object with a ``write`` method.
+        queryset: A Django ``QuerySet`` of instances to export.
+        progress: An optional callback (see :func:`collect_columns`).
+
+    Returns:
+        `None`. Has a side effect of writing to the ``stream``.
+    """
+    columns = collect_columns(queryset, progress)
+    table = pyarrow.Table.from_arrays([pyarrow.array(column, from_pandas=True)
+                                       for column in columns.values()],
+                                      names=list(columns))
+    buffer = io.BytesIO()
+    parquet.write_table(table, buffer)
+    stream.write(buffer.getvalue())
+
+
+def get_export_functions():
+    """
+    List the available export formats.
+
+    Returns:
+        dict: A map from format names (which are also file extensions) to
+        functions that take a stream and a ``QuerySet`` and write the export
+        to the stream.
+    """
+    export_functions = {
+        'csv': export_csv,
+        'xlsx': export_excel,
+        'npz': export_npz,
+    }
+    if PARQUET_SUPPORTED:
+        export_functions['parquet'] = export_parquet
+    return export_functions
+
+
+def generate_export_filename(model_name, data_format):
+    now = datetime.datetime.now()
+    return model_name + '-' + now.strftime('%Y-%m-%d') + '.' + data_format
+
+
+@profile
+def export_data(queryset, data_format='csv'):
+    """
+    Create and write data to a response as a file for download.
+
+    Formats that can be generated incrementally are sent as a streaming
+    response, which begins before the export has finished.
+
+    Args:
+        data_format (str): The file format the data should be exported as.
+            Current options are: ``csv`` (default), ``xlsx``, ``npz``, and
+            ``parquet`` (if ``pyarrow`` is installed).
+        queryset: The instances to export.
+
+    Returns:
+        An ``HttpResponse`` (or a ``StreamingHttpResponse``) with the requested
+        data as an attached file, or an ``HttpResponseBadRequest`` with a status
+        code of 400 with an invalid ``data_format``.
+    """
+    export_functions = get_export_functions()
+    streaming_export_functions = {
+        'csv': generate_csv,
+    }
+    try:
+        export = export_functions[data_format]
+    except KeyError:
+        return HttpResponseBadRequest('no such data format "{0}"'.format(data_format))
+
+    model_name = queryset.model.__name__
+    filename = generate_export_filename(model_name, data_format)
+    content_type, _ = mimetypes.guess_type(filename)
+    content_type = content_type or 'application/octet-stream'
+
+    if data_format in streaming_export_functions:
+        generate = streaming_export_functions[data_format]
+        response = StreamingHttpResponse(generate(queryset), content_type=content_type)
+    else:
+        response = HttpResponse(content_type=content_type)
+        export(response, queryset)
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(filename)
+    return response
+
+
+@contextlib.contextmanager
+def snapshot_transaction():
+    """
+    Run a block in a transaction in which every query reads the same snapshot
+    of the database, regardless of concurrent writes.
+
+    SQLite and MySQL transactions already provide this. PostgreSQL's default
+    isolation level (read committed) does not, so the isolation level of the
+    transaction is raised to repeatable read.
+    """
+    in_transaction = connection.in_atomic_block
+    with transaction.atomic():
+        if connection.vendor == 'postgresql' and not in_transaction:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        yield
+
+
+@profile
+def export_survey(stream, data_format='csv', survey_models=SURVEY_MODELS):
+    """
+    Export every survey model as one zip archive.
+
+    The archive contains one file per model (for instance, ``Comment.csv``) and
+    a ``manifest.json`` with the time of the export and the number of rows of
+    each model. All models are read within a single
+    :func:`snapshot_transaction`, so the files are mutually consistent (for
+    instance, every rating refers to an exported respondent). Each model is
+    exported in chunks to a temporary file before being added to the
+    archive, so memory usage does not grow with the size of the survey.
+
+    Args:
+        stream: A seekable ``file``-like object opened for writing.
+        data_format (str): The format of each file in the archive (see
+            :func:`export_data`).
+        survey_models: The models to export.
+
+    Returns:
+        OrderedDict: The manifest written to the archive. Has a side effect of
+        writing to the ``stream``.
+
+    Raises:
+        ValueError: if ``data_format`` is not a valid format.
+    """
+    export_functions = get_export_functions()
+    if data_format not in export_functions:
+        raise ValueError('no such data format "{0}"'.format(data_format))
+    export = export_functions[data_format]
+    # Only text benefits from further compression
+    compression = zipfile.ZIP_DEFLATED if data_format == 'csv' else zipfile.ZIP_STORED
+
+    manifest = OrderedDict([
+        ('exported', timezone.now().isoformat()),
+        ('data_format', data_format),
+        ('num_rows', OrderedDict()),
+    ])
+    with snapshot_transaction(), zipfile.ZipFile(stream, 'w', compression,
+                                                 allowZip64=True) as archive:
+        for model in survey_models:
+            queryset = model.objects.all()
+            model_file = tempfile.NamedTemporaryFile(delete=False)
+            try:
+                with model_file:
+                    export(model_file, queryset)
+                filename = '{0}.{1}'.format(model.__name__, data_format)
+                archive.write(model_file.name, filename)
+            finally:
+                os.remove(model_file.name)
+            manifest['num_rows'][model.__name__] = queryset.count()
+        archive.writestr('manifest.json', json.dumps(manifest, indent=4))
+    return manifest
+
+
+def get_changed_rows(queryset, last_primary_key=None, last_timestamp=None,
+                     last_change_id=None):
+    """
+    Select rows added or changed since the given high-water marks.
+
+    A row is new if its primary key exceeds ``last_primary_key`` or, for
+    :class:`pcari.models.Response` models, if its ``timestamp`` is later than
+    ``last_timestamp`` (which also catches rows whose primary key was
+    allocated before, but committed after, the previous export). Because
+    :class:`pcari.models.History` models are insert-only, editing an instance
+    (see ``HistoryAdmin.save_model``) inserts a successor with a new primary
+    key and deactivates its predecessor, so predecessors of new rows are
+    selected as changed rows. Rows modified in place (for instance, marked as
+    inactive) are selected through the :class:`pcari.models.RowChange` log.
+
+    Args:
+        queryset: The ``QuerySet`` to filter.
+        last_primary_key: The largest primary key previously exported, or
+            `None` to select every row.
+        last_timestamp (datetime.datetime): The latest timestamp previously
+            exported, or `None`.
+        last_change_id: The identifier of the latest ``RowChange`` previously
+            exported, or `None` to select every logged change.
+
+    Returns:
+        A ``QuerySet`` of the new and changed rows.
+    """
+    if last_primary_key is None:
+        return queryset
+    model = queryset.model
+    new_rows = Q(pk__gt=last_primary_key)
+    if issubclass(model, Response) and last_timestamp is not None:
+        new_rows |= Q(timestamp__gt=last_timestamp)
+    changed_rows = new_rows
+    if issubclass(model, History):
+        successors = model.objects.filter(new_rows, predecessor__isnull=False)
+        changed_rows |= Q(pk__in=successors.values('predecessor'))
+    changes = RowChange.objects.filter(model_label=model._meta.label,
+                                       id__gt=last_change_id or 0)
+    changed_rows |= Q(pk__in=changes.values('object_id'))
+    return queryset.filter(changed_rows)
+
+
+@profile
+def export_changes(model, directory, data_format='csv'):
+    """
+    Export rows of a model added or changed since the last export, then
+    advance the model's :class:`pcari.models.ExportCheckpoint`.
+
+    The rows are read and the checkpoint is advanced within one
+    :func:`snapshot_transaction`, so every row is exported at least once even
+    while responses are being submitted. If the export fails, the checkpoint
+    is left unchanged and the next export includes the same rows.
+
+    Args:
+        model: The model to export.
+        directory (str): Where to write the exported file, which is named
+            after the model and the time of the export.
+        data_format (str): The format of the exported file (see
+            :func:`export_data`).
+
+    Returns:
+        A tuple of the path of the exported file (or `None` if no rows have
+        changed, in which case no file is written) and the number of rows
+        exported.
+
+    Raises:
+        ValueError: if ``data_format`` is not a valid format.
+    """
+    export_functions = get_export_functions()
+    if data_format not in export_functions:
+        raise ValueError('no such data format "{0}"'.format(data_format))
+    export = export_functions[data_format]
+
+    with snapshot_transaction():
+        checkpoint, _ = (ExportCheckpoint.objects.select_for_update()
+                         .get_or_create(model_label=model._meta.label))
+        queryset = get_changed_rows(model.objects.all(), checkpoint.last_primary_key,
+                                    checkpoint.last_timestamp, checkpoint.last_change_id)
+        changes = RowChange.objects.filter(model_label=model._meta.label)
+        last_change_id = changes.aggregate(last_change_id=Max('id'))['last_change_id']
+        num_rows = queryset.count()
+        if num_rows == 0:
+            return None, 0
+
+        filename = '{0}-{1}.{2}'.format(model.__name__,
+                                        timezone.now().strftime('%Y%m%d-%H%M%S-%f'),
+                                        data_format)
+        path = os.path.join(directory, filename)
+        partial_path = path + '.partial'
+        try:
+            with open(partial_path, 'wb') as export_file:
+                export(export_file, queryset)
+            os.rename(partial_path, path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+        high_water_marks = {'last_primary_key': Max('pk')}
+        if issubclass(model, Response):
+            high_water_marks['last_timestamp'] = Max('timestamp')
+        for name, value in model.objects.aggregate(**high_water_marks).items():
+            setattr(checkpoint, name, value)
+        if last_change_id is not None:
+            # Exported changes are no longer needed
+            checkpoint.last_change_id = last_change_id
+            changes.filter(id__lte=last_change_id).delete()
+        checkpoint.rows_exported += num_rows
+        checkpoint.save()
+    LOGGER.info('Exported %d changed rows of %s to "%s"', num_rows,
+                model._meta.label, path)
+    return path, num_rows
+
+
+def claim_export_job(stale_after=None):
+    """
+    Claim the oldest pending export job, so that no other worker runs it.
+
+    Args:
+        stale_after (float): If given, a running job that has not made
+            progress in this many seconds is presumed interrupted and may be
+            claimed as well, to be resumed.
+
+    Returns:
+        The claimed ``ExportJob`` (now marked as running), or `None` if there
+        is no job to run.
+    """
+    claimable = Q(status=ExportJob.PENDING)
+    if stale_after is not None:
+        cutoff = timezone.now() - datetime.timedelta(seconds=stale_after)
+        claimable |= Q(status=ExportJob.RUNNING, updated__lt=cutoff)
+
+    for job in ExportJob.objects.filter(claimable).defer('_selection').order_by('created'):
+        # Only succeeds if no other worker has claimed the job in the meantime
+        num_claimed = ExportJob.objects.filter(
+            id=job.id, status=job.status, updated=job.updated,
+        ).update(status=ExportJob.RUNNING, updated=timezone.now())
+        if num_claimed:
+            return ExportJob.objects.get(id=job.id)
+    return None
+
+
+def write_csv_job(job, queryset, chunk_size=None):
+    """
+    Export a ``QuerySet`` as CSV for an export job, recording the job's
+    progress after every chunk. If the job was interrupted, the rows already
+    written are kept and the export resumes after the last of them.
+    """
+    field_names = get_export_field_names(queryset.model)
+    encoders = [make_csv_encoder(field) for field in get_export_fields(queryset.model)]
+    primary_key_index = field_names.index(queryset.model._meta.pk.attname)
+
+    resume = job.bytes_written > 0 and os.path.exists(job.path)
+    with open(job.path, 'r+b' if resume else 'wb') as stream:
+        writer = csv.writer(stream)
+        if resume:
+            # Discard anything written after progress was last recorded
+            stream.seek(job.bytes_written)
+            stream.truncate()
+            queryset = queryset.filter(pk__gt=job.last_primary_key)
+            LOGGER.log(logging.INFO, 'Resuming %s after %d rows', job, job.rows_processed)
+        else:
+            job.rows_processed, job.last_primary_key = 0, None
+            writer.writerow([encode_text(field_name) for field_name in field_names])
+
+        for rows in iterate_export_rows(queryset, field_names, chunk_size):
+            write_csv_rows(writer, encoders, rows)
+            stream.flush()
+            job.rows_processed += len(rows)
+            job.last_primary_key = rows[-1][primary_key_index]
+            job.bytes_written = stream.tell()
+            job.save(update_fields=['rows_processed', 'last_primary_key',
+                                    'bytes_written', 'updated'])
+
+
+def write_export_job(job, queryset):
+    """
+    Export a ``QuerySet`` for an export job in a format that cannot be
+    resumed, recording the job's progress after every chunk. The file is
+    written to a temporary path first, so that an incomplete file is never
+    mistaken for a finished one.
+    """
+    def progress(num_rows):
+        job.rows_processed += num_rows
+        job.save(update_fields=['rows_processed', 'updated'])
+
+    export = get_export_functions()[job.data_format]
+    job.rows_processed = 0
+    partial_path = job.path + '.partial'
+    try:
+        with open(partial_path, 'wb') as stream:
+            export(stream, queryset, progress=progress)
+        os.rename(partial_path, job.path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+def write_survey_job(job):
+    """
+    Export every survey model as one zip archive for an export job (see
+    :func:`export_survey`). Like :func:`write_export_job`, the archive is
+    written to a temporary path first, and an interrupted job starts over.
+    """
+    partial_path = job.path + '.partial'
+    try:
+        with open(partial_path, 'wb') as stream:
+            manifest = export_survey(stream, job.data_format)
+        os.rename(partial_path, job.path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    job.rows_total = job.rows_processed = sum(manifest['num_rows'].values())
+
+
+@profile
+def run_export_job(job, chunk_size=None):
+    """
+    Produce the file requested by a claimed export job.
+
+    CSV exports are resumable: a job that was interrupted continues after the
+    last row it recorded. Other formats, and archives of the whole survey,
+    start over.
+
+    Args:
+        job: An ``ExportJob`` (typically returned by
+            :func:`claim_export_job`).
+        chunk_size (int): The maximum number of rows to fetch at once.
+
+    Returns:
+        `None`. Has the side effect of writing the file and marking the job as
+        completed or failed.
+    """
+    try:
+        if job.data_format not in get_export_functions():
+            raise ValueError('no such data format "{0}"'.format(job.data_format))
+        if job.model_label == ExportJob.SURVEY_LABEL:
+            querysets = [model.objects.all() for model in SURVEY_MODELS]
+            model_name, extension = 'survey', 'zip'
+        else:
+            querysets = [job.queryset]
+            model_name, extension = querysets[0].model.__name__, job.data_format
+        if not job.filename:
+            job.filename = '{0}-{1}'.format(job.id, generate_export_filename(
+                model_name, extension))
+        if job.started is None:
+            job.started = timezone.now()
+        job.rows_total = sum(queryset.count() for queryset in querysets)
+        job.save(update_fields=['filename', 'started', 'rows_total', 'updated'])
+
+        directory = os.path.dirname(job.path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if job.model_label == ExportJob.SURVEY_LABEL:
+            write_survey_job(job)
+        elif job.data_format == 'csv':
+            write_csv_job(job, querysets[0], chunk_size)
+        else:
+            write_export_job(job, querysets[0])
+    except Exception as error:  # pylint: disable=broad-except
+        LOGGER.log(logging.ERROR, 'Failed to run %s: %s', job, error)
+        job.status, job.error = ExportJob.FAILED, str(error)
+    else:
+        job.status = ExportJob.COMPLETED
+    job.finished = timezone.now()
+    job.save()
@@ -0,0 +1,150 @@
+"""
+Measure the throughput of the data exporters on a synthetic survey
+"""
+
+from __future__ import division, unicode_literals
+import io
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from openpyxl import Workbook
+import unicodecsv as csv
+
+from pcari.exports import export_csv, export_excel, get_export_field_names
+from pcari.models import Respondent, QuantitativeQuestion, QualitativeQuestion
+from pcari.models import Comment, CommentRating, QuantitativeQuestionRating
+
+EXPORTED_MODELS = [Respondent, Comment, CommentRating, QuantitativeQuestionRating]
+INSERT_BATCH_SIZE = 10000
+
+
+class NullStream(object):
+    """ A ``file``-like object that discards everything written to it. """
+    # pylint: disable=too-few-public-methods,no-self-use
+    def write(self, data):
+        return len(data)
+
+
+def export_instances_csv(stream, queryset):
+    """ Export CSV by instantiating every row (the original exporter). """
+    field_names = get_export_field_names(queryset.model)
+    writer = csv.writer(stream, encoding='utf-8')
+    writer.writerow(field_names)
+    for instance in queryset.iterator():
+        row = [getattr(instance, field_name) for field_name in field_names]
+        row = [unicode(cell) if cell is not None else '' for cell in row]
+        writer.writerow(row)
+
+
+def export_instances_excel(stream, queryset):
+    """ Export a spreadsheet by instantiating every row (the original exporter). """
+    field_names = get_export_field_names(queryset.model)
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(queryset.model.__name__)
+    worksheet.append(field_names)
+    for instance in queryset.iterator():
+        worksheet.append([getattr(instance, field_name) for field_name in field_names])
+    workbook.save(stream)
+
+
+EXPORTERS = {
+    'csv': [('instances', export_instances_csv), ('values', export_csv)],
+    'xlsx': [('instances', export_instances_excel), ('values', export_excel)],
+}
+
+
+class Command(BaseCommand):
+    """
+    This command inserts a synthetic survey into the database, times each
+    exporter on each exported model, then rolls back the transaction so that
+    no data are kept. The ``instances`` exporters reproduce the original
+    implementations, which instantiate a model instance per row, for
+    comparison.
+    """
+    help = 'Benchmarks the data exporters on a synthetic survey'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--num-ratings', type=int, default=1000000,
+                            help='The number of quantitative question ratings')
+        parser.add_argument('--num-questions', type=int, default=20,
+                            help='The number of quantitative questions each '
+                            'respondent rates')
+        parser.add_argument('--comment-ratings-per-respondent', type=int, default=5)
+        parser.add_argument('--formats', nargs='+', choices=sorted(EXPORTERS),
+                            default=['csv'], help='The formats to benchmark')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def populate(self, options):
+        """ Insert respondents, comments, and ratings with random scores. """
+        num_questions = options['num_questions']
+        num_respondents = max(options['num_ratings']//num_questions, 1)
+        question_ids = [QuantitativeQuestion.objects.create(min_score=0, max_score=9).id
+                        for _ in range(num_questions)]
+        qualitative_question = QualitativeQuestion.objects.create()
+
+        start_id = (Respondent.objects.order_by('-id').values_list('id', flat=True)
+                    .first() or 0) + 1
+        respondent_ids = range(start_id, start_id + num_respondents)
+        for start in range(0, num_respondents, INSERT_BATCH_SIZE):
+            batch = respondent_ids[start:start + INSERT_BATCH_SIZE]
+            Respondent.objects.bulk_create([
+                Respondent(id=respondent_id, age=random.randint(18, 80),
+                           gender=random.choice('MF'), language='en',
+                           location='Province, City, Barangay')
+                for respondent_id in batch
+            ])
+            QuantitativeQuestionRating.objects.bulk_create([
+                QuantitativeQuestionRating(respondent_id=respondent_id,
+                                           question_id=question_id,
+                                           score=random.randint(0, 9))
+                for respondent_id in batch for question_id in question_ids
+            ])
+            Comment.objects.bulk_create([
+                Comment(respondent_id=respondent_id, language='en',
+                        question=qualitative_question,
+                        message='Synthetic comment {0}'.format(respondent_id))
+                for respondent_id in batch
+            ])
+
+        comment_ids = list(Comment.objects.values_list('id', flat=True))
+        num_comment_ratings = min(options['comment_ratings_per_respondent'],
+                                  len(comment_ids))
+        for start in range(0, num_respondents, INSERT_BATCH_SIZE):
+            batch = respondent_ids[start:start + INSERT_BATCH_SIZE]
+            CommentRating.objects.bulk_create([
+                CommentRating(respondent_id=respondent_id, comment_id=comment_id,
+                              score=random.randint(0, 9))
+                for respondent_id in batch
+                for comment_id in random.sample(comment_ids, num_comment_ratings)
+            ])
+
+    def benchmark(self, formats):
+        """ Time every exporter on every model. """
+        header = '{0:>28} {1:>6} {2:>10} {3:>10} {4:>10} {5:>12}'
+        row = '{0:>28} {1:>6} {2:>10} {3:>10} {4:>10.2f} {5:>12.0f}'
+        self.stdout.write(header.format('Model', 'Format', 'Exporter', 'Rows',
+                                        'Seconds', 'Rows/second'))
+        for model in EXPORTED_MODELS:
+            queryset = model.objects.all()
+            num_rows = queryset.count()
+            for data_format in formats:
+                for name, export in EXPORTERS[data_format]:
+                    stream = NullStream() if data_format == 'csv' else io.BytesIO()
+                    start_time = time.time()
+                    export(stream, queryset)
+                    time_elapsed = time.time() - start_time
+                    self.stdout.write(row.format(model.__name__, data_format, name,
+                                                 num_rows, time_elapsed,
+                                                 num_rows/max(time_elapsed, 1e-9)))
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        with transaction.atomic():
+            start_time = time.time()
+            self.populate(options)
+            message = 'Inserted synthetic survey in {0:.1f} seconds'
+            self.stdout.write(message.format(time.time() - start_time))
+            self.benchmark(options['formats'])
+            transaction.set_rollback(True)
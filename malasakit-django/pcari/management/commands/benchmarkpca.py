@@ -0,0 +1,64 @@
+"""
+Compare the speed and accuracy of the principal component analysis engines
+"""
+
+from __future__ import division, unicode_literals
+import time
+
+from django.core.management.base import BaseCommand
+import numpy as np
+
+from pcari.analysis import PCA_ENGINES
+
+
+class Command(BaseCommand):
+    """
+    This command times every engine in :data:`pcari.analysis.PCA_ENGINES` on
+    synthetic ratings matrices of increasing size. No data are read from or
+    written to the database.
+    """
+    help = 'Benchmarks the principal component analysis engines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[1000, 10000, 100000],
+                            help='Numbers of respondents (rows) to benchmark')
+        parser.add_argument('--num-questions', type=int, default=20,
+                            help='The number of questions (columns)')
+        parser.add_argument('--num-components', type=int, default=2,
+                            help='The number of principal components')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Take the best time of this many runs')
+        parser.add_argument('--seed', type=int, default=0)
+
+    @staticmethod
+    def make_ratings(random_state, num_respondents, num_questions):
+        """ Generate a centered matrix of scores with some latent structure. """
+        latent = random_state.normal(size=(num_respondents, 3)) * [3, 2, 1]
+        loadings = random_state.normal(size=(3, num_questions))
+        ratings = np.clip(np.round(4.5 + latent.dot(loadings)), 0, 9)
+        return ratings - ratings.mean(axis=0)
+
+    def handle(self, *args, **options):
+        random_state = np.random.RandomState(options['seed'])
+        num_components = options['num_components']
+        header = '{0:>10} {1:>12} {2:>12} {3:>12}'
+        row = '{0:>10} {1:>12} {2:>12.4f} {3:>12.2e}'
+        self.stdout.write(header.format('Rows', 'Engine', 'Seconds', 'Error'))
+
+        for num_respondents in options['sizes']:
+            ratings = self.make_ratings(random_state, num_respondents,
+                                        options['num_questions'])
+            reference = PCA_ENGINES['svd'](ratings, num_components)
+            for name in sorted(PCA_ENGINES):
+                engine = PCA_ENGINES[name]
+                timings = []
+                for _ in range(options['repeat']):
+                    start_time = time.time()
+                    components = engine(ratings, num_components)
+                    timings.append(time.time() - start_time)
+
+                # Components are only unique up to sign
+                alignment = np.abs(np.sum(components*reference, axis=1))
+                error = np.max(np.abs(1 - alignment))
+                self.stdout.write(row.format(num_respondents, name, min(timings), error))
@@ -0,0 +1,74 @@
+"""
+Export rows added or changed since the previous export
+"""
+
+from __future__ import unicode_literals
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pcari.exports import SURVEY_MODELS, export_changes, get_export_functions
+from pcari.models import ExportCheckpoint
+
+
+class Command(BaseCommand):
+    """
+    This command exports, for each survey model, only the rows added or
+    changed since the model was last exported by this command (see
+    :func:`pcari.exports.export_changes`). Each run writes one file per model
+    with changes, so recurring jobs (for instance, a nightly ``cron`` job) do
+    not re-read the full history. The first run exports every row.
+    """
+    help = 'Exports survey data added or changed since the previous export'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', nargs='?', default=None,
+                            help='Where to write the exported files (by '
+                            'default, the EXPORT_JOB_DIRECTORY setting)')
+        parser.add_argument('--format', dest='data_format', default='csv',
+                            choices=sorted(get_export_functions()),
+                            help='The format of the exported files')
+        parser.add_argument('--models', nargs='+', default=None,
+                            choices=[model.__name__ for model in SURVEY_MODELS],
+                            help='Only export these models')
+        parser.add_argument('--reset', action='store_true',
+                            help='Forget previous exports, so that every row '
+                            'is exported again')
+        parser.add_argument('--status', action='store_true',
+                            help='Only report how far each model has been exported')
+
+    def handle(self, *args, **options):
+        models = [model for model in SURVEY_MODELS
+                  if options['models'] is None or model.__name__ in options['models']]
+        checkpoints = ExportCheckpoint.objects.filter(
+            model_label__in=[model._meta.label for model in models])
+
+        if options['status']:
+            for checkpoint in checkpoints.order_by('model_label'):
+                message = '{0}: {1} rows exported, up to ID {2} (last run {3})'
+                self.stdout.write(message.format(checkpoint.model_label,
+                                                 checkpoint.rows_exported,
+                                                 checkpoint.last_primary_key,
+                                                 checkpoint.updated))
+            return
+        if options['reset']:
+            checkpoints.delete()
+
+        directory = options['directory']
+        if directory is None:
+            directory = getattr(settings, 'EXPORT_JOB_DIRECTORY',
+                                os.path.join(settings.BASE_DIR, 'exports'))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        for model in models:
+            try:
+                path, num_rows = export_changes(model, directory, options['data_format'])
+            except (IOError, OSError) as error:
+                raise CommandError(str(error))
+            if path is None:
+                self.stdout.write('{0}: no changes'.format(model.__name__))
+            else:
+                self.stdout.write('{0}: exported {1} rows to {2}'.format(
+                    model.__name__, num_rows, path))
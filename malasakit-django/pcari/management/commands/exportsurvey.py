@@ -0,0 +1,38 @@
+"""
+Export the entire survey as one archive
+"""
+
+from __future__ import unicode_literals
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pcari.exports import export_survey, get_export_functions
+
+
+class Command(BaseCommand):
+    """
+    This command writes every survey model to a zip archive from a single
+    consistent snapshot of the database (see
+    :func:`pcari.exports.export_survey`).
+    """
+    help = 'Exports all survey data as a zip archive of one file per model'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=None,
+                            help='Where to write the archive (by default, '
+                            'survey-<date>.zip in the current directory)')
+        parser.add_argument('--format', dest='data_format', default='csv',
+                            choices=sorted(get_export_functions()),
+                            help='The format of each file in the archive')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if path is None:
+            path = 'survey-{0}.zip'.format(datetime.date.today().isoformat())
+        try:
+            with open(path, 'wb') as archive_file:
+                export_survey(archive_file, options['data_format'])
+        except (IOError, ValueError) as error:
+            raise CommandError(str(error))
+        self.stdout.write('Exported survey to {0}'.format(path))
@@ -0,0 +1,66 @@
+"""
+Ingest responses queued when the response queue is enabled
+"""
+
+from __future__ import unicode_literals
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from pcari.models import QueuedResponse
+from pcari.views import QUEUE_BATCH_SIZE, process_queued_responses
+
+
+class Command(BaseCommand):
+    """
+    This command drains the response queue, either once (for instance, from a
+    ``cron`` job) or continuously as a background worker.
+    """
+    help = 'Validates and saves queued responses in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=QUEUE_BATCH_SIZE,
+                            help='The maximum number of responses to save at once')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running, checking for new responses '
+                            'every this many seconds')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Return responses that previously failed to '
+                            'the queue before draining it')
+        parser.add_argument('--status', action='store_true',
+                            help='Only report the number of queued responses')
+
+    def report(self):
+        """ Write the number of pending and failed responses. """
+        num_failed = QueuedResponse.objects.filter(failed=True).count()
+        num_pending = QueuedResponse.objects.filter(failed=False).count()
+        self.stdout.write('{0} pending, {1} failed'.format(num_pending, num_failed))
+
+    def drain(self, batch_size):
+        """ Ingest batches of queued responses until the queue is empty. """
+        total_ingested = total_failed = 0
+        while True:
+            num_ingested, num_failed = process_queued_responses(batch_size)
+            total_ingested += num_ingested
+            total_failed += num_failed
+            if num_ingested + num_failed == 0:
+                break
+        if total_ingested + total_failed > 0:
+            message = 'Saved {0} responses ({1} failed)'
+            self.stdout.write(message.format(total_ingested, total_failed))
+
+    def handle(self, *args, **options):
+        if options['status']:
+            self.report()
+            return
+
+        if options['retry_failed']:
+            QueuedResponse.objects.filter(failed=True).update(failed=False, error='')
+
+        batch_size = max(options['batch_size'], 1)
+        self.drain(batch_size)
+        while options['interval'] is not None:
+            time.sleep(options['interval'])
+            close_old_connections()
+            self.drain(batch_size)
@@ -0,0 +1,51 @@
+"""
+Rebuild the score aggregates stored on rated models
+"""
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pcari.models import Comment, QuantitativeQuestion
+
+
+class Command(BaseCommand):
+    """
+    This command recomputes the score aggregates (see
+    :class:`pcari.models.StatisticsMixin`) from the ratings themselves and
+    repairs any stored values that have drifted.
+    """
+    help = 'Recomputes the stored rating statistics of comments and questions'
+    MODELS = (Comment, QuantitativeQuestion)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report instances whose statistics have drifted')
+
+    def handle(self, *args, **options):
+        for model in self.MODELS:
+            with transaction.atomic():
+                aggregates = model.compute_score_aggregates()
+                stored = model.objects.select_for_update().values_list(
+                    'pk', *model.AGGREGATE_FIELD_NAMES
+                )
+
+                num_repaired = 0
+                for row in stored.iterator():
+                    primary_key, values = row[0], tuple(row[1:])
+                    expected = aggregates.get(primary_key, (0, 0, 0))
+                    if values != expected:
+                        num_repaired += 1
+                        if not options['dry_run']:
+                            model.objects.filter(pk=primary_key).update(
+                                **dict(zip(model.AGGREGATE_FIELD_NAMES, expected))
+                            )
+
+            message = '{0} {1} instance{2} with drifted statistics{3}'
+            self.stdout.write(message.format(
+                num_repaired,
+                model.__name__,
+                's' if num_repaired != 1 else '',
+                '' if options['dry_run'] else ' repaired',
+            ))
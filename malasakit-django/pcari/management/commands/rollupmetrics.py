@@ -0,0 +1,55 @@
+"""
+Roll up the quantitative question ratings received since the previous run
+"""
+
+from __future__ import unicode_literals
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from pcari.metrics import get_last_rollup_date, update_daily_rollups
+from pcari.models import DailyRollup
+
+
+def parse_date(value):
+    """ Parse a date in ISO format (``YYYY-MM-DD``). """
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError('invalid date "{0}" (expected YYYY-MM-DD)'.format(value))
+
+
+class Command(BaseCommand):
+    """
+    This command updates the daily per-language rollups of the quantitative
+    question ratings, which back the responses by day on the statistics page (see
+    :func:`pcari.metrics.update_daily_rollups`). Each run only recomputes the
+    days since the last rolled-up day, so recurring jobs (for instance, a
+    nightly ``cron`` job) do not rescan the full history. The first run rolls
+    up every day.
+    """
+    help = 'Updates the daily rollups of quantitative question ratings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=parse_date, default=None,
+                            help='Recompute from this day (YYYY-MM-DD) onward, '
+                            'for instance after ratings were deactivated')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recompute every day')
+        parser.add_argument('--status', action='store_true',
+                            help='Only report how far the rollups extend')
+
+    def handle(self, *args, **options):
+        if options['status']:
+            message = '{0} rollups, up to {1}'
+            self.stdout.write(message.format(DailyRollup.objects.count(),
+                                             get_last_rollup_date() or 'no day'))
+            return
+
+        with transaction.atomic():
+            if options['rebuild']:
+                DailyRollup.objects.all().delete()
+            since, num_rollups = update_daily_rollups(options['since'])
+        message = 'Computed {0} rollups since {1}'
+        self.stdout.write(message.format(num_rollups, since or 'the first day'))
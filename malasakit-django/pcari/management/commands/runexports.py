@@ -0,0 +1,66 @@
+"""
+Run export jobs requested from the admin panel
+"""
+
+from __future__ import division, unicode_literals
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from pcari.exports import claim_export_job, run_export_job
+from pcari.models import ExportJob
+
+
+class Command(BaseCommand):
+    """
+    This command runs pending export jobs, either until none remain (for
+    instance, from a ``cron`` job) or continuously as a background worker.
+    Jobs that were interrupted (for example, because a worker was stopped)
+    are resumed once they have not made progress for ``--stale-after``
+    seconds.
+    """
+    help = 'Runs pending export jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running, checking for new jobs every '
+                            'this many seconds')
+        parser.add_argument('--stale-after', type=float, default=10*60,
+                            help='Resume running jobs that have not made '
+                            'progress in this many seconds')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='The maximum number of rows to fetch at once')
+        parser.add_argument('--status', action='store_true',
+                            help='Only report the status of recent jobs')
+
+    def report(self, job):
+        """ Write the progress of a job. """
+        message = '{0} ({1} {2}): {3}, {4}/{5} rows'
+        message = message.format(job, job.model_label, job.data_format, job.status,
+                                  job.rows_processed, job.rows_total or '?')
+        if job.throughput is not None:
+            message += ', {0:.0f} rows/second'.format(job.throughput)
+        if job.error:
+            message += ', error: {0}'.format(job.error)
+        self.stdout.write(message)
+
+    def run_pending(self, options):
+        """ Run jobs until none remain. """
+        job = claim_export_job(options['stale_after'])
+        while job is not None:
+            run_export_job(job, options['chunk_size'])
+            self.report(job)
+            job = claim_export_job(options['stale_after'])
+
+    def handle(self, *args, **options):
+        if options['status']:
+            for job in ExportJob.objects.defer('_selection').order_by('-created')[:20]:
+                self.report(job)
+            return
+
+        self.run_pending(options)
+        while options['interval'] is not None:
+            time.sleep(options['interval'])
+            close_old_connections()
+            self.run_pending(options)
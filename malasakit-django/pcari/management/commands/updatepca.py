@@ -0,0 +1,82 @@
+"""
+Recompute the principal components used to position comments on the bloom
+"""
+
+from __future__ import division, unicode_literals
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from pcari.analysis import count_new_respondents
+from pcari.models import PCASnapshot
+from pcari.views import compute_pca_snapshot
+
+
+class Command(BaseCommand):
+    """
+    This command computes a new PCA snapshot, either once (for instance, from a
+    ``cron`` job) or periodically as a background worker.
+    """
+    help = 'Computes principal components of the quantitative question ratings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-new-responses', type=int, default=0,
+                            help='Only recompute if at least this many '
+                            'respondents are not in the latest snapshot')
+        parser.add_argument('--max-age', type=float, default=None,
+                            help='Recompute regardless of the number of new '
+                            'responses if the latest snapshot is older than '
+                            'this many seconds')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running, checking for new responses '
+                            'every this many seconds')
+        parser.add_argument('--keep', type=int, default=10,
+                            help='The number of most recent snapshots to keep')
+        parser.add_argument('--status', action='store_true',
+                            help='Only report how stale the latest snapshot is')
+
+    def report(self, snapshot):
+        """ Write the staleness of the given snapshot. """
+        if snapshot is None:
+            self.stdout.write('No PCA snapshot exists')
+        else:
+            message = '{0}: computed {1} ({2:.0f} seconds ago), {3} new respondents'
+            self.stdout.write(message.format(snapshot, snapshot.timestamp,
+                                             snapshot.age.total_seconds(),
+                                             count_new_respondents(snapshot)))
+
+    def is_stale(self, snapshot, options):
+        """ Decide whether a new snapshot should be computed. """
+        if snapshot is None:
+            return True
+        max_age = options['max_age']
+        if max_age is not None and snapshot.age.total_seconds() > max_age:
+            return True
+        return count_new_respondents(snapshot) >= options['min_new_responses']
+
+    def prune(self, keep):
+        """ Delete all but the ``keep`` most recent snapshots. """
+        versions = PCASnapshot.objects.order_by('-version').values_list('version', flat=True)
+        obsolete = list(versions[keep:])
+        if obsolete:
+            PCASnapshot.objects.filter(version__in=obsolete).delete()
+
+    def update(self, options):
+        """ Compute a new snapshot if the latest one is stale. """
+        snapshot = PCASnapshot.objects.defer('_data').order_by('-version').first()
+        if self.is_stale(snapshot, options):
+            snapshot = compute_pca_snapshot()
+            self.prune(max(options['keep'], 1))
+        self.report(snapshot)
+
+    def handle(self, *args, **options):
+        if options['status']:
+            self.report(PCASnapshot.objects.defer('_data').order_by('-version').first())
+            return
+
+        self.update(options)
+        while options['interval'] is not None:
+            time.sleep(options['interval'])
+            close_old_connections()
+            self.update(options)
@@ -0,0 +1,304 @@
+"""
+This module computes the survey statistics shown on the admin statistics page.
+
+Every statistic is aggregated by the database with a handful of grouped
+queries, rather than by downloading individual ratings to the browser. The
+per-question means and standard errors are derived from the score aggregates
+stored on each question (see :class:`pcari.models.StatisticsMixin`). Because
+the statistics only inform staff, the result is cached for
+``STATISTICS_CACHE_TIMEOUT`` seconds.
+
+Ratings and respondents per day are instead read from
+:class:`pcari.models.DailyRollup` rows, which this module maintains
+incrementally (see :func:`update_daily_rollups`). Only days after the last
+rolled-up day are counted from the ratings themselves.
+
+References:
+  * `Django Aggregation <https://docs.djangoproject.com/en/dev/topics/db/aggregation/>`_
+"""
+
+from __future__ import division, unicode_literals
+from collections import OrderedDict
+import datetime
+import logging
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, Count, F, IntegerField, Max, Sum, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.translation import ugettext
+
+from pcari.models import Respondent, QuantitativeQuestion
+from pcari.models import Comment, QuantitativeQuestionRating, Rating, DailyRollup
+from pcari.payloads import render_question_histograms
+
+__all__ = [
+    'compute_question_statistics',
+    'count_responses_by_day',
+    'compute_completion_funnel',
+    'count_respondents_by_language',
+    'compute_survey_statistics',
+    'get_survey_statistics',
+    'translate_survey_statistics',
+    'get_last_rollup_date',
+    'update_daily_rollups',
+]
+
+LOGGER = logging.getLogger('pcari')
+
+SURVEY_STATISTICS_KEY = 'pcari:survey-statistics'
+DEFAULT_STATISTICS_CACHE_TIMEOUT = 5*60
+ROLLUP_FIELD_NAMES = ('num_respondents', 'num_ratings', 'score_sum', 'score_squared_sum')
+
+
+def finite_or_none(value, digits=3):
+    """ Round a number for JSON, which cannot represent ``NaN``. """
+    return None if math.isnan(value) else round(value, digits)
+
+
+def compute_question_statistics():
+    """
+    Summarize the ratings of each active quantitative question.
+
+    Returns:
+        list: One ``dict`` per question, ordered by identifier, with the
+        question's ``id``, ``tag``, and (untranslated) ``prompt``, the number of valid
+        ratings (``num_ratings``), the ``mean``, ``stdev``, and ``sem`` of
+        the scores (`None` if undefined), and the ``histogram`` of the scores
+        (see :func:`pcari.payloads.render_question_histograms`).
+    """
+    histograms = render_question_histograms()
+    questions = QuantitativeQuestion.objects.filter(active=True).order_by('id')
+    fields = ('id', 'tag', 'prompt') + QuantitativeQuestion.AGGREGATE_FIELD_NAMES
+    statistics = []
+    for question_id, tag, prompt, score_sum, score_squared_sum, num_scores \
+            in questions.values_list(*fields):
+        aggregates = score_sum, score_squared_sum, num_scores
+        statistics.append(OrderedDict([
+            ('id', question_id),
+            ('tag', tag),
+            ('prompt', prompt),
+            ('num_ratings', num_scores),
+            ('mean', round(score_sum/num_scores, 3) if num_scores > 0 else None),
+            ('stdev', finite_or_none(QuantitativeQuestion.calculate_score_stdev(*aggregates))),
+            ('sem', finite_or_none(QuantitativeQuestion.calculate_score_sem(*aggregates))),
+            ('histogram', histograms.get(str(question_id), {})),
+        ]))
+    return statistics
+
+
+def count_responses_by_day():
+    """
+    Count the active responses received on each day (in the current time zone).
+
+    Ratings and respondents are read from the rollups of all questions (see
+    :func:`update_daily_rollups`) for days before the last day rolled up. Later
+    days (or every day, if there are no rollups) are counted from the ratings
+    themselves, as are comments, which are not rolled up. Ratings deactivated
+    after their day was rolled up are still counted until that day is rolled
+    up again.
+
+    Returns:
+        list: One ``dict`` per day with any responses, in chronological order,
+        with the ``date`` (in ISO format), the number of ``respondents`` who
+        rated a question, and the number of valid ``ratings`` and
+        ``comments``.
+    """
+    last_rollup_date = get_last_rollup_date()
+    rollups = DailyRollup.objects.filter(question__isnull=True)
+    ratings = QuantitativeQuestionRating.objects.filter(active=True)
+    if last_rollup_date is None:
+        rollups = rollups.none()
+    else:
+        # The last day rolled up may have received more ratings since
+        rollups = rollups.filter(date__lt=last_rollup_date)
+        ratings = ratings.filter(timestamp__gte=get_start_of_day(last_rollup_date))
+    rows = list(rollups.values('date').annotate(respondents=Sum('num_respondents'),
+                                                ratings=Sum('num_ratings')).order_by())
+    rows += list(ratings.annotate(date=TruncDate('timestamp')).values('date')
+                 .annotate(respondents=Count('respondent', distinct=True),
+                           ratings=Sum(valid_score_case(1))).order_by())
+
+    days = {}
+    for row in rows:
+        days[row['date']] = {'respondents': row['respondents'], 'ratings': row['ratings'],
+                             'comments': 0}
+    comments = (Comment.objects.filter(active=True).exclude(message='')
+                .annotate(date=TruncDate('timestamp'))
+                .values('date').annotate(comments=Count('id')).order_by())
+    for row in comments:
+        days.setdefault(row['date'], {'respondents': 0, 'ratings': 0})
+        days[row['date']]['comments'] = row['comments']
+    return [dict(counts, date=date.isoformat()) for date, counts in sorted(days.items())]
+
+
+def count_true(field_name):
+    """ Make an aggregate counting rows where a Boolean field is true. """
+    return Sum(Case(When(**{field_name: True, 'then': 1}), default=0,
+                    output_field=IntegerField()))
+
+
+def compute_completion_funnel():
+    """
+    Count how many active respondents reached each stage of the survey.
+
+    Returns:
+        OrderedDict: The number of respondents who started the survey
+        (``started``), submitted their personal data
+        (``submitted_personal_data``), and completed the survey
+        (``completed_survey``).
+    """
+    counts = Respondent.objects.filter(active=True).aggregate(
+        started=Count('id'),
+        submitted_personal_data=count_true('submitted_personal_data'),
+        completed_survey=count_true('completed_survey'),
+    )
+    return OrderedDict((stage, counts[stage] or 0) for stage in
+                       ('started', 'submitted_personal_data', 'completed_survey'))
+
+
+def count_respondents_by_language():
+    """
+    Count the active respondents who chose each language.
+
+    Returns:
+        OrderedDict: A map from language codes (including the empty string,
+        for respondents who did not choose one) to numbers of respondents.
+    """
+    rows = (Respondent.objects.filter(active=True).values_list('language')
+            .annotate(count=Count('id')).order_by('language'))
+    return OrderedDict(rows)
+
+
+def compute_survey_statistics():
+    """
+    Compute every statistic shown on the admin statistics page.
+
+    Returns:
+        OrderedDict: The results of the ``compute_*`` and ``count_*``
+        functions of this module, keyed by ``questions``, ``days``,
+        ``funnel``, and ``languages``, along with when they were ``computed``
+        and the last day ``rolled_up`` (in ISO format, or `None`).
+    """
+    last_rollup_date = get_last_rollup_date()
+    return OrderedDict([
+        ('computed', timezone.now().isoformat()),
+        ('rolled_up', last_rollup_date.isoformat() if last_rollup_date else None),
+        ('questions', compute_question_statistics()),
+        ('days', count_responses_by_day()),
+        ('funnel', compute_completion_funnel()),
+        ('languages', count_respondents_by_language()),
+    ])
+
+
+def get_survey_statistics(refresh=False):
+    """
+    Get the survey statistics, from the cache if they were recently computed.
+
+    Args:
+        refresh (bool): Whether to recompute the statistics even if they are
+            cached.
+
+    Returns:
+        OrderedDict: The result of :func:`compute_survey_statistics`.
+    """
+    statistics = None if refresh else cache.get(SURVEY_STATISTICS_KEY)
+    if statistics is None:
+        statistics = compute_survey_statistics()
+        timeout = getattr(settings, 'STATISTICS_CACHE_TIMEOUT',
+                          DEFAULT_STATISTICS_CACHE_TIMEOUT)
+        cache.set(SURVEY_STATISTICS_KEY, statistics, timeout=timeout)
+        LOGGER.log(logging.DEBUG, 'Computed survey statistics')
+    return statistics
+
+
+def translate_survey_statistics(statistics):
+    """
+    Translate the question prompts of the survey statistics into the active
+    language. (The cached statistics are shared by every language.)
+
+    Args:
+        statistics (OrderedDict): The result of :func:`get_survey_statistics`,
+            which is not modified.
+
+    Returns:
+        OrderedDict: A copy of the statistics with translated prompts.
+    """
+    statistics = OrderedDict(statistics)
+    statistics['questions'] = [
+        OrderedDict(question, prompt=ugettext(question['prompt']) if question['prompt'] else '')
+        for question in statistics['questions']
+    ]
+    return statistics
+
+
+def get_last_rollup_date():
+    """ Get the latest day with a rollup, or `None` if there are none. """
+    return DailyRollup.objects.aggregate(last_date=Max('date'))['last_date']
+
+
+def get_start_of_day(date):
+    """ Get the first instant of a day in the current time zone. """
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
+
+def valid_score_case(then, output_field=IntegerField()):
+    """ Make an expression equal to ``then`` for valid scores, and zero otherwise. """
+    return Case(When(score__in=[Rating.NOT_RATED, Rating.SKIPPED], then=0),
+                default=then, output_field=output_field)
+
+
+@transaction.atomic
+def update_daily_rollups(since=None):
+    """
+    Recompute the daily rollups of quantitative question ratings, per
+    question and of all questions together, from a day onward.
+
+    By default, only days since the last update are recomputed. The last day
+    already rolled up is included, since it may have received more ratings
+    after the previous update. Ratings whose ``timestamp`` lies on an earlier
+    day (or which were deactivated after their day was rolled up) are only
+    reflected by passing an earlier ``since``.
+
+    Args:
+        since (datetime.date): The first day to recompute. Defaults to the
+            result of :func:`get_last_rollup_date`. If there are no rollups,
+            every day is computed.
+
+    Returns:
+        tuple: The first day recomputed (`None` if every day was) and the
+        number of rollups written.
+    """
+    if since is None:
+        since = get_last_rollup_date()
+
+    ratings = QuantitativeQuestionRating.objects.filter(active=True)
+    rollups = DailyRollup.objects.all()
+    if since is not None:
+        ratings = ratings.filter(timestamp__gte=get_start_of_day(since))
+        rollups = rollups.filter(date__gte=since)
+
+    aggregates = {
+        'num_respondents': Count('respondent', distinct=True),
+        'num_ratings': Sum(valid_score_case(1)),
+        'score_sum': Sum(valid_score_case(F('score'))),
+        'score_squared_sum': Sum(valid_score_case(F('score')*F('score'), BigIntegerField())),
+    }
+    ratings = ratings.annotate(date=TruncDate('timestamp'))
+    rows = list(ratings.values('date', 'question_id', 'respondent__language')
+                .annotate(**aggregates).order_by())
+    # Respondents are counted once across all questions (``question`` is `None`)
+    rows += list(ratings.values('date', 'respondent__language')
+                 .annotate(**aggregates).order_by())
+    rollups.delete()
+    DailyRollup.objects.bulk_create([
+        DailyRollup(date=row['date'], question_id=row.get('question_id'),
+                    language=row['respondent__language'] or '',
+                    **{field_name: row[field_name] for field_name in ROLLUP_FIELD_NAMES})
+        for row in rows
+    ])
+    LOGGER.log(logging.INFO, 'Computed %d daily rollups since %s', len(rows), since)
+    return since, len(rows)
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 01:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pcari', '0051_auto_20170705_1952'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PCASnapshot',
+            fields=[
+                ('version', models.AutoField(primary_key=True, serialize=False)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('num_respondents', models.PositiveIntegerField(default=0)),
+                ('num_questions', models.PositiveIntegerField(default=0)),
+                ('last_respondent_id', models.PositiveIntegerField(default=0)),
+                ('_data', models.BinaryField(default=b'')),
+            ],
+        ),
+    ]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 01:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F, Count, Sum
+
+SENTINEL_SCORES = [-2, -1]
+
+
+def compute_rating_statistics(apps, schema_editor):
+    """ Populate the score aggregates from existing ratings. """
+    for model_name, rating_model_name, target_name in [
+            ('Comment', 'CommentRating', 'comment_id'),
+            ('QuantitativeQuestion', 'QuantitativeQuestionRating', 'question_id')]:
+        model = apps.get_model('pcari', model_name)
+        rating_model = apps.get_model('pcari', rating_model_name)
+        ratings = rating_model.objects.filter(active=True)
+        rows = ratings.exclude(score__in=SENTINEL_SCORES).values(target_name).annotate(
+            score_sum=Sum('score'),
+            score_squared_sum=Sum(F('score')*F('score')),
+            num_scores=Count('score'),
+        ).order_by()
+        for row in rows:
+            model.objects.filter(pk=row[target_name]).update(
+                _score_sum=row['score_sum'],
+                _score_squared_sum=row['score_squared_sum'],
+                _num_scores=row['num_scores'],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pcari', '0052_pcasnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='_num_scores',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='_score_squared_sum',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='_score_sum',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='quantitativequestion',
+            name='_num_scores',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='quantitativequestion',
+            name='_score_squared_sum',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='quantitativequestion',
+            name='_score_sum',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compute_rating_statistics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 01:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pcari', '0053_rating_statistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='respondent',
+            name='response_key',
+            field=models.CharField(blank=True, default=None, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
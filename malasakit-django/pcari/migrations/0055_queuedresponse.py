@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 01:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pcari', '0054_respondent_response_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedResponse',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.TextField()),
+                ('received', models.DateTimeField(auto_now_add=True)),
+                ('failed', models.BooleanField(db_index=True, default=False)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+        ),
+    ]
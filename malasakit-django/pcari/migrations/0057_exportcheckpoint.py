@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 02:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pcari', '0056_exportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_label', models.CharField(max_length=128, unique=True)),
+                ('last_primary_key', models.PositiveIntegerField(blank=True, default=None, null=True)),
+                ('last_timestamp', models.DateTimeField(blank=True, default=None, null=True)),
+                ('last_change_id', models.PositiveIntegerField(blank=True, default=None, null=True)),
+                ('rows_exported', models.PositiveIntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RowChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_label', models.CharField(max_length=128)),
+                ('object_id', models.PositiveIntegerField()),
+                ('changed', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='rowchange',
+            index_together=set([('model_label', 'id')]),
+        ),
+    ]
@@ -21,21 +21,29 @@ Attributes:
         the language code for "English" would be "en". This attribute is pulled
         from the project ``settings`` lazily.
 """
+# pylint: disable=too-many-lines
 
 from __future__ import division, unicode_literals
+import io
 import json
+import os
 
+from django.apps import apps
 from django.core.exceptions import ValidationError
 from django.conf import settings
 from django.core.validators import RegexValidator
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
-from django.db.models import F, Count, Avg, Sum
+from django.db.models import F, Value, Case, When, Count, Sum
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
+import numpy as np
 
 __all__ = ['Comment', 'QuantitativeQuestionRating', 'CommentRating',
            'QualitativeQuestion', 'QuantitativeQuestion', 'Respondent',
-           'OptionQuestion', 'OptionQuestionChoice']
+           'OptionQuestion', 'OptionQuestionChoice', 'PCASnapshot',
+           'QueuedResponse', 'ExportJob', 'ExportCheckpoint', 'RowChange',
+           'DailyRollup']
 
 LANGUAGES = settings.LANGUAGES
 _LANGUAGE_CODES = [''] + [code for code, name in LANGUAGES]
@@ -54,7 +62,7 @@ def get_direct_fields(model):
             if not field.auto_created or field.concrete]
 
 
-class StatisticsMixin:
+class StatisticsMixin(models.Model):
     """
     A ``StatisticsMixin`` adds descriptive statistics capabilities to a model
     that accepts ratings.
@@ -66,7 +74,17 @@ class StatisticsMixin:
     instances of a model that inherits from :class:`Rating`.
 
     All properties exclude the sentinel scores :attr:`Rating.SKIPPED` and
-    :attr:`Rating.NOT_RATED`.
+    :attr:`Rating.NOT_RATED`, as well as inactive ratings.
+
+    Rather than aggregating the ratings on every access, the mixin stores the
+    number of scores, their sum, and the sum of their squares in columns that
+    are updated whenever ratings are created, changed, or deleted (see
+    :class:`RatingQuerySet` and :mod:`pcari.signals`). Each property reads
+    the columns loaded with the instance, so listing many instances costs no
+    extra queries. Instances held while ratings change should be refreshed
+    (see :meth:`get_score_aggregates`). If the columns ever drift from the
+    ratings (for instance, after raw SQL), the ``recomputestats`` command
+    rebuilds them.
 
     Attributes:
         scores: A flat ``QuerySet`` of integer scores.
@@ -81,7 +99,20 @@ class StatisticsMixin:
         score_sem (float): The standard error of the mean of this object's
             scores, or ``float('nan')`` if the object has fewer than two
             ratings.
+        _num_scores (int): The stored number of scores. This field should only
+            be used internally by this model.
+        _score_sum (int): The stored sum of scores. This field should only be
+            used internally by this model.
+        _score_squared_sum (int): The stored sum of squared scores. This field
+            should only be used internally by this model.
     """
+    AGGREGATE_FIELD_NAMES = ('_score_sum', '_score_squared_sum', '_num_scores')
+    AGGREGATE_UPDATE_BATCH_SIZE = 100
+
+    _num_scores = models.IntegerField(default=0, editable=False)
+    _score_sum = models.BigIntegerField(default=0, editable=False)
+    _score_squared_sum = models.BigIntegerField(default=0, editable=False)
+
     @property
     def scores(self):
         active_ratings = self.ratings.filter(active=True)
@@ -92,15 +123,37 @@ class StatisticsMixin:
         )
         return active_ratings.values_list('score', flat=True)
 
+    def get_score_aggregates(self, refresh=False):
+        """
+        Get the stored score aggregates.
+
+        Args:
+            refresh (bool): Whether to re-read the aggregates from the database
+                (with a primary key lookup), for instance after ratings were
+                saved while this instance was held. By default, the values
+                loaded with this instance are used, which costs no queries.
+
+        Returns:
+            tuple: Tuple of three items: the sum of scores, the sum of squared
+            scores, and the number of scores.
+        """
+        if refresh and self.pk is not None:
+            query = self.__class__.objects.filter(pk=self.pk)
+            values = query.values_list(*self.AGGREGATE_FIELD_NAMES).first()
+            if values is not None:
+                self._score_sum, self._score_squared_sum, self._num_scores = values
+        return self._score_sum, self._score_squared_sum, self._num_scores
+
     def num_ratings(self):
-        return self.scores.count()
+        _, _, num_scores = self.get_score_aggregates()
+        return num_scores
     num_ratings.short_description = 'Number of ratings'
     num_ratings = property(num_ratings)
 
     @property
     def mean_score(self):
-        mean = self.scores.aggregate(Avg('score'))['score__avg']
-        return mean if mean is not None else float('nan')
+        score_sum, _, num_scores = self.get_score_aggregates()
+        return score_sum/num_scores if num_scores > 0 else float('nan')
 
     @property
     def mode_score(self):
@@ -108,29 +161,113 @@ class StatisticsMixin:
         most_common = aggregation.order_by('-count').first()
         return most_common if most_common is not None else float('nan')
 
-    @property
-    def _score_aggregates(self):
-        query = self.scores.annotate(score_squared=F('score')*F('score'))
-        values = query.aggregate(
-            Sum('score'), Sum('score_squared'), Count('score')
-        )
-        return values['score__sum'], values['score_squared__sum'], values['score__count']
+    @classmethod
+    def compute_score_aggregates(cls, primary_keys=None):
+        """
+        Compute score aggregates from the ratings themselves (rather than the
+        stored columns) with a single grouped query.
 
-    @property
-    def score_stdev(self):
-        score_sum, score_squared_sum, num_scores = self._score_aggregates
+        Args:
+            primary_keys: An iterable of primary keys of instances of this
+                model. If `None`, all instances are included.
+
+        Returns:
+            dict: A map from primary keys to tuples of three items: the sum of
+            scores, the sum of squared scores, and the number of scores.
+            Instances with no (valid) ratings are absent from the map.
+        """
+        relation = cls._meta.get_field('ratings')
+        target_name = relation.field.attname
+        ratings = relation.related_model.objects.filter(active=True)
+        if primary_keys is not None:
+            ratings = ratings.filter(**{target_name + '__in': list(primary_keys)})
+        ratings = ratings.exclude(score__in=[Rating.SKIPPED, Rating.NOT_RATED])
+
+        rows = ratings.values(target_name).annotate(
+            score_sum=Sum('score'),
+            score_squared_sum=Sum(F('score')*F('score')),
+            num_scores=Count('score'),
+        ).order_by()
+        return {
+            row[target_name]: (row['score_sum'], row['score_squared_sum'], row['num_scores'])
+            for row in rows
+        }
+
+    @classmethod
+    def refresh_score_aggregates(cls, primary_keys):
+        """
+        Overwrite the stored score aggregates of the given instances with
+        aggregates computed from their ratings.
+
+        Args:
+            primary_keys: An iterable of primary keys of instances of this
+                model.
+        """
+        primary_keys = set(primary_keys)
+        aggregates = cls.compute_score_aggregates(primary_keys)
+        for primary_key in primary_keys:
+            values = aggregates.get(primary_key, (0, 0, 0))
+            cls.objects.filter(pk=primary_key).update(
+                **dict(zip(cls.AGGREGATE_FIELD_NAMES, values))
+            )
+
+    @classmethod
+    def add_score_aggregates(cls, deltas):
+        """
+        Atomically add to the stored score aggregates of the given instances.
+
+        Args:
+            deltas (dict): A map from primary keys to tuples of three items:
+                the change in the sum of scores, in the sum of squared scores,
+                and in the number of scores.
+        """
+        deltas = {primary_key: values for primary_key, values in deltas.items()
+                  if any(values)}
+        if not deltas:
+            return
+
+        # One ``UPDATE`` per batch of instances. (Every updated row evaluates
+        # the entire ``CASE``, so batches must be small.)
+        primary_keys = list(deltas)
+        batch_size = cls.AGGREGATE_UPDATE_BATCH_SIZE
+        for start in range(0, len(primary_keys), batch_size):
+            batch = primary_keys[start:start + batch_size]
+            updates = {}
+            for index, field_name in enumerate(cls.AGGREGATE_FIELD_NAMES):
+                output_field = cls._meta.get_field(field_name)
+                cases = [When(pk=primary_key, then=Value(deltas[primary_key][index]))
+                         for primary_key in batch]
+                updates[field_name] = F(field_name) + Case(*cases, default=Value(0),
+                                                           output_field=output_field)
+            cls.objects.filter(pk__in=batch).update(**updates)
+
+    @staticmethod
+    def calculate_score_stdev(score_sum, score_squared_sum, num_scores):
+        """ Compute the corrected standard deviation from score aggregates. """
         if num_scores < 2:
             return float('nan')
         stdev2 = (score_squared_sum - pow(score_sum, 2)/num_scores)/(num_scores - 1)
-        return pow(stdev2, 0.5)
+        return pow(max(stdev2, 0), 0.5)
 
-    @property
-    def score_sem(self):
-        score_sum, score_squared_sum, num_scores = self._score_aggregates
+    @staticmethod
+    def calculate_score_sem(score_sum, score_squared_sum, num_scores):
+        """ Compute the standard error of the mean from score aggregates. """
         if num_scores < 2:
             return float('nan')
-        stdev2 = (score_squared_sum - pow(score_sum, 2)/num_scores)/(num_scores - 1)
-        return pow(stdev2, 0.5)/num_scores**0.5
+        stdev = StatisticsMixin.calculate_score_stdev(score_sum, score_squared_sum,
+                                                      num_scores)
+        return stdev/num_scores**0.5
+
+    @property
+    def score_stdev(self):
+        return self.calculate_score_stdev(*self.get_score_aggregates())
+
+    @property
+    def score_sem(self):
+        return self.calculate_score_sem(*self.get_score_aggregates())
+
+    class Meta:
+        abstract = True
 
 
 class History(models.Model):
@@ -227,6 +364,34 @@ class Response(History):
         abstract = True
 
 
+class RatingQuerySet(models.QuerySet):
+    """
+    A ``RatingQuerySet`` keeps the score aggregates stored by
+    :class:`StatisticsMixin` consistent through bulk operations, which bypass
+    model signals.
+    """
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super(RatingQuerySet, self).bulk_create(objs, *args, **kwargs)
+        self.model.add_contributions(objs)
+        return objs
+
+    def update(self, **kwargs):
+        target_name = self.model.get_target_field().attname
+        fields_changed = set(kwargs) & {'score', 'active', target_name,
+                                        self.model.TARGET_FIELD_NAME}
+        if not fields_changed:
+            return super(RatingQuerySet, self).update(**kwargs)
+
+        target_ids = set(self.values_list(target_name, flat=True))
+        num_updated = super(RatingQuerySet, self).update(**kwargs)
+        for name in target_name, self.model.TARGET_FIELD_NAME:
+            if name in kwargs:
+                target_ids.add(getattr(kwargs[name], 'pk', kwargs[name]))
+        target_model = self.model.get_target_field().related_model
+        target_model.refresh_score_aggregates(target_ids - {None})
+        return num_updated
+
+
 class Rating(Response):
     """
     A ``Rating`` is an abstract model of a numeric response.
@@ -236,15 +401,60 @@ class Rating(Response):
             respondent never submitted (that is, a default value).
         SKIPPED: A sentinel value assigned to a ``Rating`` where the user
             intentionally chose to decline rating a question or a comment.
+        TARGET_FIELD_NAME (str): The name of the foreign key to the rated
+            object, whose model should inherit from :class:`StatisticsMixin`.
         score: An integer that quantifies a rating. (No scale is provided, by
             design. Interpreting the :attr:`score` is not the responsibility of
             this model.)
+        contribution (tuple): A pair consisting of the primary key of the rated
+            object and the score this rating contributes to its statistics, or
+            `None` if this rating should be excluded from statistics.
     """
     NOT_RATED = -2
     SKIPPED = -1
+    TARGET_FIELD_NAME = None
 
     score = models.SmallIntegerField(default=NOT_RATED)
 
+    objects = RatingQuerySet.as_manager()
+
+    @classmethod
+    def get_target_field(cls):
+        return cls._meta.get_field(cls.TARGET_FIELD_NAME)
+
+    @staticmethod
+    def make_contribution(target_id, score, active):
+        if active and score not in (Rating.SKIPPED, Rating.NOT_RATED):
+            return target_id, score
+        return None
+
+    @property
+    def contribution(self):
+        target_id = getattr(self, self.get_target_field().attname)
+        return self.make_contribution(target_id, self.score, self.active)
+
+    @classmethod
+    def add_contributions(cls, ratings, sign=1):
+        """
+        Add (or subtract) the contributions of ratings to the stored score
+        aggregates of the objects they rate.
+
+        Args:
+            ratings: An iterable of instances of this model, or of
+                contributions (see :attr:`contribution`).
+            sign (int): ``1`` to add the contributions, ``-1`` to subtract.
+        """
+        deltas = {}
+        for rating in ratings:
+            contribution = rating.contribution if isinstance(rating, Rating) else rating
+            if contribution is not None:
+                target_id, score = contribution
+                score_sum, score_squared_sum, num_scores = deltas.get(target_id, (0, 0, 0))
+                deltas[target_id] = (score_sum + sign*score,
+                                     score_squared_sum + sign*score*score,
+                                     num_scores + sign)
+        cls.get_target_field().related_model.add_score_aggregates(deltas)
+
     class Meta:
         abstract = True
 
@@ -257,6 +467,8 @@ class QuantitativeQuestionRating(Rating):
     Attributes:
         question: The quantitative question rated.
     """
+    TARGET_FIELD_NAME = 'question'
+
     question = models.ForeignKey('QuantitativeQuestion',
                                  on_delete=models.CASCADE,
                                  related_name='ratings')
@@ -298,6 +510,8 @@ class CommentRating(Rating):
     Attributes:
         comment: The comment rated.
     """
+    TARGET_FIELD_NAME = 'comment'
+
     comment = models.ForeignKey('Comment', on_delete=models.CASCADE,
                                 related_name='ratings')
 
@@ -338,11 +552,18 @@ class Comment(Response, StatisticsMixin):
     tag = models.CharField(max_length=256, blank=True, default='')
 
     def __unicode__(self):
-        if self.message is not None and self.message.strip():
-            message = self.message
-            if len(message) > self.MAX_COMMENT_DISPLAY_LEN:
-                message = message[:self.MAX_COMMENT_DISPLAY_LEN] + ' ...'
-            return 'Comment {1}: "{0}"'.format(message, self.id)
+        return self.describe(self.id, self.message)
+
+    @classmethod
+    def describe(cls, comment_id, message):
+        """
+        Describe a comment by its identifier and message (or a prefix of the
+        message at least ``MAX_COMMENT_DISPLAY_LEN + 1`` characters long).
+        """
+        if message is not None and message.strip():
+            if len(message) > cls.MAX_COMMENT_DISPLAY_LEN:
+                message = message[:cls.MAX_COMMENT_DISPLAY_LEN] + ' ...'
+            return 'Comment {1}: "{0}"'.format(message, comment_id)
         return '-- Empty response --'
 
     @property
@@ -515,6 +736,9 @@ class Respondent(History):
             infer a respondent's progression through this stage.
         completed_survey (bool): Whether the respondent completed the entire
             survey.
+        response_key (str): A key generated by the client that uniquely
+            identifies the submission that created this respondent, if the
+            client provided one. Resubmissions with the same key are ignored.
         num_questions_rated (int): The number of quantitative questions
             answered by this respondent. From this number, one can infer whether
             this respondent reached the rating stage of the survey. This
@@ -540,6 +764,8 @@ class Respondent(History):
                                 default='', validators=[LANGUAGE_VALIDATOR])
     submitted_personal_data = models.BooleanField(default=False)
     completed_survey = models.BooleanField(default=False)
+    response_key = models.CharField(max_length=64, unique=True, null=True,
+                                    blank=True, default=None, editable=False)
 
     def __unicode__(self):
         return 'Respondent {0}'.format(self.id)
@@ -561,3 +787,308 @@ class Respondent(History):
     @property
     def comments(self):
         return Comment.objects.filter(respondent=self).all()
+
+
+class PCASnapshot(models.Model):
+    """
+    A ``PCASnapshot`` stores the result of a principal component analysis of
+    the quantitative question ratings so the analysis need not be repeated on
+    every request.
+
+    Snapshots are insert-only. The snapshot with the largest :attr:`version`
+    is the current one.
+
+    Attributes:
+        version (int): A number that increases with every new snapshot. (This
+            is the primary key.)
+        timestamp (datetime.datetime): When this snapshot was computed.
+        num_respondents (int): The number of rows in the ratings matrix.
+        num_questions (int): The number of columns in the ratings matrix.
+        last_respondent_id (int): The largest respondent identifier that
+            existed when this snapshot was computed. Respondents with larger
+            identifiers are not represented in :attr:`arrays`.
+        _data (bytes): The serialized arrays. This field should only be used
+            internally by this model.
+        arrays (dict): A wrapper around :attr:`_data` that serializes and
+            unserializes a ``dict`` of NumPy arrays in the ``.npz`` format.
+            The arrays are:
+                * ``respondent_ids``: Length-`m` vector of respondent
+                  identifiers, in row order.
+                * ``question_ids``: Length-`n` vector of question identifiers,
+                  in column order.
+                * ``column_means``: Length-`n` vector of the mean of each
+                  column prior to normalization.
+                * ``components``: A `p` by `n` matrix whose rows are principal
+                  components.
+                * ``projections``: An `m` by `p` matrix of each respondent's
+                  normalized ratings projected onto the components.
+        age (datetime.timedelta): How long ago this snapshot was computed.
+    """
+    version = models.AutoField(primary_key=True)
+    timestamp = models.DateTimeField(auto_now_add=True)
+    num_respondents = models.PositiveIntegerField(default=0)
+    num_questions = models.PositiveIntegerField(default=0)
+    last_respondent_id = models.PositiveIntegerField(default=0)
+    _data = models.BinaryField(default=b'')
+
+    @property
+    def arrays(self):
+        archive = np.load(io.BytesIO(bytes(self._data)))
+        return {name: archive[name] for name in archive.files}
+
+    @arrays.setter
+    def arrays(self, arrays):
+        stream = io.BytesIO()
+        np.savez_compressed(stream, **arrays)
+        self._data = stream.getvalue()
+
+    @property
+    def age(self):
+        return timezone.now() - self.timestamp
+
+    def __unicode__(self):
+        return 'PCA snapshot {0}'.format(self.version)
+
+
+class QueuedResponse(models.Model):
+    """
+    A ``QueuedResponse`` is a submitted response that has been received, but
+    not yet validated or written as model instances.
+
+    When the response queue is enabled, submissions are stored as queued
+    responses so the request can complete immediately. The
+    ``processresponses`` command ingests them in batches. Queued responses
+    that are ingested successfully are deleted.
+
+    Attributes:
+        payload (str): The submitted response as a JSON object.
+        received (datetime.datetime): When the response was submitted.
+        failed (bool): Whether ingesting the response was attempted, but
+            failed. Failed responses are not retried automatically.
+        error (str): Why ingesting the response failed, if it did.
+    """
+    payload = models.TextField()
+    received = models.DateTimeField(auto_now_add=True)
+    failed = models.BooleanField(default=False, db_index=True)
+    error = models.TextField(blank=True, default='')
+
+    def __unicode__(self):
+        return 'Queued response {0}'.format(self.id)
+
+
+class ExportJob(models.Model):
+    """
+    An ``ExportJob`` is a request to export a ``QuerySet`` (or the whole
+    survey) as a file, which is produced outside the request cycle by the
+    ``runexports`` command.
+
+    Attributes:
+        PENDING, RUNNING, COMPLETED, FAILED (str): The possible values of
+            :attr:`status`.
+        STATUSES (tuple): Choices for the :attr:`status` field.
+        SURVEY_LABEL (str): The :attr:`model_label` of jobs that export every
+            survey model as one archive (see
+            :func:`pcari.exports.export_survey`).
+        model_label (str): The label of the exported model (for instance,
+            ``pcari.Comment``), or :attr:`SURVEY_LABEL`.
+        data_format (str): The file format to export (see
+            :func:`pcari.exports.export_data`).
+        _selection (str): The JSON-encoded filter arguments that select the
+            exported rows of the model. This field should only be used
+            internally by this model.
+        queryset: A wrapper around :attr:`_selection` that builds the
+            ``QuerySet`` to export (except for survey jobs). Assigning a
+            ``QuerySet`` stores either no filter (if it selects every row) or
+            the primary keys it selects, so stored jobs do not depend on how
+            the ``QuerySet`` was built.
+        status (str): The progress of this job, selected from
+            :attr:`STATUSES`.
+        created (datetime.datetime): When this job was requested.
+        started (datetime.datetime): When the export started, or `None`.
+        finished (datetime.datetime): When the export finished, or `None`.
+        updated (datetime.datetime): When this job last made progress. A
+            running job that has not been updated recently was interrupted.
+        rows_total (int): The number of rows to export, once known.
+        rows_processed (int): The number of rows exported so far.
+        last_primary_key: The primary key of the last row written so far,
+            where an interrupted job resumes (only for resumable formats).
+        bytes_written (int): The size of the output written so far.
+        filename (str): The name of the exported file, relative to the
+            ``EXPORT_JOB_DIRECTORY`` setting.
+        error (str): Why the export failed, if it did.
+        path (str): The absolute path of the exported file.
+        throughput (float): The average number of rows exported per second,
+            or `None` if the export has not started.
+    """
+    PENDING, RUNNING, COMPLETED, FAILED = 'pending', 'running', 'completed', 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    )
+    SURVEY_LABEL = 'survey'
+
+    model_label = models.CharField(max_length=128)
+    data_format = models.CharField(max_length=16)
+    _selection = models.TextField(default='{}')
+    status = models.CharField(max_length=16, choices=STATUSES, default=PENDING,
+                              db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True, default=None)
+    finished = models.DateTimeField(null=True, blank=True, default=None)
+    updated = models.DateTimeField(auto_now=True)
+    rows_total = models.PositiveIntegerField(null=True, blank=True, default=None)
+    rows_processed = models.PositiveIntegerField(default=0)
+    last_primary_key = models.PositiveIntegerField(null=True, blank=True, default=None)
+    bytes_written = models.BigIntegerField(default=0)
+    filename = models.CharField(max_length=255, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+
+    @property
+    def queryset(self):
+        model = apps.get_model(self.model_label)
+        return model.objects.filter(**json.loads(self._selection))
+
+    @queryset.setter
+    def queryset(self, queryset):
+        self.model_label = queryset.model._meta.label
+        selection = {}
+        if queryset.query.has_filters() or not queryset.query.can_filter():
+            selection['pk__in'] = list(queryset.values_list('pk', flat=True).order_by('pk'))
+        self._selection = json.dumps(selection)
+
+    @property
+    def path(self):
+        directory = getattr(settings, 'EXPORT_JOB_DIRECTORY',
+                            os.path.join(settings.BASE_DIR, 'exports'))
+        return os.path.join(directory, self.filename)
+
+    @property
+    def throughput(self):
+        if self.started is None:
+            return None
+        end = self.finished or timezone.now()
+        return self.rows_processed/max((end - self.started).total_seconds(), 1e-3)
+
+    def __unicode__(self):
+        return 'Export job {0}'.format(self.id)
+
+
+class ExportCheckpoint(models.Model):
+    """
+    An ``ExportCheckpoint`` records how far the ``exportchanges`` command has
+    exported a model, so that the next export only includes rows added or
+    changed since.
+
+    Attributes:
+        model_label (str): The label of the exported model (for instance,
+            ``pcari.Comment``).
+        last_primary_key: The largest primary key exported so far, or `None`
+            if nothing has been exported.
+        last_timestamp (datetime.datetime): The latest ``timestamp`` exported
+            so far (only for :class:`Response` models), or `None`.
+        last_change_id: The identifier of the latest :class:`RowChange` of
+            the model exported so far, or `None`.
+        rows_exported (int): The total number of rows exported so far.
+        updated (datetime.datetime): When this checkpoint last advanced.
+    """
+    model_label = models.CharField(max_length=128, unique=True)
+    last_primary_key = models.PositiveIntegerField(null=True, blank=True, default=None)
+    last_timestamp = models.DateTimeField(null=True, blank=True, default=None)
+    last_change_id = models.PositiveIntegerField(null=True, blank=True, default=None)
+    rows_exported = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return 'Export checkpoint for {0}'.format(self.model_label)
+
+
+class RowChange(models.Model):
+    """
+    A ``RowChange`` records that an existing row was modified in place (for
+    instance, marked as active or inactive), which neither allocates a new
+    primary key nor a new ``timestamp``, so that the ``exportchanges``
+    command exports the row again.
+
+    Changes are recorded by the admin's bulk actions and by the signal
+    handlers in :mod:`pcari.signals`. The table grows with every change until
+    ``exportchanges`` exports the changed rows of a model, which deletes the
+    changes it exported.
+
+    Attributes:
+        model_label (str): The label of the model of the changed row.
+        object_id (int): The primary key of the changed row.
+        changed (datetime.datetime): When the row was changed.
+    """
+    model_label = models.CharField(max_length=128)
+    object_id = models.PositiveIntegerField()
+    changed = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return 'Change of {0} {1}'.format(self.model_label, self.object_id)
+
+    @classmethod
+    def record(cls, model, primary_keys):
+        """ Record that the rows of a model with the given primary keys changed. """
+        cls.objects.bulk_create([cls(model_label=model._meta.label, object_id=primary_key)
+                                 for primary_key in primary_keys])
+
+    class Meta:
+        index_together = ('model_label', 'id')
+
+
+class DailyRollup(models.Model):
+    """
+    A ``DailyRollup`` aggregates the active ratings of one quantitative
+    question (or of all questions together) received on one day from
+    respondents who chose one language.
+
+    Rollups are maintained by the ``rollupmetrics`` command (see
+    :func:`pcari.metrics.update_daily_rollups`), so that reports over time
+    read a few rows per day rather than every rating.
+
+    Attributes:
+        date (datetime.date): The day (in the current time zone) the ratings
+            were received.
+        question: The :class:`QuantitativeQuestion` that was rated, or
+            `None` for the rollup of all questions.
+        language (str): The language of the respondents, or an empty string
+            for respondents who did not choose one.
+        num_respondents (int): The number of respondents who answered the
+            question (or any question), including those who skipped it.
+        num_ratings (int): The number of valid (that is, not skipped or
+            unrated) scores.
+        score_sum (int): The sum of the valid scores.
+        score_squared_sum (int): The sum of the squares of the valid scores.
+        updated (datetime.datetime): When this rollup was last computed.
+    """
+    date = models.DateField(db_index=True)
+    question = models.ForeignKey(QuantitativeQuestion, on_delete=models.CASCADE,
+                                 null=True, blank=True, default=None)
+    language = models.CharField(max_length=8, choices=LANGUAGES, blank=True, default='')
+    num_respondents = models.PositiveIntegerField(default=0)
+    num_ratings = models.PositiveIntegerField(default=0)
+    score_sum = models.BigIntegerField(default=0)
+    score_squared_sum = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        questions = ('question {0}'.format(self.question_id) if self.question_id is not None
+                     else 'all questions')
+        return 'Rollup of {0} on {1} ({2})'.format(questions, self.date,
+                                                   self.language or 'no language')
+
+    @property
+    def mean_score(self):
+        if self.num_ratings > 0:
+            return self.score_sum/self.num_ratings
+        return float('nan')
+
+    @property
+    def score_stdev(self):
+        return StatisticsMixin.calculate_score_stdev(self.score_sum, self.score_squared_sum,
+                                                     self.num_ratings)
+
+    class Meta:
+        unique_together = ('date', 'question', 'language')
@@ -0,0 +1,448 @@
+"""
+This module renders and caches the JSON payloads of the API endpoints, and
+identifies versions of the data they serve for conditional requests.
+
+Every question field is sent in every language, so rendering a payload
+involves many translation lookups. Questions rarely change, so each payload is
+rendered once, serialized, and stored in the Django cache, where every process
+can serve it as-is. A cached payload is identified by:
+
+    * A generation number (see :func:`invalidate_question_payloads`), which is
+      incremented whenever a question is saved or deleted.
+    * The largest identifier and number of active questions, which change
+      when questions are revised or (de)activated in bulk without signals.
+    * The modification time of the compiled translation catalogs, which
+      changes when ``./manage.py compilemessages`` is run.
+
+Clients on slow connections revalidate the resources they have already
+downloaded instead of fetching them again. The ``fetch_*`` views are
+decorated with :func:`conditional`, which attaches an ``ETag`` and (where
+one is known) a ``Last-Modified`` header describing the version of the underlying data. When
+the client's copy is still current, the view responds with ``304 Not
+Modified`` without rendering a payload at all.
+
+References:
+  * `Django Cache Framework <https://docs.djangoproject.com/en/dev/topics/cache/>`_
+  * `Conditional View Processing <https://docs.djangoproject.com/en/dev/topics/conditional-view-processing/>`_
+"""
+
+from __future__ import unicode_literals
+import collections
+import glob
+import hashlib
+import json
+import logging
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max, Sum
+from django.utils import timezone, translation
+from django.utils.translation import ugettext
+from django.views.decorators.http import condition
+
+from pcari.models import QualitativeQuestion, QuantitativeQuestion
+from pcari.models import Comment, CommentRating, QuantitativeQuestionRating
+from pcari.models import PCASnapshot
+from pcari.analysis import get_ratings_matrix_generation
+
+__all__ = [
+    'invalidate_question_payloads',
+    'translate_fields',
+    'render_qualitative_questions',
+    'render_quantitative_questions',
+    'get_question_payload',
+    'render_question_histograms',
+    'render_question_ratings_page',
+    'generate_question_ratings_json',
+    'generate_question_ratings_ndjson',
+    'conditional',
+    'get_question_version',
+    'get_comments_version',
+    'get_question_ratings_version',
+    'invalidate_comments',
+]
+
+LOGGER = logging.getLogger('pcari')
+
+QUESTION_PAYLOAD_GENERATION_KEY = 'pcari:question-payload-generation'
+QUESTION_PAYLOAD_TIMEOUT = 60*60  # Bounds staleness if a catalog is reloaded
+COMMENTS_GENERATION_KEY = 'pcari:comments-generation'
+
+DEFAULT_RATINGS_PAGE_SIZE = 10000  # Maximum number of ratings sent at once
+
+QuestionPayload = collections.namedtuple('QuestionPayload', ['content', 'etag', 'rendered'])
+
+
+def get_question_payload_generation():
+    """
+    Get the generation number of the question payloads shared by all processes.
+
+    Returns:
+        int: A counter that is incremented every time a question changes.
+    """
+    cache.add(QUESTION_PAYLOAD_GENERATION_KEY, 0, timeout=None)
+    return cache.get(QUESTION_PAYLOAD_GENERATION_KEY, 0)
+
+
+def invalidate_question_payloads():
+    """
+    Force every process to render the question payloads again on the next read.
+    """
+    cache.add(QUESTION_PAYLOAD_GENERATION_KEY, 0, timeout=None)
+    try:
+        cache.incr(QUESTION_PAYLOAD_GENERATION_KEY)
+    except ValueError:
+        cache.set(QUESTION_PAYLOAD_GENERATION_KEY, 1, timeout=None)
+    LOGGER.log(logging.DEBUG, 'Invalidated question payloads')
+
+
+def get_catalog_mtime():
+    """
+    Find when the compiled translation catalogs were last modified.
+
+    Returns:
+        float: The latest modification time of any ``.mo`` file in
+        ``settings.LOCALE_PATHS``, or zero if there are none.
+    """
+    mtimes = [os.path.getmtime(path) for locale_path in settings.LOCALE_PATHS
+              for path in glob.glob(os.path.join(locale_path, '*', 'LC_MESSAGES', '*.mo'))]
+    return max(mtimes or [0])
+
+
+def translate_fields(instances, field_names):
+    """
+    Translate fields of model instances into every language.
+
+    Each language is activated once for all instances (rather than once per
+    string), and the previously active language is restored afterwards.
+
+    Args:
+        instances: An iterable of model instances.
+        field_names: The names of the text fields to translate.
+
+    Returns:
+        dict: Maps each instance's identifier and field name to a ``dict``
+        mapping each language code in ``settings.LANGUAGES`` to the
+        translated field.
+    """
+    translations = {(instance.id, field_name): {}
+                    for instance in instances for field_name in field_names}
+    for code, _ in settings.LANGUAGES:
+        with translation.override(code):
+            for instance in instances:
+                for field_name in field_names:
+                    text = getattr(instance, field_name)
+                    translations[instance.id, field_name][code] = ugettext(text)
+    return translations
+
+
+def render_qualitative_questions(questions):
+    """
+    Render the payload of :func:`pcari.views.fetch_qualitative_questions`.
+    """
+    translations = translate_fields(questions, ['prompt'])
+    return {str(question.id): translations[question.id, 'prompt']
+            for question in questions}
+
+
+def render_quantitative_questions(questions):
+    """
+    Render the payload of :func:`pcari.views.fetch_quantitative_questions`.
+    """
+    translations = translate_fields(questions, ['prompt', 'left_anchor', 'right_anchor'])
+    return {
+        str(question.id): {
+            'prompts': translations[question.id, 'prompt'],
+            'left-anchors': translations[question.id, 'left_anchor'],
+            'right-anchors': translations[question.id, 'right_anchor'],
+            'min-score': question.min_score,
+            'max-score': question.max_score,
+            'input-type': question.input_type,
+        } for question in questions
+    }
+
+
+QUESTION_PAYLOAD_RENDERERS = {
+    QualitativeQuestion: render_qualitative_questions,
+    QuantitativeQuestion: render_quantitative_questions,
+}
+
+
+def get_question_payload(model, request=None):
+    """
+    Get the serialized payload of the active questions of a model.
+
+    Args:
+        model: One of the models in :data:`QUESTION_PAYLOAD_RENDERERS`.
+        request: If given, the payload is looked up at most once per request
+            (for instance, once for both the entity tag and the response).
+
+    Returns:
+        QuestionPayload: A tuple of the payload as UTF-8 encoded JSON, a hash
+        of the payload (for use as an entity tag), and when the payload was
+        rendered. The payload is read from the cache if possible.
+    """
+    if request is not None:
+        payloads = request.__dict__.setdefault('question_payloads', {})
+        if model not in payloads:
+            payloads[model] = get_question_payload(model)
+        return payloads[model]
+
+    questions = model.objects.filter(active=True)
+    marker = questions.aggregate(last_id=Max('id'), count=Count('id'))
+    key = 'pcari:question-payloads:{0}:{1}:{2}:{3}:{4}'.format(
+        model._meta.label, get_question_payload_generation(),
+        marker['last_id'], marker['count'], get_catalog_mtime())
+
+    payload = cache.get(key)
+    if payload is None:
+        data = QUESTION_PAYLOAD_RENDERERS[model](list(questions))
+        content = json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+        payload = QuestionPayload(content, hashlib.sha1(content).hexdigest(),
+                                  timezone.now())
+        cache.set(key, payload, timeout=QUESTION_PAYLOAD_TIMEOUT)
+        LOGGER.log(logging.DEBUG, 'Rendered %s payload (%d bytes)',
+                   model.__name__, len(content))
+    return payload
+
+
+def render_question_histograms():
+    """
+    Count the ratings of each active quantitative question by score.
+
+    The counts are computed by the database with a single ``GROUP BY`` query,
+    so no individual rating is transferred.
+
+    Returns:
+        dict: Maps each question identifier (as a string) to a ``dict``
+        mapping each score (as a string) to the number of active ratings of
+        the question with that score. Skipped and unrated questions are
+        included with their sentinel scores.
+    """
+    ratings = QuantitativeQuestionRating.objects.filter(active=True, question__active=True)
+    counts = ratings.values_list('question_id', 'score').annotate(count=Count('id'))
+    histograms = collections.defaultdict(dict)
+    for question_id, score, count in counts.order_by():
+        histograms[str(question_id)][str(score)] = count
+    return dict(histograms)
+
+
+def get_ratings_page_size():
+    return getattr(settings, 'RATINGS_PAGE_SIZE', DEFAULT_RATINGS_PAGE_SIZE)
+
+
+def get_question_ratings(after=0):
+    """
+    Select active ratings of active quantitative questions with identifiers
+    greater than ``after``, as tuples of the identifier, question identifier,
+    and score, in order of identifier.
+    """
+    ratings = QuantitativeQuestionRating.objects.filter(active=True, question__active=True,
+                                                        id__gt=after)
+    return ratings.order_by('id').values_list('id', 'question_id', 'score')
+
+
+def render_question_ratings_page(after=0, limit=None):
+    """
+    Render one page of the payload of :func:`pcari.views.fetch_question_ratings`.
+
+    Pages are delimited by rating identifiers (rather than offsets), so each
+    page costs one indexed range query, no matter how deep into the ratings
+    it is.
+
+    Args:
+        after (int): The identifier of the last rating of the previous page,
+            or zero for the first page.
+        limit (int): The maximum number of ratings on the page, which is at
+            most (and by default) the ``RATINGS_PAGE_SIZE`` setting.
+
+    Returns:
+        tuple: The page, and the identifier to pass as ``after`` to fetch the
+        next page (or `None` if this is the last page).
+    """
+    page_size = get_ratings_page_size()
+    limit = page_size if limit is None else max(min(limit, page_size), 1)
+    ratings = list(get_question_ratings(after)[:limit + 1])
+    next_cursor = ratings[limit - 1][0] if len(ratings) > limit else None
+    page = {str(rating_id): {'qid': question_id, 'score': score}
+            for rating_id, question_id, score in ratings[:limit]}
+    return page, next_cursor
+
+
+def iterate_question_ratings_pages(after=0):
+    """
+    Fetch every rating after a cursor one page (of at most ``RATINGS_PAGE_SIZE``
+    ratings) at a time, as lists of tuples (see :func:`get_question_ratings`).
+    """
+    page_size = get_ratings_page_size()
+    while True:
+        ratings = list(get_question_ratings(after)[:page_size])
+        if not ratings:
+            break
+        yield ratings
+        after = ratings[-1][0]
+
+
+def generate_question_ratings_json():
+    """
+    Generate the payload of every rating as one JSON object, in the format of
+    :func:`render_question_ratings_page`.
+
+    Ratings are fetched one page at a time, so memory usage does not depend on
+    the number of ratings.
+
+    Yields:
+        bytes: Fragments of the JSON object, one page at a time.
+    """
+    separator = '{'
+    for ratings in iterate_question_ratings_pages():
+        members = [json.dumps(str(rating_id)) + ': ' +
+                   json.dumps({'qid': question_id, 'score': score})
+                   for rating_id, question_id, score in ratings]
+        yield (separator + ', '.join(members)).encode('utf-8')
+        separator = ', '
+    yield b'{}' if separator == '{' else b'}'
+
+
+def generate_question_ratings_ndjson(after=0):
+    """
+    Generate every rating after a cursor as newline-delimited JSON.
+
+    Ratings are fetched one page at a time, so memory usage does not depend on
+    the number of ratings.
+
+    Args:
+        after (int): The identifier of the last rating already fetched.
+
+    Yields:
+        bytes: Lines of JSON objects of the form ``{"id": <rating.id>, "qid":
+        <question.id>, "score": <rating.score>}``, one page at a time.
+    """
+    for ratings in iterate_question_ratings_pages(after):
+        lines = [json.dumps({'id': rating_id, 'qid': question_id, 'score': score}) + '\n'
+                 for rating_id, question_id, score in ratings]
+        yield ''.join(lines).encode('utf-8')
+
+
+def conditional(get_version):
+    """
+    Make a decorator that adds conditional request processing to a view.
+
+    Args:
+        get_version: A callable that takes the same arguments as the view and
+            returns a tuple of the entity tag and the last modification time
+            (or `None`) of the data the view would respond with. The callable
+            is called at most once per request.
+
+    Returns:
+        A view decorator. (See ``django.views.decorators.http.condition``.)
+    """
+    def get_cached_version(request, *args, **kwargs):
+        if not hasattr(request, 'data_version'):
+            request.data_version = get_version(request, *args, **kwargs)
+        return request.data_version
+
+    return condition(
+        etag_func=lambda *args, **kwargs: get_cached_version(*args, **kwargs)[0],
+        last_modified_func=lambda *args, **kwargs: get_cached_version(*args, **kwargs)[1],
+    )
+
+
+def hash_version(*components):
+    """ Hash the components identifying a version of some data as an entity tag. """
+    return hashlib.sha1(repr(components).encode('utf-8')).hexdigest()
+
+
+def get_latest(*timestamps):
+    """ Find the latest of some timestamps, ignoring missing ones. """
+    timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+    return max(timestamps) if timestamps else None
+
+
+def get_question_version(model):
+    """
+    Make a function that identifies the version of a question payload (see
+    :func:`conditional`).
+    """
+    def get_version(request):
+        payload = get_question_payload(model, request)
+        return payload.etag, payload.rendered
+    return get_version
+
+
+def get_comments_generation():
+    """
+    Get the generation number of the comments shared by all processes.
+
+    Returns:
+        int: A counter that is incremented every time an existing comment
+        changes (for instance, when it is flagged or deactivated).
+    """
+    cache.add(COMMENTS_GENERATION_KEY, 0, timeout=None)
+    return cache.get(COMMENTS_GENERATION_KEY, 0)
+
+
+def invalidate_comments():
+    """
+    Force every client to fetch the comments again, since an existing comment
+    changed in a way new identifiers cannot reveal.
+    """
+    cache.add(COMMENTS_GENERATION_KEY, 0, timeout=None)
+    try:
+        cache.incr(COMMENTS_GENERATION_KEY)
+    except ValueError:
+        cache.set(COMMENTS_GENERATION_KEY, 1, timeout=None)
+    LOGGER.log(logging.DEBUG, 'Invalidated comments')
+
+
+def get_comments_version(request):
+    """
+    Identify the version of the data :func:`pcari.views.fetch_comments`
+    samples from (see :func:`conditional`).
+
+    Besides new comments, ratings, and snapshots, the version reflects
+    in-place changes to comments (see :func:`invalidate_comments`), to the
+    ratings matrix that authors are projected from (see
+    :func:`pcari.analysis.invalidate_ratings_matrix`), and to the score
+    aggregates stored on comments (which change whenever a comment rating is
+    changed, however it is changed).
+
+    Comments are sampled at random, so two responses for the same version may
+    differ, and the entity tag is weak. Either response is an equally valid
+    sample, so a client holding either one need not fetch another.
+    """
+    comments = Comment.objects.filter(active=True, flagged=False).exclude(message='')
+    comments = comments.aggregate(last_id=Max('id'), count=Count('id'),
+                                  last_modified=Max('timestamp'), score_sum=Sum('_score_sum'),
+                                  score_squared_sum=Sum('_score_squared_sum'),
+                                  num_scores=Sum('_num_scores'))
+    ratings = CommentRating.objects.aggregate(last_id=Max('id'),
+                                              last_modified=Max('timestamp'))
+    snapshot = (PCASnapshot.objects.order_by('-version')
+                .values_list('version', 'timestamp').first()) or (None, None)
+    etag = hash_version(request.GET.get('limit'), comments['last_id'], comments['count'],
+                        comments['score_sum'], comments['score_squared_sum'],
+                        comments['num_scores'], ratings['last_id'], snapshot[0],
+                        get_comments_generation(), get_ratings_matrix_generation())
+    last_modified = get_latest(comments['last_modified'], ratings['last_modified'],
+                               snapshot[1])
+    return 'W/"{0}"'.format(etag), last_modified
+
+
+def get_question_ratings_version(request):
+    """
+    Identify the version of the data :func:`pcari.views.fetch_question_ratings`
+    serves (see :func:`conditional`). Each page has its own version.
+
+    New ratings are detected from the largest rating identifier, which is read
+    from the primary key index, and in-place changes (such as ratings or
+    questions being deactivated) from the ratings matrix generation (see
+    :func:`pcari.analysis.invalidate_ratings_matrix`), so no ratings are
+    scanned. Because in-place changes have no timestamp, no
+    ``Last-Modified`` time is given.
+    """
+    last_id = QuantitativeQuestionRating.objects.aggregate(last_id=Max('id'))['last_id']
+    etag = hash_version(request.GET.urlencode(), last_id, get_ratings_matrix_generation())
+    return etag, None
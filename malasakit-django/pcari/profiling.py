@@ -0,0 +1,35 @@
+"""
+This module defines tools for measuring the performance of the application.
+"""
+
+from __future__ import unicode_literals
+import logging
+import time
+
+import decorator
+
+__all__ = ['profile']
+
+LOGGER = logging.getLogger('pcari')
+
+
+@decorator.decorator
+def profile(function, *args, **kwargs):
+    """
+    Log the runtime of a function call.
+
+    Args:
+        function: The callable to profile.
+        args: Additional positional arguments to ``function``.
+        kwargs: Additional keyword arguments to ``function``.
+
+    Returns:
+        The result of applying ``function`` to ``args`` and ``kwargs``.
+    """
+    start_time = time.time()
+    result = function(*args, **kwargs)
+    end_time = time.time()
+    time_elapsed = end_time - start_time
+    LOGGER.log(logging.DEBUG, 'Call to "%s" took %.3f seconds',
+               function.__name__, time_elapsed)
+    return result
@@ -7,10 +7,13 @@ References:
 
 from __future__ import unicode_literals
 
-from django.db.models.signals import pre_delete, post_delete
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 from django.dispatch import receiver
 
-from pcari.models import History
+from pcari.models import History, Rating, QualitativeQuestion, QuantitativeQuestion
+from pcari.models import Comment, QuantitativeQuestionRating, RowChange
+from pcari.analysis import RATINGS_MATRIX_MODELS, invalidate_ratings_matrix
+from pcari.payloads import invalidate_question_payloads, invalidate_comments
 
 
 @receiver(pre_delete)
@@ -38,3 +41,111 @@ def resolve_history_on_deletion(**kwargs):
         if instance.predecessor is not None:
             instance.predecessor.active = instance.active
             instance.predecessor.save()
+
+
+@receiver(pre_save)
+def stash_active_flag(**kwargs):
+    """ Record whether an existing `History` instance was active before it changes. """
+    sender, instance = kwargs['sender'], kwargs['instance']
+    if issubclass(sender, History):
+        was_active, update_fields = None, kwargs['update_fields']
+        if instance.pk is not None and not kwargs['raw'] \
+                and (update_fields is None or 'active' in update_fields):
+            query = sender.objects.using(kwargs['using']).filter(pk=instance.pk)
+            was_active = query.values_list('active', flat=True).first()
+        # pylint: disable=protected-access
+        instance._was_active = was_active
+
+
+@receiver(post_save)
+def record_history_change(**kwargs):
+    """
+    Log existing `History` instances being marked as active or inactive in
+    place, so that incremental exports include them. (Other saves of existing
+    instances, which do not change the ``active`` flag, are not logged.)
+
+    The log grows with every such change until the ``exportchanges`` command
+    exports the changed rows and prunes it.
+    """
+    sender, instance = kwargs['sender'], kwargs['instance']
+    if issubclass(sender, History) and not kwargs['created'] and not kwargs['raw']:
+        was_active = getattr(instance, '_was_active', None)
+        if was_active is not None and was_active != instance.active:
+            RowChange.objects.using(kwargs['using']).create(model_label=sender._meta.label,
+                                                            object_id=instance.pk)
+
+
+@receiver(post_save)
+def invalidate_ratings_matrix_on_change(**kwargs):
+    """
+    Ensure in-place changes to existing ratings and questions (which allocate
+    no new identifier) invalidate the ratings matrix and the entity tags of
+    the ratings payloads.
+    """
+    sender = kwargs['sender']
+    if issubclass(sender, (QuantitativeQuestion, QuantitativeQuestionRating)) \
+            and not kwargs['created'] and not kwargs['raw']:
+        invalidate_ratings_matrix()
+
+
+@receiver(post_delete)
+def invalidate_ratings_matrix_on_deletion(**kwargs):
+    """
+    Ensure deleted respondents, questions, and ratings do not linger in the
+    ratings matrix.
+    """
+    if issubclass(kwargs['sender'], RATINGS_MATRIX_MODELS):
+        invalidate_ratings_matrix()
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_question_payloads_on_change(**kwargs):
+    """ Ensure the cached question payloads reflect saved and deleted questions. """
+    if issubclass(kwargs['sender'], (QualitativeQuestion, QuantitativeQuestion)):
+        invalidate_question_payloads()
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_comments_on_change(**kwargs):
+    """ Ensure clients fetch the comments again after a comment changes in place. """
+    if issubclass(kwargs['sender'], Comment) and not kwargs.get('created') \
+            and not kwargs.get('raw'):
+        invalidate_comments()
+
+
+@receiver(pre_save)
+def stash_rating_contribution(**kwargs):
+    """ Record what an existing rating contributed to statistics before it changes. """
+    sender, instance = kwargs['sender'], kwargs['instance']
+    if issubclass(sender, Rating):
+        contribution = None
+        if instance.pk is not None:
+            query = sender.objects.using(kwargs['using']).filter(pk=instance.pk)
+            target_name = sender.get_target_field().attname
+            values = query.values_list(target_name, 'score', 'active').first()
+            if values is not None:
+                contribution = sender.make_contribution(*values)
+        # pylint: disable=protected-access
+        instance._old_contribution = contribution
+
+
+@receiver(post_save)
+def update_statistics_on_save(**kwargs):
+    """ Update the stored score aggregates of the object a rating rates. """
+    sender, instance = kwargs['sender'], kwargs['instance']
+    if issubclass(sender, Rating):
+        old_contribution = getattr(instance, '_old_contribution', None)
+        new_contribution = instance.contribution
+        if old_contribution != new_contribution:
+            sender.add_contributions([old_contribution], sign=-1)
+            sender.add_contributions([new_contribution])
+
+
+@receiver(post_delete)
+def update_statistics_on_deletion(**kwargs):
+    """ Remove a deleted rating from the stored score aggregates. """
+    sender, instance = kwargs['sender'], kwargs['instance']
+    if issubclass(sender, Rating):
+        sender.add_contributions([instance], sign=-1)
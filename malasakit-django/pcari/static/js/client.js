@@ -13,6 +13,7 @@ const APP_URL_ROOT = '';  // TODO: Change to `/pcari` in production
 const API_URL_ROOT = APP_URL_ROOT + '/api';
 const STATIC_URL_ROOT = APP_URL_ROOT + '/static';
 const RESPONSE_SAVE_ENDPOINT = API_URL_ROOT + '/save-response/';
+const RESPONSES_SAVE_ENDPOINT = API_URL_ROOT + '/save-responses/';
 
 const RESPONSE_KEY_PREFIX = 'response-';
 const EMPTY_RESPONSE = {
@@ -133,13 +134,25 @@ class Resource {
     fetch() {
         var resource = this;  // Alias to avoid conflicts in callbacks
         if (resource.endpoint !== undefined) {
+            // Revalidate the copy we already have, if any, so that unchanged
+            // data are not downloaded again
+            var headers = {};
+            if (resource.etag && resource.data !== null) {
+                headers['If-None-Match'] = resource.etag;
+            }
             $.ajax(resource.endpoint, {
+                headers: headers,
                 timeout: resource.timeout || DEFAULT_TIMEOUT,
-                success: function(data) {
-                    resource.data = data;
+                success: function(data, textStatus, xhr) {
+                    if (xhr.status === 304) {
+                        console.log('Resource ' + resource.name + ' is unchanged');
+                    } else {
+                        resource.data = data;
+                        resource.etag = xhr.getResponseHeader('ETag');
+                        console.log('Successfully fetched ' + resource.name);
+                    }
                     resource.updateTimestamp();
                     resource.put();
-                    console.log('Successfully fetched ' + resource.name);
                 },
                 failure: function() {
                     console.log('Failed to fetch data for ' + resource.name);
@@ -205,7 +218,10 @@ function isResponseName(resourceName) {
 
 function initializeNewResponse() {
     var now = getCurrentTimestamp();
-    var responseKey = RESPONSE_KEY_PREFIX + now.toString();
+    // The random suffix keeps keys unique across devices, since the server
+    // uses the key to recognize resubmitted responses
+    var suffix = Math.random().toString(36).slice(2, 10);
+    var responseKey = RESPONSE_KEY_PREFIX + now.toString() + '-' + suffix;
     var response = new Resource(responseKey, now, Infinity,
                                 API_URL_ROOT + '/save-response/',
                                 DEFAULT_TIMEOUT, EMPTY_RESPONSE);
@@ -254,16 +270,44 @@ function postprocess(responseData) {
 }
 
 function pushCompletedResponses() {
+    // Submit all completed responses in a single request
     var resourceNames = Resource.loadNames();
     var currentResponseName = Resource.load('current').data;
+    var responses = [];
     for (var index in resourceNames) {
         var name = resourceNames[index];
         if (isResponseName(name) && name !== currentResponseName) {
             var response = Resource.load(name);
             postprocess(response.data);
-            response.push();
+            response.data['response-key'] = response.name;
+            responses.push(response);
         }
     }
+
+    if (responses.length === 0) {
+        return;
+    }
+
+    $.ajax(RESPONSES_SAVE_ENDPOINT, {
+        method: 'POST',
+        data: JSON.stringify(responses.map(response => response.data)),
+        timeout: DEFAULT_TIMEOUT,
+        success: function(data) {
+            data.results.forEach(function(result, index) {
+                var response = responses[index];
+                if (result.saved) {
+                    console.log('Successfully pushed ' + response.name);
+                    response.delete();
+                } else {
+                    console.log('Failed to push data for ' + response.name
+                                + ': ' + result.error);
+                }
+            });
+        },
+        error: function() {
+            console.log('Failed to push ' + responses.length + ' responses');
+        },
+    });
 }
 
 function getCookie(name) {
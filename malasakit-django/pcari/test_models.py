@@ -4,9 +4,11 @@ This module defines unit tests of model behavior.
 
 from __future__ import unicode_literals
 import math
+import os
 import random
 
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
 from django.db import IntegrityError
 from django.test import TestCase, TransactionTestCase
 
@@ -69,6 +71,11 @@ class StatisticsTests(TestCase):
             ) for _ in range(random.randrange(100))
         ])
 
+    def setUp(self):
+        # The stored aggregates were updated after these instances were loaded
+        for instance in [self.question, self.question_no_ratings, self.comment]:
+            instance.refresh_from_db()
+
     def test_num_ratings(self):
         self.assertEqual(self.question.num_ratings, 4)
         QuantitativeQuestionRating.objects.create(
@@ -76,6 +83,7 @@ class StatisticsTests(TestCase):
             score=6,
             respondent=Respondent.objects.create(language='en')
         )
+        self.question.refresh_from_db()
         self.assertEqual(self.question.num_ratings, 5)
         self.assertEqual(self.question_no_ratings.num_ratings, 0)
         self.assertEqual(self.comment.num_ratings, 2)
@@ -85,6 +93,7 @@ class StatisticsTests(TestCase):
         self.assertTrue(math.isnan(self.question_no_ratings.mean_score))
         self.assertAlmostEqual(self.comment.mean_score, 1.5)
         CommentRating.objects.filter(score=3, active=True).delete()
+        self.comment.refresh_from_db()
         self.assertAlmostEqual(self.comment.mean_score, 0)
 
     def test_mode_score(self):
@@ -98,6 +107,7 @@ class StatisticsTests(TestCase):
         self.assertAlmostEqual(self.question.score_stdev, 2.87228132327)
         self.assertAlmostEqual(self.comment.score_stdev, 2.1213203435596424)
         CommentRating.objects.filter(score=3, active=True).delete()
+        self.comment.refresh_from_db()
         self.assertTrue(math.isnan(self.comment.score_stdev))
 
     def test_score_sem(self):
@@ -105,6 +115,78 @@ class StatisticsTests(TestCase):
         self.assertTrue(math.isnan(self.question_no_ratings.score_sem))
         self.assertAlmostEqual(self.comment.score_sem, 1.5)
 
+    def test_loaded_statistics(self):
+        questions = list(QuantitativeQuestion.objects.all())
+        with self.assertNumQueries(0):
+            statistics = [(question.num_ratings, question.mean_score, question.score_sem)
+                          for question in questions]
+        self.assertEqual(statistics[0][0], 4)
+
+
+class StoredStatisticsTests(TestCase):
+    """ Ensure stored score aggregates track changes to ratings. """
+    def setUp(self):
+        self.question = QuantitativeQuestion.objects.create()
+        self.other_question = QuantitativeQuestion.objects.create()
+
+    def assertAggregatesConsistent(self):
+        for question in QuantitativeQuestion.objects.all():
+            expected = QuantitativeQuestion.compute_score_aggregates([question.pk])
+            self.assertEqual(question.get_score_aggregates(refresh=False),
+                             expected.get(question.pk, (0, 0, 0)))
+
+    def test_single_instance_changes(self):
+        rating = QuantitativeQuestionRating.objects.create(
+            question=self.question,
+            score=5,
+            respondent=Respondent.objects.create(),
+        )
+        self.assertAggregatesConsistent()
+        for attribute, value in [('score', 7), ('score', -1), ('score', 3),
+                                 ('active', False), ('active', True),
+                                 ('question', self.other_question)]:
+            setattr(rating, attribute, value)
+            rating.save()
+            self.assertAggregatesConsistent()
+        rating.delete()
+        self.assertAggregatesConsistent()
+        self.other_question.refresh_from_db()
+        self.assertEqual(self.other_question.num_ratings, 0)
+
+    def test_bulk_changes(self):
+        QuantitativeQuestionRating.objects.bulk_create([
+            QuantitativeQuestionRating(
+                question=random.choice([self.question, self.other_question]),
+                score=random.randint(-2, 9),
+                respondent=Respondent.objects.create(),
+                active=random.choice([True, False]),
+            ) for _ in range(random.randrange(1, 100))
+        ])
+        self.assertAggregatesConsistent()
+        QuantitativeQuestionRating.objects.filter(score__gt=4).update(active=False)
+        self.assertAggregatesConsistent()
+        QuantitativeQuestionRating.objects.filter(score=0).update(score=9)
+        self.assertAggregatesConsistent()
+        QuantitativeQuestionRating.objects.filter(score=1).update(question=self.question)
+        self.assertAggregatesConsistent()
+        QuantitativeQuestionRating.objects.filter(active=False).delete()
+        self.assertAggregatesConsistent()
+        self.question.delete()
+        self.assertAggregatesConsistent()
+
+    def test_recompute_statistics(self):
+        for score in range(10):
+            QuantitativeQuestionRating.objects.create(
+                question=self.question,
+                score=score,
+                respondent=Respondent.objects.create(),
+            )
+        QuantitativeQuestion.objects.update(_num_scores=0, _score_sum=3)
+        call_command('recomputestats', stdout=open(os.devnull, 'w'))
+        self.assertAggregatesConsistent()
+        self.assertEqual(self.question.get_score_aggregates(refresh=True)[2], 10)
+        self.assertEqual(self.question.num_ratings, 10)
+
 
 class PropertyTests(TestCase):
     """ Test other dynamically computed model attributes. """
@@ -3,24 +3,43 @@ This module defines unit tests for views.
 """
 
 from __future__ import unicode_literals
+import datetime
+import io
 import json
 import logging
 import os
 import random
+import shutil
+import tempfile
 import time
 import warnings
+import zipfile
 
 from django.conf import settings
-from django.db import IntegrityError
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone, translation
+from django.utils.html import escape
 import numpy as np
 
 from pcari.models import Respondent
 from pcari.models import QuantitativeQuestion, QualitativeQuestion
 from pcari.models import Comment, QuantitativeQuestionRating, CommentRating
+from pcari.models import PCASnapshot, QueuedResponse, ExportJob, ExportCheckpoint
+from pcari.models import DailyRollup, RowChange
 from pcari.views import (generate_ratings_matrix, normalize_ratings_matrix,
-                         calculate_principal_components)
+                         calculate_principal_components, compute_pca_snapshot)
+from pcari.analysis import RatingsMatrixStore, invalidate_ratings_matrix
+from pcari.exports import export_csv, export_data, export_survey, iterate_in_chunks
+from pcari.exports import claim_export_job, run_export_job, export_changes
+from pcari.management.commands.benchmarkexport import export_instances_csv
+from pcari.metrics import get_survey_statistics, update_daily_rollups
+from pcari.admin import site
 
 PAGE_ENDPOINTS = ['landing', 'quantitative-questions', 'peer-responses',
                   'rate-comments', 'personal-information', 'end']
@@ -76,6 +95,144 @@ class ResourceFetchTestCase(TestCase):
             for code in translated_prompts:
                 self.assertTrue(code in dict(settings.LANGUAGES))
 
+    def test_question_payload_cache(self):
+        question = QuantitativeQuestion.objects.create(prompt='First')
+        url = reverse('fetch-quantitative-questions')
+        data = json.loads(self.client.get(url).content)
+        self.assertEqual(data[str(question.id)]['prompts']['en'], 'First')
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(json.loads(response.content), data)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+        question.prompt = 'Second'
+        question.save()
+        data = json.loads(self.client.get(url).content)
+        self.assertEqual(data[str(question.id)]['prompts']['en'], 'Second')
+        QuantitativeQuestion.objects.filter(id=question.id).update(active=False)
+        self.assertEqual(json.loads(self.client.get(url).content), {})
+
+    def test_conditional_fetch(self):
+        self.addCleanup(invalidate_ratings_matrix)
+        question = QuantitativeQuestion.objects.create()
+        respondent = Respondent.objects.create()
+        QuantitativeQuestionRating.objects.create(question=question, respondent=respondent,
+                                                  score=3)
+        Comment.objects.create(question=QualitativeQuestion.objects.create(),
+                               respondent=respondent, message='?')
+        compute_pca_snapshot()
+        for endpoint in ['fetch-comments', 'fetch-quantitative-questions',
+                         'fetch-qualitative-questions', 'fetch-question-ratings']:
+            response = self.client.get(reverse(endpoint))
+            self.assertEqual(response.status_code, 200)
+            if endpoint != 'fetch-question-ratings':
+                self.assertTrue(response.has_header('Last-Modified'))
+            etag = response['ETag']
+            response = self.client.get(reverse(endpoint), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+
+        url = reverse('fetch-question-ratings')
+        etag = self.client.get(url)['ETag']
+        QuantitativeQuestionRating.objects.create(question=question, score=4,
+                                                  respondent=Respondent.objects.create())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 2)
+        etag = response['ETag']
+        rating = QuantitativeQuestionRating.objects.get(score=4)
+        rating.active = False
+        rating.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 1)
+
+    def test_conditional_fetch_comments_after_changes(self):
+        self.addCleanup(invalidate_ratings_matrix)
+        respondent = Respondent.objects.create()
+        comment = Comment.objects.create(question=QualitativeQuestion.objects.create(),
+                                         respondent=respondent, message='?')
+        for score in [1, 5]:
+            CommentRating.objects.create(comment=comment, respondent=Respondent.objects.create(),
+                                         score=score)
+        compute_pca_snapshot()
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        admin_client = Client()
+        admin_client.login(username='admin', password='password')
+
+        url = reverse('fetch-comments')
+        etag = self.client.get(url)['ETag']
+        for action in ['flag_comments', 'unflag_comments', 'mark_inactive', 'mark_active']:
+            admin_client.post(reverse('admin:pcari_comment_changelist'),
+                              {'action': action, '_selected_action': [comment.id]})
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, action)
+            etag = response['ETag']
+        standard_error = json.loads(response.content)[str(comment.id)]['sem']
+        CommentRating.objects.filter(comment=comment, score=5).update(active=False)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(json.loads(response.content)[str(comment.id)]['sem'], standard_error)
+
+    def test_conditional_fetch_without_snapshot(self):
+        self.addCleanup(invalidate_ratings_matrix)
+        respondent = Respondent.objects.create()
+        Comment.objects.create(question=QualitativeQuestion.objects.create(),
+                               respondent=respondent, message='?')
+        self.assertFalse(PCASnapshot.objects.exists())
+        response = self.client.get(reverse('fetch-comments'))
+        self.assertTrue(PCASnapshot.objects.exists())
+        response = self.client.get(reverse('fetch-comments'),
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_fetch_question_histograms(self):
+        questions = [QuantitativeQuestion.objects.create() for _ in range(2)]
+        scores = [3, 3, 5, QuantitativeQuestionRating.SKIPPED]
+        for score in scores:
+            respondent = Respondent.objects.create()
+            for question in questions:
+                QuantitativeQuestionRating.objects.create(respondent=respondent,
+                                                          question=question, score=score)
+        QuantitativeQuestionRating.objects.filter(question=questions[1],
+                                                  score=5).update(active=False)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('fetch-question-histograms'))
+        self.assertEqual(json.loads(response.content), {
+            str(questions[0].id): {'3': 2, '5': 1, '-1': 1},
+            str(questions[1].id): {'3': 2, '-1': 1},
+        })
+
+    @override_settings(RATINGS_PAGE_SIZE=3)
+    def test_fetch_question_ratings_pages(self):
+        question = QuantitativeQuestion.objects.create()
+        for score in range(8):
+            QuantitativeQuestionRating.objects.create(question=question, score=score,
+                                                      respondent=Respondent.objects.create())
+        url, ratings, params = reverse('fetch-question-ratings'), {}, {'limit': 3}
+        while True:
+            response = self.client.get(url, params)
+            page = json.loads(response.content)
+            self.assertLessEqual(len(page), 3)
+            ratings.update(page)
+            if not response.has_header('X-Next-Cursor'):
+                break
+            params = {'after': response['X-Next-Cursor']}
+        self.assertEqual(sorted(rating['score'] for rating in ratings.values()), list(range(8)))
+        page = json.loads(self.client.get(url, {'limit': 2}).content)
+        self.assertEqual(len(page), 2)
+        self.assertEqual(self.client.get(url, {'after': 'a'}).status_code, 400)
+        response = self.client.get(url)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), ratings)
+        self.assertFalse(response.has_header('X-Next-Cursor'))
+
+        response = self.client.get(url, {'format': 'ndjson', 'after': min(map(int, ratings))})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['score'] for line in lines], list(range(1, 8)))
+
     def test_fetch_comments(self):
         num_comments = random.randrange(5, 100)
         for _ in range(num_comments):
@@ -117,6 +274,46 @@ class ResourceFetchTestCase(TestCase):
             for attribute in 'msg', 'tag', 'qid':
                 self.assertTrue(attribute in comment_data)
 
+    def test_fetch_comments_limit(self):
+        question = QualitativeQuestion.objects.create()
+        comment_ids = {
+            Comment.objects.create(question=question, message='?',
+                                   respondent=Respondent.objects.create()).id
+            for _ in range(random.randrange(10, 100))
+        }
+        Comment.objects.create(question=question, message='?', flagged=True,
+                               respondent=Respondent.objects.create())
+
+        selected_ids = set()
+        for _ in range(20):
+            limit = random.randrange(len(comment_ids))
+            response = self.client.get(reverse('fetch-comments'), {'limit': limit})
+            data = json.loads(response.content)
+            self.assertEqual(len(data), limit)
+            selected_ids |= {int(comment_id) for comment_id in data}
+        self.assertTrue(selected_ids <= comment_ids)
+
+    def test_fetch_comments_num_queries(self):
+        question = QualitativeQuestion.objects.create()
+        num_queries = []
+        for num_comments in [5, 50]:
+            for _ in range(num_comments):
+                comment = Comment.objects.create(question=question, message='?',
+                                                 respondent=Respondent.objects.create())
+                for score in [random.randint(0, 9) for _ in range(3)]:
+                    CommentRating.objects.create(comment=comment, score=score,
+                                                 respondent=Respondent.objects.create())
+            compute_pca_snapshot()
+
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse('fetch-comments'))
+            data = json.loads(response.content)
+            for comment_id, comment_data in data.items():
+                comment = Comment.objects.get(id=int(comment_id))
+                self.assertAlmostEqual(comment_data['sem'], round(comment.score_sem, 3))
+            num_queries.append(len(context.captured_queries))
+        self.assertEqual(num_queries[0], num_queries[1])
+
 
 class ResponseSaveTestCase(TestCase):
     @classmethod
@@ -195,6 +392,639 @@ class ResponseSaveTestCase(TestCase):
             self.assertEqual(CommentRating.objects.count(), 0)
             self.assertEqual(Respondent.objects.count(), 0)
 
+    def test_duplicate_save(self):
+        responses = {
+            'question-ratings': {'1': 4},
+            'respondent-data': {'language': 'en'},
+            'response-key': 'response-1500000000000-abc',
+        }
+        for _ in range(3):
+            self.assertEqual(self.push(responses).status_code, 200)
+        self.assertEqual(Respondent.objects.count(), 1)
+        self.assertEqual(QuantitativeQuestionRating.objects.count(), 1)
+        self.assertEqual(QuantitativeQuestion.objects.get(id=1).num_ratings, 1)
+
+        responses['response-key'] = 'response-1500000000001-abc'
+        self.assertEqual(self.push(responses).status_code, 200)
+        self.assertEqual(Respondent.objects.count(), 2)
+
+        responses['response-key'] = 'x'*100
+        self.assertEqual(self.push(responses).status_code, 400)
+
+    def test_nonexistent_comment_save(self):
+        response = self.push({
+            'question-ratings': {'1': 4},
+            'comment-ratings': {'1000': 2},
+            'respondent-data': {'language': 'en'},
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(QuantitativeQuestionRating.objects.count(), 0)
+        self.assertEqual(Respondent.objects.count(), 0)
+
+    def test_save_num_queries(self):
+        question_ids = [QuantitativeQuestion.objects.create().id for _ in range(10)]
+        respondent = Respondent.objects.create()
+        comment_ids = [
+            Comment.objects.create(respondent=respondent, question_id=1,
+                                   message='comment {0}'.format(index)).id
+            for index in range(10)
+        ]
+
+        def count_queries(num_responses):
+            with CaptureQueriesContext(connection) as context:
+                response = self.push({
+                    'question-ratings': {
+                        str(question_id): 3
+                        for question_id in question_ids[:num_responses]
+                    },
+                    'comments': {'1': 'hello world'},
+                    'comment-ratings': {
+                        str(comment_id): 5
+                        for comment_id in comment_ids[:num_responses]
+                    },
+                    'respondent-data': {'language': 'en'},
+                })
+            self.assertEqual(response.status_code, 200)
+            return len(context.captured_queries)
+
+        self.assertEqual(count_queries(2), count_queries(10))
+        question = QuantitativeQuestion.objects.get(id=question_ids[0])
+        self.assertEqual(question.num_ratings, 2)
+        self.assertAlmostEqual(question.mean_score, 3)
+        comment = Comment.objects.get(id=comment_ids[-1])
+        self.assertEqual(comment.num_ratings, 1)
+
+
+class BatchResponseSaveTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        QuantitativeQuestion(id=1, min_score=0, max_score=9).save()
+        QualitativeQuestion(id=1).save()
+
+    def push(self, batch):
+        return Client().post(reverse('save-responses'), data=json.dumps(batch),
+                             content_type='application/json')
+
+    def test_partial_save(self):
+        response = self.push([
+            {'question-ratings': {'1': 4}, 'respondent-data': {'language': 'en'}},
+            {'question-ratings': {'1': 40}, 'respondent-data': {'language': 'en'}},
+            {'comments': {'2': 'hi'}, 'respondent-data': {'language': 'en'}},
+            'not a response',
+            {'comments': {'1': 'hi'}, 'respondent-data': {'language': 'tl'}},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content)['results']
+        self.assertEqual([result['saved'] for result in results],
+                         [True, False, False, False, True])
+        self.assertTrue(all(result['error'] for result in results
+                            if not result['saved']))
+        self.assertEqual(Respondent.objects.count(), 2)
+        self.assertEqual(QuantitativeQuestionRating.objects.count(), 1)
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(QuantitativeQuestion.objects.get(id=1).num_ratings, 1)
+
+    def test_invalid_batch(self):
+        for batch in [{'respondent-data': {'language': 'en'}}, 'hello']:
+            self.assertEqual(self.push(batch).status_code, 400)
+        response = Client().post(reverse('save-responses'), data='[',
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Respondent.objects.count(), 0)
+
+
+@override_settings(RESPONSE_QUEUE_ENABLED=True)
+class ResponseQueueTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        QuantitativeQuestion(id=1, min_score=0, max_score=9).save()
+        QualitativeQuestion(id=1).save()
+
+    def push(self, endpoint, data):
+        return Client().post(reverse(endpoint), data=json.dumps(data),
+                             content_type='application/json')
+
+    def test_queue(self):
+        valid = {'question-ratings': {'1': 4}, 'respondent-data': {'language': 'en'},
+                 'response-key': 'response-1'}
+        invalid = {'question-ratings': {'1': 40}, 'respondent-data': {'language': 'en'}}
+        self.assertEqual(self.push('save-response', valid).status_code, 202)
+        self.assertEqual(self.push('save-response', []).status_code, 400)
+        response = self.push('save-responses', [valid, invalid, 1, {
+            'comments': {'1': 'hello'},
+            'respondent-data': {'language': 'tl'},
+        }])
+        self.assertEqual(response.status_code, 202)
+        results = json.loads(response.content)['results']
+        self.assertEqual([result['saved'] for result in results],
+                         [True, True, False, True])
+        self.assertEqual(QueuedResponse.objects.count(), 4)
+        self.assertEqual(Respondent.objects.count(), 0)
+
+        with open(os.devnull, 'w') as stdout:
+            call_command('processresponses', batch_size=3, stdout=stdout)
+        self.assertEqual(Respondent.objects.count(), 2)
+        self.assertEqual(QuantitativeQuestionRating.objects.count(), 1)
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(QuantitativeQuestion.objects.get(id=1).num_ratings, 1)
+        failed = QueuedResponse.objects.get()
+        self.assertTrue(failed.failed)
+        self.assertTrue(failed.error)
+
+
+class ExportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        question = QuantitativeQuestion.objects.create()
+        for index in range(10):
+            respondent = Respondent.objects.create(location='Place {0}'.format(index))
+            QuantitativeQuestionRating.objects.create(respondent=respondent,
+                                                      question=question, score=index)
+
+    def test_iterate_in_chunks(self):
+        queryset = QuantitativeQuestionRating.objects.order_by('-score')
+        for chunk_size in [1, 3, 10, 11]:
+            instances = list(iterate_in_chunks(queryset, chunk_size))
+            self.assertEqual([instance.pk for instance in instances],
+                             sorted(queryset.values_list('pk', flat=True)))
+
+    @override_settings(EXPORT_CHUNK_SIZE=3)
+    def test_streaming_csv_export(self):
+        response = export_data(QuantitativeQuestionRating.objects.all(), 'csv')
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 11)
+        self.assertIn('score', lines[0].split(','))
+        scores = [int(line.split(',')[lines[0].split(',').index('score')])
+                  for line in lines[1:]]
+        self.assertEqual(scores, list(range(10)))
+
+    def test_csv_matches_instances(self):
+        Comment.objects.create(respondent=Respondent.objects.first(),
+                               question=QualitativeQuestion.objects.create(),
+                               message='\u00f1, "quoted"\nand multiline')
+        Respondent.objects.filter(id=Respondent.objects.last().id).update(age=None)
+        for model in [Respondent, Comment, QuantitativeQuestionRating, QuantitativeQuestion]:
+            expected, actual = io.BytesIO(), io.BytesIO()
+            export_instances_csv(expected, model.objects.all())
+            export_csv(actual, model.objects.all())
+            self.assertEqual(actual.getvalue(), expected.getvalue())
+            header = actual.getvalue().decode('utf-8').splitlines()[0].split(',')
+            for field_name in QuantitativeQuestion.AGGREGATE_FIELD_NAMES:
+                self.assertNotIn(field_name, header)
+
+    @override_settings(EXPORT_CHUNK_SIZE=4)
+    def test_npz_export(self):
+        Respondent.objects.filter(id=Respondent.objects.last().id).update(age=None)
+        response = export_data(Respondent.objects.all(), 'npz')
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        arrays = np.load(io.BytesIO(response.content))
+        respondents = Respondent.objects.order_by('id')
+        self.assertEqual(arrays['id'].dtype, np.int64)
+        self.assertEqual(arrays['id'].tolist(), [respondent.id for respondent in respondents])
+        self.assertEqual(arrays['location'].tolist(),
+                         [respondent.location for respondent in respondents])
+        self.assertEqual(arrays['active'].dtype, np.bool_)
+        self.assertTrue(np.isnan(arrays['age'][-1]))
+
+        arrays = np.load(io.BytesIO(export_data(QuantitativeQuestionRating.objects.all(),
+                                                'npz').content))
+        self.assertEqual(arrays['score'].tolist(), list(range(10)))
+        self.assertEqual(arrays['timestamp'].dtype, np.dtype('datetime64[us]'))
+        self.assertEqual(len(arrays['timestamp']), 10)
+
+        arrays = np.load(io.BytesIO(export_data(Comment.objects.none(), 'npz').content))
+        self.assertEqual(len(arrays['message']), 0)
+
+    def test_excel_export(self):
+        response = export_data(Respondent.objects.all(), 'xlsx')
+        self.assertFalse(response.streaming)
+        self.assertTrue(response.content.startswith(b'PK'))
+        self.assertEqual(export_data(Respondent.objects.all(), 'txt').status_code, 400)
+
+    def test_survey_export(self):
+        stream = io.BytesIO()
+        export_survey(stream)
+        archive = zipfile.ZipFile(stream)
+        manifest = json.loads(archive.read('manifest.json').decode('utf-8'))
+        self.assertEqual(manifest['num_rows']['Respondent'], 10)
+        self.assertEqual(manifest['num_rows']['QuantitativeQuestionRating'], 10)
+        self.assertEqual(manifest['num_rows']['Comment'], 0)
+        expected = io.BytesIO()
+        export_csv(expected, Respondent.objects.all())
+        self.assertEqual(archive.read('Respondent.csv'), expected.getvalue())
+        self.assertEqual(len(archive.read('Comment.csv').splitlines()), 1)
+
+        stream = io.BytesIO()
+        export_survey(stream, 'npz')
+        arrays = np.load(io.BytesIO(zipfile.ZipFile(stream).read('QuantitativeQuestionRating.npz')))
+        self.assertEqual(arrays['score'].tolist(), list(range(10)))
+        self.assertRaises(ValueError, export_survey, io.BytesIO(), 'txt')
+
+    def test_survey_export_command(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'survey.zip')
+            with open(os.devnull, 'w') as stdout:
+                call_command('exportsurvey', path, stdout=stdout)
+            self.assertIn('Respondent.csv', zipfile.ZipFile(path).namelist())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_export_changes(self):
+        directory = tempfile.mkdtemp()
+        try:
+            def read_ids(path):
+                with open(path, 'rb') as export_file:
+                    lines = export_file.read().decode('utf-8').splitlines()
+                column = lines[0].split(',').index('id')
+                return sorted(int(line.split(',')[column]) for line in lines[1:])
+
+            path, num_rows = export_changes(QuantitativeQuestionRating, directory)
+            self.assertEqual(num_rows, 10)
+            self.assertEqual(len(read_ids(path)), 10)
+            self.assertEqual(export_changes(QuantitativeQuestionRating, directory), (None, 0))
+
+            # Revise a comment as ``HistoryAdmin.save_model`` would
+            old_comment = Comment.objects.create(respondent=Respondent.objects.first(),
+                                                 question=QualitativeQuestion.objects.create(),
+                                                 message='Original')
+            export_changes(Comment, directory)
+            new_comment = old_comment.make_copy()
+            new_comment.predecessor, new_comment.message = old_comment, 'Revised'
+            old_comment.active = False
+            old_comment.save()
+            new_comment.save()
+            path, num_rows = export_changes(Comment, directory)
+            self.assertEqual(read_ids(path), [old_comment.id, new_comment.id])
+
+            checkpoint = ExportCheckpoint.objects.get(model_label='pcari.Comment')
+            self.assertEqual(checkpoint.last_primary_key, new_comment.id)
+            self.assertEqual(checkpoint.rows_exported, 3)
+            self.assertEqual(len(os.listdir(directory)), 3)
+            new_comment.tag = 'Revised'
+            new_comment.save()
+            new_comment.save(update_fields=['active'])
+            self.assertFalse(RowChange.objects.filter(model_label='pcari.Comment').exists())
+
+            # Deactivate exported rows in place, by saving and with the admin action
+            first, second = QuantitativeQuestionRating.objects.order_by('id')[:2]
+            first.active = False
+            first.save()
+            path, _ = export_changes(QuantitativeQuestionRating, directory)
+            self.assertEqual(read_ids(path), [first.id])
+            User.objects.create_superuser('admin', 'admin@example.com', 'password')
+            client = Client()
+            client.login(username='admin', password='password')
+            client.post(reverse('admin:pcari_quantitativequestionrating_changelist'),
+                        {'action': 'mark_inactive', '_selected_action': [second.id]})
+            self.assertFalse(QuantitativeQuestionRating.objects.get(id=second.id).active)
+            path, _ = export_changes(QuantitativeQuestionRating, directory)
+            self.assertEqual(read_ids(path), [second.id])
+            self.assertFalse(RowChange.objects.filter(
+                model_label='pcari.QuantitativeQuestionRating').exists())
+            self.assertEqual(export_changes(QuantitativeQuestionRating, directory), (None, 0))
+        finally:
+            shutil.rmtree(directory)
+
+
+class ExportJobTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        question = QuantitativeQuestion.objects.create()
+        for index in range(10):
+            respondent = Respondent.objects.create()
+            QuantitativeQuestionRating.objects.create(respondent=respondent,
+                                                      question=question, score=index)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(EXPORT_JOB_DIRECTORY=self.directory,
+                                                   EXPORT_CHUNK_SIZE=3)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def make_job(self, data_format='csv'):
+        job = ExportJob(data_format=data_format)
+        job.queryset = QuantitativeQuestionRating.objects.filter(score__gte=2)
+        job.save()
+        return job
+
+    def test_job_selection(self):
+        job = ExportJob.objects.get(id=self.make_job().id)
+        self.assertEqual(json.loads(job._selection)['pk__in'],
+                         list(QuantitativeQuestionRating.objects.filter(score__gte=2)
+                              .order_by('pk').values_list('pk', flat=True)))
+        self.assertEqual(job.queryset.count(), 8)
+        job.queryset = Respondent.objects.all()
+        self.assertEqual(json.loads(job._selection), {})
+        self.assertEqual(job.queryset.count(), Respondent.objects.count())
+
+    def test_csv_job(self):
+        job = self.make_job()
+        self.assertEqual(claim_export_job().id, job.id)
+        self.assertIsNone(claim_export_job())
+        run_export_job(ExportJob.objects.get(id=job.id))
+
+        job = ExportJob.objects.get(id=job.id)
+        self.assertEqual(job.status, ExportJob.COMPLETED)
+        self.assertEqual((job.rows_processed, job.rows_total), (8, 8))
+        self.assertIsNotNone(job.throughput)
+        expected = io.BytesIO()
+        export_csv(expected, QuantitativeQuestionRating.objects.filter(score__gte=2))
+        with open(job.path, 'rb') as exported_file:
+            self.assertEqual(exported_file.read(), expected.getvalue())
+
+        # Simulate a worker stopping after the first chunk
+        lines = expected.getvalue().splitlines(True)
+        with open(job.path, 'wb') as exported_file:
+            exported_file.write(b''.join(lines[:4]) + b'incomplete row')
+        last_primary_key = QuantitativeQuestionRating.objects.get(score=4).id
+        ExportJob.objects.filter(id=job.id).update(
+            status=ExportJob.RUNNING, rows_processed=3, bytes_written=len(b''.join(lines[:4])),
+            last_primary_key=last_primary_key, updated=job.updated - datetime.timedelta(hours=1),
+        )
+        self.assertIsNone(claim_export_job(stale_after=60*60*2))
+        job = claim_export_job(stale_after=60)
+        run_export_job(job)
+        self.assertEqual(job.rows_processed, 8)
+        with open(job.path, 'rb') as exported_file:
+            self.assertEqual(exported_file.read(), expected.getvalue())
+
+    def test_excel_job_download(self):
+        job = self.make_job('xlsx')
+        run_export_job(claim_export_job())
+        job = ExportJob.objects.get(id=job.id)
+        self.assertEqual(job.status, ExportJob.COMPLETED)
+        self.assertEqual(job.rows_processed, 8)
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        client = Client()
+        client.login(username='admin', password='password')
+        response = client.get(reverse('admin:pcari_exportjob_changelist'))
+        self.assertContains(response, job.filename)
+        response = client.get(reverse('admin:pcari_exportjob_download', args=(job.id, )))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'PK'))
+
+    def test_failed_job(self):
+        job = self.make_job('txt')
+        run_export_job(claim_export_job())
+        job = ExportJob.objects.get(id=job.id)
+        self.assertEqual(job.status, ExportJob.FAILED)
+        self.assertTrue(job.error)
+
+    def test_survey_job(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        client = Client()
+        client.login(username='admin', password='password')
+        response = client.post(reverse('admin:export-survey'), {'format': 'csv'})
+        self.assertRedirects(response, reverse('admin:pcari_exportjob_changelist'))
+        job = claim_export_job()
+        self.assertEqual(job.model_label, ExportJob.SURVEY_LABEL)
+        run_export_job(job)
+        job = ExportJob.objects.get(id=job.id)
+        self.assertEqual(job.status, ExportJob.COMPLETED, job.error)
+        self.assertEqual(job.rows_processed, job.rows_total)
+        self.assertTrue(job.filename.endswith('.zip'))
+        response = client.get(reverse('admin:pcari_exportjob_download', args=(job.id, )))
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIn('manifest.json', archive.namelist())
+        self.assertFalse(os.path.exists(job.path + '.partial'))
+        response = client.post(reverse('admin:export-survey'), {'format': 'txt'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(client.get(reverse('admin:export-survey')).status_code, 405)
+
+    def test_background_export_actions(self):
+        respondent = Respondent.objects.first()
+        comment = Comment.objects.create(respondent=respondent, message='Comment',
+                                         question=QualitativeQuestion.objects.create())
+        CommentRating.objects.create(respondent=respondent, comment=comment, score=5)
+        update_daily_rollups()
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        client = Client()
+        client.login(username='admin', password='password')
+
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(username='admin')
+        for model, model_admin in site._registry.items():
+            actions = model_admin.get_actions(request)
+            queryset = model_admin.get_queryset(request)
+            for action in ['export_selected_in_background_as_csv',
+                           'export_selected_in_background_as_xlsx']:
+                if action not in actions:
+                    continue
+                url = reverse('admin:{0}_{1}_changelist'.format(model._meta.app_label,
+                                                               model._meta.model_name))
+                for select_across in [0, 1]:
+                    client.post(url, {'action': action, 'select_across': select_across,
+                                      '_selected_action': [queryset.first().pk]})
+                    job = claim_export_job()
+                    self.assertIsNotNone(job, '{0} {1}'.format(model.__name__, action))
+                    run_export_job(job)
+                    job = ExportJob.objects.get(id=job.id)
+                    self.assertEqual(job.status, ExportJob.COMPLETED, job.error)
+                    self.assertEqual(job.rows_total, 1 if not select_across
+                                     else model.objects.count())
+
+
+class AdminTestCase(TestCase):
+    """ Log in to the admin site with some questions to respond to. """
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.question = QuantitativeQuestion.objects.create()
+        cls.qualitative_question = QualitativeQuestion.objects.create()
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+
+    def add_respondents(self, num_respondents):
+        comment = Comment.objects.first()
+        for index in range(num_respondents):
+            respondent = Respondent.objects.create()
+            QuantitativeQuestionRating.objects.create(respondent=respondent, score=index,
+                                                      question=self.question)
+            Comment.objects.create(respondent=respondent, question=self.qualitative_question,
+                                   message='Comment {0}'.format(index))
+            if comment is not None:
+                CommentRating.objects.create(respondent=respondent, comment=comment,
+                                             score=index % 10)
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+
+class AdminChangeListTestCase(AdminTestCase):
+    def test_comment_change_list(self):
+        url = reverse('admin:pcari_comment_changelist')
+        self.add_respondents(3)
+        num_queries, _ = self.count_queries(url)
+        self.add_respondents(6)
+        self.assertEqual(self.count_queries(url)[0], num_queries)
+
+        comment = Comment.objects.first()
+        _, response = self.count_queries(url, {'o': '-8'})
+        self.assertEqual(response.context['cl'].result_list[0], comment)
+        self.assertEqual(response.context['cl'].result_list[0].mean_score_annotation,
+                         comment.mean_score)
+
+    @override_settings(ESTIMATED_COUNT_THRESHOLD=3)
+    def test_estimated_count(self):
+        url = reverse('admin:pcari_quantitativequestionrating_changelist')
+        cache.delete('pcari:row-count:pcari.QuantitativeQuestionRating')
+        self.add_respondents(3)
+        _, response = self.count_queries(url)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertFalse(response.context['cl'].paginator.estimated)
+
+        self.add_respondents(2)
+        _, response = self.count_queries(url)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertContains(response, 'Count exactly')
+        _, response = self.count_queries(url, {'exact-count': 1})
+        self.assertEqual(response.context['cl'].result_count, 5)
+        self.assertFalse(response.context['cl'].paginator.estimated)
+        _, response = self.count_queries(url, {'score__exact': 2})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        _, response = self.count_queries(url)
+        self.assertEqual(response.context['cl'].result_count, 5)
+
+    def test_respondent_change_list(self):
+        url = reverse('admin:pcari_respondent_changelist')
+        self.add_respondents(2)
+        num_queries, _ = self.count_queries(url)
+        self.add_respondents(4)
+        self.assertEqual(self.count_queries(url)[0], num_queries)
+
+        respondent = Respondent.objects.last()
+        long_comment = Comment.objects.create(respondent=respondent, message='a'*200,
+                                              question=self.qualitative_question)
+        _, response = self.count_queries(url)
+        self.assertContains(response, escape(str(long_comment)))
+        comment = Comment.objects.filter(respondent=respondent).first()
+        self.assertContains(response, escape(str(comment) + str(long_comment)))
+        QuantitativeQuestionRating.objects.filter(score=0).update(
+            score=QuantitativeQuestionRating.SKIPPED)
+        _, response = self.count_queries(reverse('admin:pcari_respondent_changelist'))
+        for respondent in response.context['cl'].result_list:
+            self.assertEqual(respondent.num_questions_rated_annotation,
+                             respondent.num_questions_rated)
+            self.assertEqual(respondent.num_comments_rated_annotation,
+                             respondent.num_comments_rated)
+            self.assertEqual(respondent.num_comments_annotation,
+                             respondent.comments.count())
+            for comment in respondent.comment_set.all():
+                # The full message is neither fetched nor overwritten by the excerpt
+                self.assertNotIn('message', comment.__dict__)
+
+
+class SurveyStatisticsTestCase(AdminTestCase):
+    def test_survey_statistics(self):
+        url = reverse('admin:statistics-data')
+        cache.delete('pcari:survey-statistics')
+        self.addCleanup(cache.delete, 'pcari:survey-statistics')
+        self.add_respondents(4)
+        Respondent.objects.filter(id__in=Respondent.objects.values('id')[:2]).update(
+            language='tl', submitted_personal_data=True)
+        Respondent.objects.filter(id=Respondent.objects.first().id).update(completed_survey=True)
+
+        num_queries, response = self.count_queries(url)
+        statistics = json.loads(response.content)
+        question_statistics, = statistics['questions']
+        self.question.refresh_from_db()
+        self.assertEqual(question_statistics['num_ratings'], 4)
+        self.assertAlmostEqual(question_statistics['mean'], 1.5)
+        self.assertAlmostEqual(question_statistics['stdev'], self.question.score_stdev, 3)
+        self.assertAlmostEqual(question_statistics['sem'], self.question.score_sem, 3)
+        self.assertEqual(question_statistics['histogram'], {'0': 1, '1': 1, '2': 1, '3': 1})
+        day, = statistics['days']
+        self.assertEqual((day['respondents'], day['ratings'], day['comments']), (4, 4, 4))
+        self.assertIsNone(statistics['rolled_up'])
+        self.assertEqual(statistics['funnel'], {'started': 4, 'submitted_personal_data': 2,
+                                                'completed_survey': 1})
+        self.assertEqual(sum(statistics['languages'].values()), 4)
+        self.assertEqual(statistics['languages']['tl'], 2)
+
+        self.add_respondents(1)
+        cached_num_queries, response = self.count_queries(url)
+        self.assertLess(cached_num_queries, num_queries)
+        self.assertEqual(json.loads(response.content), statistics)
+        _, response = self.count_queries(url, {'refresh': 1})
+        self.assertEqual(json.loads(response.content)['funnel']['started'], 5)
+
+        prompt = 'I feel prepared to handle a major typhoon right now.'
+        QuantitativeQuestion.objects.filter(id=self.question.id).update(prompt=prompt)
+        QuantitativeQuestion.objects.create(prompt='')
+        with translation.override('tl'):
+            expected = [translation.ugettext(prompt), '']
+        self.client.defaults['HTTP_ACCEPT_LANGUAGE'] = 'tl'
+        _, response = self.count_queries(url, {'refresh': 1})
+        self.assertEqual([question['prompt'] for question
+                          in json.loads(response.content)['questions']], expected)
+        self.assertEqual(get_survey_statistics()['questions'][0]['prompt'], prompt)
+
+    def get_rollups(self, question='self'):
+        question = self.question if question == 'self' else question
+        rows = (DailyRollup.objects.filter(question=question)
+                .values_list('date', 'language', 'num_respondents', 'num_ratings',
+                             'score_sum', 'score_squared_sum'))
+        return {row[:2]: row[2:] for row in rows}
+
+    def test_daily_rollups(self):
+        self.add_respondents(4)
+        respondents = list(Respondent.objects.order_by('id'))
+        ratings = QuantitativeQuestionRating.objects.filter(question=self.question)
+        Respondent.objects.filter(id__in=[r.id for r in respondents[:2]]).update(language='tl')
+        ratings.filter(respondent__in=respondents[:2]).update(
+            timestamp=timezone.now() - datetime.timedelta(days=1))
+        ratings.filter(respondent=respondents[3]).update(score=QuantitativeQuestionRating.SKIPPED)
+        QuantitativeQuestionRating.objects.filter(id=QuantitativeQuestionRating.objects.create(
+            respondent=respondents[0], question=QuantitativeQuestion.objects.create(), score=3,
+        ).id).update(timestamp=timezone.now() - datetime.timedelta(days=1))
+        today = timezone.localdate()
+        yesterday = today - datetime.timedelta(days=1)
+        with open(os.devnull, 'w') as stdout:
+            call_command('rollupmetrics', stdout=stdout)
+        self.assertEqual(self.get_rollups(), {(yesterday, 'tl'): (2, 2, 1, 1),
+                                              (today, ''): (2, 1, 2, 4)})
+        self.assertEqual(self.get_rollups(None), {(yesterday, 'tl'): (2, 3, 4, 10),
+                                                  (today, ''): (2, 1, 2, 4)})
+        rollup_id = DailyRollup.objects.get(date=yesterday, question=self.question).id
+
+        self.add_respondents(1)
+        ratings.filter(respondent=respondents[2]).update(
+            timestamp=timezone.now() - datetime.timedelta(days=3))
+        self.assertEqual(update_daily_rollups(), (today, 2))
+        self.assertEqual(DailyRollup.objects.get(date=yesterday, question=self.question).id,
+                         rollup_id)
+        self.assertEqual(self.get_rollups()[today, ''], (2, 1, 0, 0))
+        self.assertEqual(len(self.get_rollups()), 2)
+        update_daily_rollups(today - datetime.timedelta(days=3))
+        self.assertEqual(self.get_rollups()[today - datetime.timedelta(days=3), ''],
+                         (1, 1, 2, 4))
+        self.assertAlmostEqual(DailyRollup.objects.get(date=yesterday,
+                                                       question=self.question).mean_score, 0.5)
+        days = get_survey_statistics(refresh=True)['days']
+        self.assertEqual([(day['respondents'], day['ratings']) for day in days],
+                         [(1, 1), (2, 3), (2, 1)])
+        # Days after the last rollup are counted from the ratings themselves
+        self.add_respondents(1)
+        days = get_survey_statistics(refresh=True)['days']
+        self.assertEqual([(day['respondents'], day['ratings']) for day in days],
+                         [(1, 1), (2, 3), (3, 2)])
+        cache.delete('pcari:survey-statistics')
+
+        self.count_queries(reverse('admin:pcari_dailyrollup_changelist'))
+
 
 class PCACorrectnessTestCase(TestCase):
     """ Test the correctness of the principal component analysis. """
@@ -256,3 +1086,132 @@ class PCACorrectnessTestCase(TestCase):
             self.assertEqual(np.linalg.norm(expected), 1)
             self.assertEqual(np.linalg.norm(actual), 1)
             self.assertAlmostEqual(abs(np.dot(actual, expected)), 1)
+
+    def test_randomized_principal_components(self):
+        normalized_ratings = normalize_ratings_matrix(np.array([[9, 6],
+                                                                [0, np.nan],
+                                                                [0, np.nan]]))
+        expected_components = calculate_principal_components(normalized_ratings, 2, 'svd')
+        for engine in 'randomized', 'covariance':
+            actual_components = calculate_principal_components(normalized_ratings, 2,
+                                                               engine)
+            for actual, expected in zip(actual_components, expected_components):
+                self.assertAlmostEqual(abs(np.dot(actual, expected)), 1)
+
+        # A larger matrix with well-separated leading singular values
+        random_state = np.random.RandomState(0)
+        num_respondents, num_questions = 2000, 20
+        latent = random_state.normal(size=(num_respondents, 2)) * [8, 4]
+        loadings = np.linalg.qr(random_state.normal(size=(num_questions, 2)))[0].T
+        noise = random_state.normal(size=(num_respondents, num_questions))
+        normalized_ratings = latent.dot(loadings) + noise
+        normalized_ratings -= normalized_ratings.mean(axis=0)
+
+        expected_components = calculate_principal_components(normalized_ratings, 2, 'svd')
+        for engine in 'randomized', 'covariance':
+            actual_components = calculate_principal_components(normalized_ratings, 2,
+                                                               engine)
+            self.assertEqual(actual_components.shape, (2, num_questions))
+            for actual, expected in zip(actual_components, expected_components):
+                self.assertAlmostEqual(np.linalg.norm(actual), 1)
+                self.assertAlmostEqual(abs(np.dot(actual, expected)), 1, places=4)
+
+
+class RatingsMatrixStoreTestCase(TestCase):
+    """ Ensure the incrementally maintained ratings matrix stays consistent. """
+    fixtures = ['pca-test-data.yaml']
+
+    def setUp(self):
+        self.store = RatingsMatrixStore(generate_ratings_matrix)
+
+    def tearDown(self):
+        invalidate_ratings_matrix()
+
+    def assertMatrixEqual(self, actual_results, expected_results):
+        actual_respondent_map, actual_question_map, actual = actual_results
+        expected_respondent_map, expected_question_map, expected = expected_results
+        self.assertEqual(set(actual_respondent_map), set(expected_respondent_map))
+        self.assertEqual(set(actual_question_map), set(expected_question_map))
+        for respondent_id, expected_row in expected_respondent_map.items():
+            actual_row = actual_respondent_map[respondent_id]
+            for question_id, expected_column in expected_question_map.items():
+                actual_column = actual_question_map[question_id]
+                np.testing.assert_equal(actual[actual_row, actual_column],
+                                        expected[expected_row, expected_column])
+
+    def test_incremental_update(self):
+        self.assertMatrixEqual(self.store.get(), generate_ratings_matrix())
+        questions = QuantitativeQuestion.objects.filter(active=True)
+        for _ in range(random.randrange(1, 50)):
+            respondent = Respondent.objects.create()
+            for question in questions:
+                QuantitativeQuestionRating.objects.create(
+                    respondent=respondent,
+                    question=question,
+                    score=random.randint(-2, 9),
+                )
+        Respondent.objects.create()  # Respondent with no ratings
+
+        generation = self.store.generation
+        self.assertMatrixEqual(self.store.get(), generate_ratings_matrix())
+        self.assertEqual(self.store.generation, generation)
+
+    def test_invalidation(self):
+        self.store.get()
+        Respondent.objects.filter(id=1).update(active=False)
+        self.assertTrue(1 in self.store.get()[0])
+        invalidate_ratings_matrix()
+        self.assertMatrixEqual(self.store.get(), generate_ratings_matrix())
+        self.assertFalse(1 in self.store.get()[0])
+
+    def test_new_question(self):
+        self.store.get()
+        question = QuantitativeQuestion.objects.create()
+        QuantitativeQuestionRating.objects.create(respondent_id=2,
+                                                  question=question, score=5)
+        self.assertMatrixEqual(self.store.get(), generate_ratings_matrix())
+
+
+class PCASnapshotTestCase(TestCase):
+    """ Ensure comments are positioned with persisted principal components. """
+    fixtures = ['pca-test-data.yaml']
+
+    def tearDown(self):
+        invalidate_ratings_matrix()
+
+    @ignore_warnings
+    def test_snapshot_projections(self):
+        snapshot = compute_pca_snapshot()
+        arrays = PCASnapshot.objects.get(version=snapshot.version).arrays
+        self.assertEqual(snapshot.num_respondents, 3)
+        self.assertEqual(snapshot.num_questions, 2)
+        self.assertEqual(snapshot.last_respondent_id, 4)
+
+        respondent_id_map, _, ratings = generate_ratings_matrix()
+        normalized_ratings = normalize_ratings_matrix(ratings)
+        for index, respondent_id in enumerate(arrays['respondent_ids']):
+            expected = arrays['components'].dot(
+                normalized_ratings[respondent_id_map[respondent_id], :])
+            self.assertAlmostEqual(np.linalg.norm(arrays['projections'][index] - expected), 0)
+
+    @ignore_warnings
+    def test_fetch_comments_with_snapshot(self):
+        snapshot = compute_pca_snapshot()
+        respondent = Respondent.objects.create()
+        QuantitativeQuestionRating.objects.create(respondent=respondent,
+                                                  question_id=1, score=9)
+        QuantitativeQuestionRating.objects.create(respondent=respondent,
+                                                  question_id=2, score=6)
+        for respondent_id in [1, respondent.id]:
+            Comment.objects.create(question=QualitativeQuestion.objects.create(),
+                                   respondent_id=respondent_id, message='?')
+
+        response = Client().get(reverse('fetch-comments'))
+        self.assertEqual(response.status_code, 200)
+        positions = [comment['pos'] for comment in json.loads(response.content).values()]
+        self.assertEqual(len(positions), 2)
+
+        # The new respondent rated the questions the same way as respondent 1
+        self.assertAlmostEqual(np.linalg.norm(np.subtract(*positions)), 0)
+        self.assertEqual(PCASnapshot.objects.count(), 1)
+        self.assertEqual(PCASnapshot.objects.get().version, snapshot.version)
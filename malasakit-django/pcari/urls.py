@@ -35,5 +35,8 @@ api_urlpatterns = [
         name='fetch-qualitative-questions'),
     url(r'^fetch/question-ratings/$', views.fetch_question_ratings,
         name='fetch-question-ratings'),
+    url(r'^fetch/question-histograms/$', views.fetch_question_histograms,
+        name='fetch-question-histograms'),
     url(r'^save-response/$', views.save_response, name='save-response'),
+    url(r'^save-responses/$', views.save_responses, name='save-responses'),
 ]
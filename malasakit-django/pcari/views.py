@@ -15,43 +15,50 @@ References:
 """
 
 from __future__ import unicode_literals
-import datetime
+import collections
+import functools
 import logging
 import json
 import math
-import mimetypes
 import random
-import time
 
-import decorator
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.conf import settings
-from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.decorators.http import require_GET, require_POST
 from django.urls import reverse
-from django.utils import translation
-from django.utils.translation import ugettext_lazy as _, ugettext
+from django.utils.translation import ugettext_lazy as _
 import numpy as np
-from openpyxl import Workbook
-import unicodecsv as csv
 
 from pcari.models import Respondent
 from pcari.models import QuantitativeQuestion, QualitativeQuestion
 from pcari.models import Comment, CommentRating, QuantitativeQuestionRating
-from pcari.models import get_concrete_fields
+from pcari.models import PCASnapshot, QueuedResponse
+from pcari.analysis import RatingsMatrixStore, PCASnapshotCache, project_ratings
+from pcari.analysis import get_pca_engine
+from pcari.profiling import profile
+from pcari.payloads import get_question_payload, conditional, get_question_version
+from pcari.payloads import get_comments_version, get_question_ratings_version
+from pcari.payloads import render_question_histograms, render_question_ratings_page
+from pcari.payloads import generate_question_ratings_json, generate_question_ratings_ndjson
 
 __all__ = [
     'generate_ratings_matrix',
     'normalize_ratings_matrix',
     'calculate_principal_components',
+    'compute_pca_snapshot',
     'fetch_comments',
     'fetch_qualitative_questions',
     'fetch_quantitative_questions',
     'fetch_question_ratings',
+    'fetch_question_histograms',
     'save_response',
-    'export_data',
+    'save_responses',
+    'process_queued_responses',
     'index',
     'landing',
     'qualitative_questions',
@@ -67,32 +74,13 @@ __all__ = [
 DEFAULT_LANGUAGE = settings.LANGUAGE_CODE
 DEFAULT_COMMENT_LIMIT = 300   # Default maximum number of comments to send
 DEFAULT_STANDARD_ERROR = 4.5  # For comments with fewer than two ratings
+NUM_PRINCIPAL_COMPONENTS = 2  # For projecting respondents onto the bloom
+SAMPLE_BATCH_SIZE = 500  # Keeps `IN` clauses under backend parameter limits
+QUEUE_BATCH_SIZE = 200  # Default number of queued responses ingested at once
 
 LOGGER = logging.getLogger('pcari')
 
 
-@decorator.decorator
-def profile(function, *args, **kwargs):
-    """
-    Log the runtime of a function call.
-
-    Args:
-        function: The callable to profile.
-        args: Additional positional arguments to ``function``.
-        kwargs: Additional keyword arguments to ``function``.
-
-    Returns:
-        The result of applying ``function`` to ``args`` and ``kwargs``.
-    """
-    start_time = time.time()
-    result = function(*args, **kwargs)
-    end_time = time.time()
-    time_elapsed = end_time - start_time
-    LOGGER.log(logging.DEBUG, 'Call to "%s" took %.3f seconds',
-               function.__name__, time_elapsed)
-    return result
-
-
 @profile
 def generate_ratings_matrix():
     """
@@ -158,7 +146,7 @@ def normalize_ratings_matrix(ratings_matrix):
 
 
 @profile
-def calculate_principal_components(normalized_ratings, num_components=2):
+def calculate_principal_components(normalized_ratings, num_components=2, engine=None):
     """
     Calculate the principal components of a normalized ratings matrix.
 
@@ -167,16 +155,105 @@ def calculate_principal_components(normalized_ratings, num_components=2):
             matrix (as provided by :func:`normalize_ratings_matrix`).
         num_components (int): The number of principal components to select
             (`p`).
+        engine (str): The name of the algorithm to use (see
+            :data:`pcari.analysis.PCA_ENGINES`). By default, the ``PCA_ENGINE``
+            setting is used.
 
     Returns:
         numpy.ndarray: A `p` by `n` matrix whose rows are principal components.
     """
-    _, _, covariance_matrix = np.linalg.svd(normalized_ratings, full_matrices=False)
-    return covariance_matrix[:num_components]
+    return get_pca_engine(engine)(normalized_ratings, num_components)
+
+
+@profile
+def sample_queryset(queryset, limit):
+    """
+    Select a uniformly random subset of the instances in a ``QuerySet``.
+
+    Only the primary keys of the candidates are fetched from the database, so
+    the cost of sampling does not depend on the size of each row.
+
+    Args:
+        queryset: The Django ``QuerySet`` to sample from.
+        limit (int): The maximum number of instances to select.
+
+    Returns:
+        list: At most ``limit`` distinct model instances. Instances deleted
+        while sampling are omitted.
+    """
+    primary_keys = list(queryset.values_list('pk', flat=True))
+    if len(primary_keys) > limit:
+        primary_keys = random.sample(primary_keys, max(limit, 0))
+
+    instances = {}
+    for start in range(0, len(primary_keys), SAMPLE_BATCH_SIZE):
+        batch = primary_keys[start:start + SAMPLE_BATCH_SIZE]
+        instances.update(queryset.model.objects.in_bulk(batch))
+    return [instances[primary_key] for primary_key in primary_keys
+            if primary_key in instances]
+
+
+RATINGS_MATRIX_STORE = RatingsMatrixStore(generate_ratings_matrix)
+PCA_SNAPSHOT_CACHE = PCASnapshotCache()
+
+
+@profile
+def compute_pca_snapshot(num_components=NUM_PRINCIPAL_COMPONENTS):
+    """
+    Calculate the principal components of the current ratings and save them.
+
+    Args:
+        num_components (int): The number of principal components to select
+            (`p`).
+
+    Returns:
+        The newly saved :class:`pcari.models.PCASnapshot`.
+    """
+    last_respondent_id = Respondent.objects.aggregate(Max('id'))['id__max']
+    respondent_id_map, question_id_map, ratings = RATINGS_MATRIX_STORE.get()
+    num_respondents, num_questions = ratings.shape
+
+    if ratings.size:
+        column_means = np.nanmean(ratings, axis=0)
+        normalized_ratings = normalize_ratings_matrix(ratings)
+        components = calculate_principal_components(normalized_ratings, num_components)
+    else:
+        column_means = np.zeros(num_questions)
+        normalized_ratings = np.zeros(ratings.shape)
+        components = np.zeros((num_components, num_questions))
+
+    snapshot = PCASnapshot(num_respondents=num_respondents,
+                           num_questions=num_questions,
+                           last_respondent_id=last_respondent_id or 0)
+    snapshot.arrays = {
+        'respondent_ids': np.array(sorted(respondent_id_map, key=respondent_id_map.get),
+                                   dtype=np.int64),
+        'question_ids': np.array(sorted(question_id_map, key=question_id_map.get),
+                                 dtype=np.int64),
+        'column_means': column_means,
+        'components': components,
+        'projections': normalized_ratings.dot(components.T),
+    }
+    snapshot.save()
+    LOGGER.log(logging.INFO, 'Computed %s of %d by %d ratings matrix',
+               snapshot, num_respondents, num_questions)
+    return snapshot
+
+
+def ensure_pca_snapshot(view):
+    """ Compute a PCA snapshot before a view (and its entity tag) if none exists. """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if PCA_SNAPSHOT_CACHE.get()[0] is None:
+            compute_pca_snapshot()
+        return view(request, *args, **kwargs)
+    return wrapper
 
 
 @profile
 @require_GET
+@ensure_pca_snapshot
+@conditional(get_comments_version)
 def fetch_comments(request):
     """
     Fetch a list of comments as JSON.
@@ -205,32 +282,48 @@ def fetch_comments(request):
         principal components of the question ratings dataset (from
         :func:`calculate_principal_components`). This property is a list
         containing two numbers: the first and second projections, respectively.
+        The components are read from the latest :class:`pcari.models.PCASnapshot`
+        rather than calculated on every request (a snapshot is only computed
+        here if none exists). Authors who responded after the snapshot was
+        computed are projected onto the snapshot's components on the fly.
+
+        The standard errors are computed from the score aggregates stored on
+        each comment, so the number of queries does not depend on the
+        ``limit``. If the client's copy is current, the response is instead
+        ``304 Not Modified`` (see :func:`pcari.payloads.conditional`).
     """
     try:
         limit = int(request.GET.get('limit', str(DEFAULT_COMMENT_LIMIT)))
     except ValueError as error:
         return HttpResponseBadRequest(str(error))
 
-    query = Comment.objects.filter(active=True, flagged=False)
-    comments = query.exclude(message='').all()
-    if len(comments) > limit:
-        comments = random.sample(comments, limit)
+    query = Comment.objects.filter(active=True, flagged=False).exclude(message='')
+    comments = sample_queryset(query, limit)
 
-    respondent_id_map, _, ratings = generate_ratings_matrix()
-    if ratings.size:
-        normalized_ratings = normalize_ratings_matrix(ratings)
-        components = calculate_principal_components(normalized_ratings, 2)
+    _, arrays, respondent_index_map = PCA_SNAPSHOT_CACHE.get()
+
+    positions = {}
+    new_respondent_ids = {comment.respondent_id for comment in comments
+                          if comment.respondent_id not in respondent_index_map}
+    if new_respondent_ids:
+        respondent_id_map, question_id_map, ratings = RATINGS_MATRIX_STORE.get()
+        new_respondent_ids = list(new_respondent_ids & set(respondent_id_map))
+        row_indices = [respondent_id_map[respondent_id]
+                       for respondent_id in new_respondent_ids]
+        projections = project_ratings(arrays, question_id_map, ratings[row_indices, :])
+        positions.update(zip(new_respondent_ids, projections))
 
     data = {}
     for comment in comments:
-        standard_error = comment.score_sem
-        row_index = respondent_id_map[comment.respondent.id]
-        position = [0, 0]
-        if ratings.size:
-            position = list(np.round(components.dot(normalized_ratings[row_index, :]), 3))
-
-        # Projects the ratings by this comment's author onto the first two
-        # principal components to generate the position (`pos`).
+        aggregates = comment.get_score_aggregates()
+        standard_error = Comment.calculate_score_sem(*aggregates)
+        respondent_id = comment.respondent_id
+        if respondent_id in respondent_index_map:
+            position = arrays['projections'][respondent_index_map[respondent_id]]
+        else:
+            position = positions.get(respondent_id, np.zeros(NUM_PRINCIPAL_COMPONENTS))
+        position = list(np.round(position, 3))
+
         if math.isnan(standard_error):
             standard_error = DEFAULT_STANDARD_ERROR
         data[str(comment.id)] = {
@@ -244,13 +337,9 @@ def fetch_comments(request):
     return JsonResponse(data)
 
 
-def translate(text, language_code):
-    translation.activate(language_code)
-    return ugettext(text)
-
-
 @profile
 @require_GET
+@conditional(get_question_version(QualitativeQuestion))
 def fetch_qualitative_questions(request):
     """
     Fetch qualitative question data as JSON.
@@ -269,19 +358,19 @@ def fetch_qualitative_questions(request):
                 ...
             }
 
-        Each language code is obtained from ``settings.LANGUAGES``.
+        Each language code is obtained from ``settings.LANGUAGES``. The
+        payload is rendered once and served from the cache until a question
+        or translation changes (see :mod:`pcari.payloads`), and is not sent
+        again to clients whose copy is current.
     """
     # pylint: disable=unused-argument
-    return JsonResponse({
-        str(question.id): {
-            code: translate(question.prompt, code)
-            for code, _ in settings.LANGUAGES
-        } for question in QualitativeQuestion.objects.filter(active=True)
-    })
+    return HttpResponse(get_question_payload(QualitativeQuestion, request).content,
+                        content_type='application/json')
 
 
 @profile
 @require_GET
+@conditional(get_question_version(QuantitativeQuestion))
 def fetch_quantitative_questions(request):
     """
     Fetch quantitative question data as JSON.
@@ -313,38 +402,28 @@ def fetch_quantitative_questions(request):
                 ...
             }
 
-        Each language code is obtained from ``settings.LANGUAGES``.
+        Each language code is obtained from ``settings.LANGUAGES``. The
+        payload is rendered once and served from the cache until a question
+        or translation changes (see :mod:`pcari.payloads`), and is not sent
+        again to clients whose copy is current.
     """
     # pylint: disable=unused-argument
-    return JsonResponse({
-        str(question.id): {
-            'prompts': {
-                code: translate(question.prompt, code)
-                for code, _ in settings.LANGUAGES
-            },
-            'left-anchors': {
-                code: translate(question.left_anchor, code)
-                for code, _ in settings.LANGUAGES
-            },
-            'right-anchors': {
-                code: translate(question.right_anchor, code)
-                for code, _ in settings.LANGUAGES
-            },
-            'min-score': question.min_score,
-            'max-score': question.max_score,
-            'input-type': question.input_type,
-        } for question in QuantitativeQuestion.objects.filter(active=True)
-    })
+    return HttpResponse(get_question_payload(QuantitativeQuestion, request).content,
+                        content_type='application/json')
 
 
 @profile
 @require_GET
+@conditional(get_question_ratings_version)
 def fetch_question_ratings(request):
     """
     Fetch quantitative question ratings as JSON.
 
     Args:
-        request: This parameter is ignored.
+        request: May contain an ``after`` GET parameter (the ``X-Next-Cursor``
+            header of the previous page), a ``limit`` GET parameter (at most
+            ``settings.RATINGS_PAGE_SIZE``), and ``format=ndjson``. Without
+            ``after`` or ``limit``, every rating is streamed.
 
     Returns:
         A ``JsonResponse`` containing a JSON object of the form::
@@ -356,16 +435,56 @@ def fetch_question_ratings(request):
                 },
                 ...
             }
+
+        If a page is requested and more ratings remain, the ``X-Next-Cursor``
+        header is set. With
+        ``format=ndjson``, every remaining rating is instead streamed as one
+        object per line (see :mod:`pcari.payloads`). If the client's copy is
+        current, the response is ``304 Not Modified``.
+    """
+    try:
+        after = int(request.GET.get('after', '0'))
+        limit = int(request.GET['limit']) if 'limit' in request.GET else None
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    if request.GET.get('format') == 'ndjson':
+        return StreamingHttpResponse(generate_question_ratings_ndjson(after),
+                                     content_type='application/x-ndjson')
+    if 'after' not in request.GET and limit is None:
+        return StreamingHttpResponse(generate_question_ratings_json(),
+                                     content_type='application/json')
+    page, next_cursor = render_question_ratings_page(after, limit)
+    response = JsonResponse(page)
+    if next_cursor is not None:
+        response['X-Next-Cursor'] = next_cursor
+    return response
+
+
+@profile
+@require_GET
+@conditional(get_question_ratings_version)
+def fetch_question_histograms(request):
+    """
+    Fetch the number of ratings of each quantitative question by score, which
+    (unlike :func:`fetch_question_ratings`) does not grow with the number of
+    ratings.
+
+    Args:
+        request: This parameter is ignored.
+
+    Returns:
+        A ``JsonResponse`` containing a JSON object of the form::
+
+            {
+                "<question.id>": {
+                    "<score>": <number of ratings with this score>,
+                    ...
+                },
+                ...
+            }
     """
     # pylint: disable=unused-argument
-    ratings = QuantitativeQuestionRating.objects
-    ratings = ratings.filter(active=True, question__active=True)
-    return JsonResponse({
-        str(rating.id): {
-            'qid': rating.question_id,
-            'score': rating.score,
-        } for rating in ratings
-    })
+    return JsonResponse(render_question_histograms())
 
 
 @profile
@@ -403,9 +522,254 @@ def make_respondent_data(respondent, responses):
         if serialized_name in respondent_data:
             setattr(respondent, attribute, respondent_data[serialized_name])
     respondent.language = respondent_data['language']
+    respondent.response_key = responses.get('response-key')
     yield respondent
 
 
+# Errors indicating that a submitted response is malformed or invalid
+RESPONSE_ERRORS = (KeyError, ValueError, TypeError, AttributeError,
+                   ObjectDoesNotExist, ValidationError, IntegrityError)
+
+# Each model generator is paired with the name of the foreign key (other than
+# the respondent) whose targets must exist. Instances are written in this order.
+RESPONSE_MODEL_GENERATORS = [
+    (make_question_ratings, 'question'),
+    (make_comments, 'question'),
+    (make_comment_ratings, 'comment'),
+]
+
+
+@profile
+def attach_related_instances(instances, field_name):
+    """
+    Fetch the objects that the given instances refer to with a single query
+    and cache them on the instances, so that validation does not need to fetch
+    each object separately.
+
+    Args:
+        instances (list): Unsaved instances of the same model.
+        field_name (str): The name of a foreign key of that model.
+
+    Raises:
+        ObjectDoesNotExist: if some instance refers to a nonexistent object.
+    """
+    if not instances:
+        return
+    field = instances[0]._meta.get_field(field_name)
+    primary_keys = {getattr(instance, field.attname) for instance in instances}
+    related_instances = field.related_model.objects.in_bulk(list(primary_keys))
+    for instance in instances:
+        primary_key = getattr(instance, field.attname)
+        if primary_key not in related_instances:
+            template = '{0} with ID {1} does not exist'
+            raise field.related_model.DoesNotExist(
+                template.format(field.related_model.__name__, primary_key))
+        setattr(instance, field_name, related_instances[primary_key])
+
+
+@profile
+def make_response_instances(responses):
+    """
+    Make and validate (but do not save) the model instances described by a
+    single user's responses.
+
+    Args:
+        responses (dict): The deserialized responses (see
+            :func:`save_response` for the format).
+
+    Returns:
+        A tuple of two items: the unsaved ``Respondent`` and a list of lists
+        of unsaved instances, one list per model, in the order they should be
+        written.
+
+    Raises:
+        KeyError, ValueError, AttributeError, ObjectDoesNotExist,
+        ValidationError: if the responses are malformed or invalid.
+    """
+    respondent = Respondent()
+    list(make_respondent_data(respondent, responses))
+    respondent.full_clean()
+
+    instance_groups = []
+    for model_generator, field_name in RESPONSE_MODEL_GENERATORS:
+        instances = list(model_generator(respondent, responses))
+        attach_related_instances(instances, field_name)
+        for instance in instances:
+            # Foreign keys have already been checked in bulk, and the
+            # respondent does not yet exist
+            instance.full_clean(exclude=['respondent', field_name])
+        instance_groups.append(instances)
+    return respondent, instance_groups
+
+
+@profile
+def write_response_batch(batch):
+    """
+    Write respondents and their responses to the database in one transaction,
+    with one ``INSERT`` per respondent and one per response model.
+
+    Args:
+        batch (list): Pairs of an unsaved ``Respondent`` and lists of unsaved
+            instances, as returned by :func:`make_response_instances`.
+
+    Raises:
+        IntegrityError: if the database rejects some instance (for example,
+            because an object it refers to has since been deleted). No
+            instances are written in that case.
+    """
+    instances_by_model = collections.OrderedDict()
+    with transaction.atomic():
+        for respondent, instance_groups in batch:
+            respondent.save()
+            for instances in instance_groups:
+                for instance in instances:
+                    instance.respondent = respondent
+                    instances_by_model.setdefault(instance.__class__, []).append(instance)
+
+        for model, instances in instances_by_model.items():
+            model.objects.bulk_create(instances)
+            LOGGER.log(logging.DEBUG, 'Saved %d instances of %s',
+                       len(instances), model.__name__)
+
+
+@profile
+def ingest_response(responses):
+    """
+    Validate and write a single user's responses, unless a response with the
+    same response key has already been saved.
+
+    Args:
+        responses (dict): The deserialized responses (see
+            :func:`save_response` for the format).
+
+    Returns:
+        bool: `True` if the responses were written, or `False` if they were
+        a duplicate of responses already saved.
+
+    Raises:
+        KeyError, ValueError, TypeError, AttributeError, ObjectDoesNotExist,
+        ValidationError, IntegrityError: if the responses are malformed or
+        invalid.
+    """
+    response_key = responses.get('response-key')
+    respondents = Respondent.objects.filter(response_key=response_key)
+    if response_key is not None and respondents.exists():
+        LOGGER.log(logging.INFO, 'Ignored duplicate response "%s"', response_key)
+        return False
+
+    respondent, instance_groups = make_response_instances(responses)
+    try:
+        write_response_batch([(respondent, instance_groups)])
+    except IntegrityError:
+        # A concurrent request with the same key may have been written first
+        if response_key is not None and respondents.exists():
+            LOGGER.log(logging.INFO, 'Ignored duplicate response "%s"', response_key)
+            return False
+        raise
+    return True
+
+
+@profile
+def enqueue_responses(batch):
+    """
+    Store responses in the queue to be ingested later by
+    :func:`process_queued_responses`.
+
+    Only the shape of each response is checked here. Validation is deferred
+    until the response is ingested.
+
+    Args:
+        batch (list): Deserialized responses (see :func:`save_response` for the
+            format).
+
+    Raises:
+        ValueError: if some response is not a JSON object. No responses are
+            queued in that case.
+    """
+    if not all(isinstance(responses, dict) for responses in batch):
+        raise ValueError('Expected a response object')
+    QueuedResponse.objects.bulk_create([
+        QueuedResponse(payload=json.dumps(responses)) for responses in batch
+    ])
+
+
+def mark_queued_responses_failed(queued_responses):
+    """ Record that the given queued responses could not be ingested. """
+    for queued_response in queued_responses:
+        queued_response.failed = True
+        queued_response.save(update_fields=['failed', 'error'])
+        LOGGER.log(logging.ERROR, 'Failed to ingest %s: %s', queued_response,
+                   queued_response.error)
+
+
+@profile
+@transaction.atomic
+def process_queued_responses(batch_size=QUEUE_BATCH_SIZE):
+    """
+    Ingest the oldest queued responses.
+
+    The batch stays locked until it is ingested, so concurrent workers never
+    ingest the same responses. (Where the database supports it, other workers
+    skip the locked responses instead of waiting for them.) All valid
+    responses in the batch are written together with
+    :func:`write_response_batch`. Should the batch be rejected by the database,
+    the responses are instead ingested one at a time, so that a single bad
+    response cannot block the queue.
+
+    Args:
+        batch_size (int): The maximum number of queued responses to ingest.
+
+    Returns:
+        A tuple of two items: the number of responses ingested (including
+        duplicates of responses already saved) and the number of responses
+        that failed to be ingested.
+    """
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    queued_responses = QueuedResponse.objects.filter(failed=False).order_by('id')
+    queued_responses = list(queued_responses.select_for_update(skip_locked=skip_locked)
+                            [:batch_size])
+    payloads = [json.loads(queued_response.payload)
+                for queued_response in queued_responses]
+
+    response_keys = [responses.get('response-key') for responses in payloads]
+    respondents = Respondent.objects.filter(response_key__in=filter(None, response_keys))
+    saved_keys = set(respondents.values_list('response_key', flat=True))
+
+    batch, ingested, failed = [], [], []
+    for queued_response, responses, response_key in zip(queued_responses, payloads,
+                                                        response_keys):
+        if response_key is None or response_key not in saved_keys:
+            try:
+                batch.append(make_response_instances(responses))
+            except RESPONSE_ERRORS as error:
+                queued_response.error = str(error)
+                failed.append(queued_response)
+                continue
+            saved_keys.add(response_key)
+        ingested.append(queued_response)
+
+    try:
+        with transaction.atomic():
+            write_response_batch(batch)
+            QueuedResponse.objects.filter(id__in=[
+                queued_response.id for queued_response in ingested
+            ]).delete()
+    except IntegrityError as error:
+        LOGGER.log(logging.WARNING, 'Ingesting responses one at a time: %s', error)
+        for queued_response in list(ingested):
+            try:
+                with transaction.atomic():
+                    ingest_response(json.loads(queued_response.payload))
+                    queued_response.delete()
+            except RESPONSE_ERRORS as error:
+                queued_response.error = str(error)
+                ingested.remove(queued_response)
+                failed.append(queued_response)
+
+    mark_queued_responses_failed(failed)
+    return len(ingested), len(failed)
+
+
 @profile
 @require_POST
 def save_response(request):
@@ -435,9 +799,18 @@ def save_response(request):
                 "language": "<language-code>",
                 "submitted-personal-data": <bool>,
                 "completed-survey": <bool>
-            }
+            },
+            "response-key": "<key>"
         }
 
+    The optional ``response-key`` is a unique string generated by the client
+    for each response. Clients may safely resubmit a response with a key,
+    since a response whose key has already been saved is acknowledged without
+    being written again.
+
+    All instances are validated before any are written, and are then written
+    in a single transaction with one ``INSERT`` per model.
+
     Args:
         request: This parameter is ignored (the data should arrive in the body
             of the request).
@@ -451,125 +824,94 @@ def save_response(request):
         question, or malformed JSON). In that case, no new instances are
         written to the database, and the client should not send another request
         without modifications to the payload.
-    """
-    respondent = Respondent()
-    respondent.save()
 
+        If the ``RESPONSE_QUEUE_ENABLED`` setting is true, the response is
+        queued (see :func:`enqueue_responses`) and a ``HttpResponse`` with a
+        status code of 202 is returned instead of 200. In that case, the 400
+        response is only returned if the body is not a JSON object.
+    """
     try:
         responses = json.loads(request.body)
-        model_instances = []
-
-        model_generator_functions = [
-            make_respondent_data,
-            make_question_ratings,
-            make_comments,
-            make_comment_ratings,
-        ]
-
-        for model_generator in model_generator_functions:
-            model_instances.extend(model_generator(respondent, responses))
-
-        for instance in model_instances:
-            instance.full_clean()
-    except (KeyError, ValueError, AttributeError, ObjectDoesNotExist,
-            ValidationError) as error:
-        respondent.delete()
+        if getattr(settings, 'RESPONSE_QUEUE_ENABLED', False):
+            enqueue_responses([responses])
+            return HttpResponse(status=202)
+        ingest_response(responses)
+    except RESPONSE_ERRORS as error:
         LOGGER.log(logging.ERROR, error)
         return HttpResponseBadRequest(str(error))
-
-    for instance in model_instances:
-        instance.save()
-        LOGGER.log(logging.DEBUG, 'Saved instance %s', instance)
     return HttpResponse()
 
 
 @profile
-def export_csv(stream, queryset):
-    """
-    Export the given ``QuerySet`` as comma-separated values to a stream.
-
-    Args:
-        stream: A ``file``-like object with a ``write`` method.
-        queryset: A Django ``QuerySet`` of instances to export.
-
-    Returns:
-        `None`. Has a side effect of writing to the ``stream``.
+@require_POST
+def save_responses(request):
     """
-    concrete_fields = get_concrete_fields(queryset.model)
-    field_names = [unicode(field.get_attname()) for field in concrete_fields]
-
-    writer = csv.writer(stream, encoding='utf-8')
-    writer.writerow(field_names)
+    Write the responses of many users to the database in a single request.
 
-    for instance in queryset.iterator():
-        row = [getattr(instance, field_name) for field_name in field_names]
-        row = [unicode(cell) if cell is not None else '' for cell in row]
-        writer.writerow(row)
-
-
-@profile
-def export_excel(stream, queryset):
-    """
-    Export the given ``QuerySet`` as an Excel spreadsheet.
+    Clients that queue responses while offline should use this endpoint to
+    submit their backlog all at once. The request body should contain a JSON
+    array of response objects, each of the form accepted by
+    :func:`save_response`. All responses are written in one transaction, but
+    each is validated and written independently, so that an invalid response
+    does not prevent the others from being saved.
 
     Args:
-        stream: A ``file``-like object with a ``write`` method.
-        queryset: A Django ``QuerySet`` of instances to export.
+        request: This parameter is ignored (the data should arrive in the body
+            of the request).
 
     Returns:
-        `None`. Has a side effect of writing to the ``stream``.
-    """
-    concrete_fields = get_concrete_fields(queryset.model)
-    field_names = [unicode(field.get_attname()) for field in concrete_fields]
-
-    workbook = Workbook(write_only=True)
-    worksheet = workbook.create_sheet(queryset.model.__name__)
-    worksheet.append(field_names)
-
-    for instance in queryset.iterator():
-        row = [getattr(instance, field_name) for field_name in field_names]
-        worksheet.append(row)
-
-    workbook.save(stream)
-
-
-def generate_export_filename(model_name, data_format):
-    now = datetime.datetime.now()
-    return model_name + '-' + now.strftime('%Y-%m-%d') + '.' + data_format
-
+        A ``JsonResponse`` containing a JSON object of the form::
 
-@profile
-def export_data(queryset, data_format='csv'):
-    """
-    Create and write data to a response as a file for download.
+            {
+                "results": [
+                    {"saved": true},
+                    {"saved": false, "error": "<message>"},
+                    ...
+                ]
+            }
 
-    Args:
-        data_format (str): The file format the data should be exported as.
-            Current options are: ``csv`` (default), ``xlsx``.
-        queryset: The instances to export.
+        where the ``results`` correspond to the submitted responses, in order.
+        (Duplicates of responses already saved are reported as saved.) A
+        response that was not saved should not be submitted again without
+        modifications. If the body is not a JSON array, a
+        ``HttpResponseBadRequest`` with a status code of 400 is returned
+        instead, and nothing is saved.
 
-    Returns:
-        An ``HttpResponse`` with the requested data as an attached file, or an
-        ``HttpResponseBadRequest`` with a status code of 400 with an invalid
-        ``data_format``.
+        If the ``RESPONSE_QUEUE_ENABLED`` setting is true, every response that
+        is a JSON object is queued and reported as saved, and the status code
+        is 202 instead of 200.
     """
-    export_functions = {
-        'csv': export_csv,
-        'xlsx': export_excel,
-    }
     try:
-        export = export_functions[data_format]
-    except KeyError:
-        return HttpResponseBadRequest('no such data format "{0}"'.format(data_format))
-
-    model_name = queryset.model.__name__
-    filename = generate_export_filename(model_name, data_format)
-    content_type, _ = mimetypes.guess_type(filename)
+        batch = json.loads(request.body)
+        if not isinstance(batch, list):
+            raise ValueError('Expected an array of responses')
+    except ValueError as error:
+        LOGGER.log(logging.ERROR, error)
+        return HttpResponseBadRequest(str(error))
 
-    response = HttpResponse(content_type=content_type)
-    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(filename)
-    export(response, queryset)
-    return response
+    if getattr(settings, 'RESPONSE_QUEUE_ENABLED', False):
+        enqueue_responses([responses for responses in batch
+                           if isinstance(responses, dict)])
+        return JsonResponse({'results': [
+            {'saved': True} if isinstance(responses, dict)
+            else {'saved': False, 'error': 'Expected a response object'}
+            for responses in batch
+        ]}, status=202)
+
+    results = []
+    with transaction.atomic():
+        for responses in batch:
+            try:
+                # Written in a savepoint, which is rolled back on failure
+                ingest_response(responses)
+            except RESPONSE_ERRORS as error:
+                LOGGER.log(logging.ERROR, error)
+                results.append({'saved': False, 'error': str(error)})
+            else:
+                results.append({'saved': True})
+    LOGGER.log(logging.INFO, 'Saved %d of %d responses in batch',
+               sum(result['saved'] for result in results), len(results))
+    return JsonResponse({'results': results})
 
 
 @profile